@@ -0,0 +1,16 @@
+from django.conf import settings
+
+
+def pytest_configure():
+    if not settings.configured:
+        settings.configure(
+            API_BASE_URL="http://trs-api.test",
+            HEALTH_CHECK_TOKEN="health-check-token",
+            ENVIRONMENT_KEY="test",
+            FILE_MAX_SIZE_BYTES=30 * 1024 * 1024,
+            CACHES={
+                "default": {
+                    "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                },
+            },
+        )
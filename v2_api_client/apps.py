@@ -0,0 +1,16 @@
+import threading
+
+from django.apps import AppConfig
+from django.conf import settings
+
+
+class V2APIClientConfig(AppConfig):
+    name = "v2_api_client"
+    verbose_name = "TRS V2 API client"
+
+    def ready(self):
+        if getattr(settings, "API_WARMUP_ON_STARTUP", False):
+            from v2_api_client.warmup import warm_up
+
+            # don't hold up startup, the first requests benefit from whatever has been done
+            threading.Thread(target=warm_up, name="api-client-warmup", daemon=True).start()
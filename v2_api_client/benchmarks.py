@@ -0,0 +1,357 @@
+"""End-to-end benchmarks for the hot paths of the API client, run against the mock API server.
+
+These aren't collected by pytest, run them directly, e.g.
+
+python -m v2_api_client.benchmarks run --output before.json
+python -m v2_api_client.benchmarks run --output after.json
+python -m v2_api_client.benchmarks compare before.json after.json
+python -m v2_api_client.benchmarks run --only get_many_1000 --only refresh
+
+The mock API server runs in its own process, so its time spent encoding responses isn't
+counted against the client. The data it serves is generated from a fixed seed, and gzipped for
+clients that accept it, as they all do by default, see v2_api_client.compression. The
+get_many_<size>_<encoding> benchmarks report the bytes on the wire for each encoding, and the
+decompress_<size>_<encoding> ones the cost of decoding them.
+"""
+import argparse
+import gzip
+import json
+import multiprocessing
+import statistics
+import sys
+import time
+import tracemalloc
+
+from django.conf import settings
+from dotwiz import DotWiz
+
+from v2_api_client.shared import benchmarking
+from v2_api_client.shared.benchmarking import percentile
+
+LIST_SIZES = (10, 1000, 50000)
+CONCURRENT_FETCHES = 20
+CREATED_AT = "2023-03-21T13:23:20.123456Z"
+
+
+def configure_settings(api_base_url: str) -> None:
+    """Configures the minimal Django settings the client needs, when run as a script."""
+    if not settings.configured:
+        settings.configure(
+            HEALTH_CHECK_TOKEN="benchmark",
+            ENVIRONMENT_KEY="benchmark",
+            API_BASE_URL=api_base_url,
+        )
+    settings.API_BASE_URL = api_base_url
+
+
+def case_data(index: int, batch: int = None) -> dict:
+    """A case shaped like the API's full case serializer, nested objects, lists and datetimes."""
+    return {
+        "name": f"Synthetic case {index}",
+        "reference": f"TD{index:04}",
+        "batch": batch,
+        "archived": False,
+        "created_at": CREATED_AT,
+        "last_modified": CREATED_AT,
+        "type": {"id": 1, "name": "Anti-dumping investigation", "acronym": "AD"},
+        "stage": {"id": 2, "name": "Case initiated", "created_at": CREATED_AT},
+        "organisations": [
+            {"id": index * 10 + each, "name": f"Organisation {each}", "created_at": CREATED_AT}
+            for each in range(3)
+        ],
+    }
+
+
+def populate(server, list_sizes=LIST_SIZES) -> list:
+    """Seeds a MockAPIServer with the data the benchmarks use, returns the IDs of the
+    organisations."""
+    for size in list_sizes:
+        server.generate("cases", size, lambda index, size=size: case_data(index, batch=size))
+    organisations = server.generate("organisations", CONCURRENT_FETCHES)
+    server.add_action(
+        "organisations",
+        "get_organisation_card_data",
+        lambda method, obj, data, query: {**obj, "cases": [case_data(0)]},
+    )
+    return [each["id"] for each in organisations]
+
+
+def serve_mock_api(list_sizes, latency, ready, stop) -> None:
+    """Runs a populated MockAPIServer until stop is set, in a separate process."""
+    from v2_api_client.mock_api import MockAPIServer
+
+    with MockAPIServer(latency=latency, compress_responses=True) as server:
+        organisation_ids = populate(server, list_sizes)
+        ready.put((server.url, organisation_ids))
+        stop.wait()
+
+
+def run_benchmark(
+    function,
+    setup=None,
+    min_time: float = 1.0,
+    min_iterations: int = 3,
+    max_iterations: int = 100000,
+    warmup: int = 1,
+    allocation_iterations: int = 1,
+) -> dict:
+    """Calls function until it has run for min_time seconds (and at least min_iterations times).
+
+    setup() is called before each call, outside the timings, and returns the args for function.
+    The peak allocations, and the memory still held by what function returns, are measured
+    afterwards, over allocation_iterations calls with tracemalloc, so tracing doesn't slow the
+    timings.
+    """
+    setup = setup or tuple
+    for _ in range(warmup):
+        function(*setup())
+
+    latencies = []
+    while len(latencies) < max_iterations and (
+        len(latencies) < min_iterations or sum(latencies) < min_time
+    ):
+        args = setup()
+        start = time.perf_counter()
+        function(*args)
+        latencies.append(time.perf_counter() - start)
+
+    allocations = []
+    retained = []
+    tracemalloc.start()
+    try:
+        for _ in range(allocation_iterations):
+            args = setup()
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            result = function(*args)
+            current, peak = tracemalloc.get_traced_memory()
+            allocations.append(peak - before)
+            retained.append(current - before)
+            del result
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "iterations": len(latencies),
+        "ops_per_second": len(latencies) / sum(latencies),
+        "p50_us": percentile(latencies, 50) * 1_000_000,
+        "p90_us": percentile(latencies, 90) * 1_000_000,
+        "p99_us": percentile(latencies, 99) * 1_000_000,
+        "mean_us": statistics.mean(latencies) * 1_000_000,
+        "peak_allocated_bytes": max(allocations),
+        "retained_bytes": max(retained),
+    }
+
+
+def get_compression_benchmarks(size: int) -> dict:
+    """Benchmarks retrieving (and decompressing) a list of size cases with and without
+    compression. The API must already be populated, and compress its responses."""
+    from urllib3.response import _get_decoder
+
+    from v2_api_client.client import TRSAPIClient
+
+    benchmarks = {}
+    for encoding in ("identity", "gzip"):
+        client = TRSAPIClient(token="benchmark")
+        client.cases.get_session().headers["Accept-Encoding"] = encoding
+        url = client.cases.url("cases", filter_parameters={"batch": size})
+        response = client.cases.get_session().get(url)
+        # the bytes read from the socket, before they are decoded
+        wire_bytes = response.raw.tell()
+        benchmarks[f"get_many_{size}_{encoding}"] = (
+            lambda client=client, url=url: client.cases._get_many(url),
+            None,
+            {"wire_bytes": wire_bytes, "content_bytes": len(response.content)},
+        )
+        if encoding != "identity":
+            body = gzip.compress(response.content, compresslevel=6)
+            benchmarks[f"decompress_{size}_{encoding}"] = (
+                # the decoder urllib3 uses for the responses
+                lambda body=body, encoding=encoding: _get_decoder(encoding).decompress(body),
+                None,
+            )
+    return benchmarks
+
+
+def get_benchmarks(organisation_ids: list, list_sizes=LIST_SIZES) -> dict:
+    """Returns {name: (function, setup)}, or {name: (function, setup, extra results)}, the API
+    must already be populated."""
+    from v2_api_client.client import TRSAPIClient
+    from v2_api_client.library import BaseAPIClient
+    from v2_api_client.trs_object import TRSObject
+
+    client = TRSAPIClient(token="benchmark")
+    case = client.cases._get_many(
+        client.cases.url("cases", filter_parameters={"batch": list_sizes[0]})
+    )[0]
+
+    def build_url():
+        BaseAPIClient.url(
+            "cases",
+            fields=["id", "name", "reference"],
+            params={"open_to_roi": True},
+            filter_parameters={"archived": False, "type": 1},
+            slim=True,
+        )
+
+    def access_attributes():
+        case.name, case["reference"], case.type.name, case.organisations[0].name
+
+    # the footprint of the TRSObjects alone, without any data, for a list of the largest size
+    object_ids = [f"{index:032x}" for index in range(max(list_sizes))]
+
+    def make_lazy_objects():
+        return [client.cases.make_trs_object(object_id, lazy=True) for object_id in object_ids]
+
+    benchmarks = {
+        "client_construction": (lambda: TRSAPIClient(token="benchmark"), None),
+        "url_building": (build_url, None),
+    }
+    for size in list_sizes:
+        url = client.cases.url("cases", filter_parameters={"batch": size})
+        benchmarks[f"get_many_{size}"] = (lambda url=url: client.cases._get_many(url), None)
+    benchmarks.update(
+        {
+            "attribute_access": (access_attributes, None),
+            "encode_nested_dict": (
+                TRSObject.encode_nested_dict,
+                lambda: (case, DotWiz(case_data(0))),
+            ),
+            "get_concurrently": (
+                lambda: client.organisations.get_organisation_cards(*organisation_ids),
+                None,
+            ),
+            "refresh": (case.refresh, None),
+            f"lazy_objects_{len(object_ids)}": (make_lazy_objects, None),
+        }
+    )
+    # a mid-sized list, the largest takes too long to run several times
+    benchmarks.update(get_compression_benchmarks(sorted(list_sizes)[len(list_sizes) // 2]))
+    return benchmarks
+
+
+def run_benchmarks(
+    organisation_ids: list, list_sizes=LIST_SIZES, only: list = None, **kwargs
+) -> dict:
+    results = {}
+    for name, (function, setup, *extra) in get_benchmarks(organisation_ids, list_sizes).items():
+        if only and name not in only:
+            continue
+        results[name] = run_benchmark(function, setup, **kwargs)
+        if extra:
+            results[name].update(extra[0])
+    return results
+
+
+def print_results(results: dict) -> None:
+    print(
+        f"{'benchmark':<22}{'ops/s':>12}{'p50 (us)':>12}{'p90 (us)':>12}{'p99 (us)':>12}"
+        f"{'peak alloc (KB)':>17}{'retained (KB)':>15}"
+    )
+    for name, result in results.items():
+        print(
+            f"{name:<22}{result['ops_per_second']:>12.1f}{result['p50_us']:>12.1f}"
+            f"{result['p90_us']:>12.1f}{result['p99_us']:>12.1f}"
+            f"{result['peak_allocated_bytes'] / 1024:>17.1f}"
+            f"{result['retained_bytes'] / 1024:>15.1f}"
+        )
+    for name, result in results.items():
+        if "wire_bytes" in result:
+            print(
+                f"{name}: {result['wire_bytes'] / 1024:.1f}KB on the wire for "
+                f"{result['content_bytes'] / 1024:.1f}KB of JSON"
+            )
+
+
+# (metric, True if bigger is better)
+COMPARED_METRICS = (
+    ("ops_per_second", True),
+    ("p50_us", False),
+    ("p99_us", False),
+    ("peak_allocated_bytes", False),
+    ("retained_bytes", False),
+    ("wire_bytes", False),
+)
+
+
+def compare_results(baseline: dict, current: dict, threshold: float = 0.1) -> list:
+    """Compares two runs of the benchmarks.
+
+    Returns a list of regression messages, a regression is when throughput drops, or latency or
+    allocations grow, by more than threshold (a fraction).
+    """
+    return benchmarking.compare_results(baseline, current, COMPARED_METRICS, threshold)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument(
+        "--list-sizes",
+        type=lambda value: tuple(int(size) for size in value.split(",")),
+        default=LIST_SIZES,
+        help="comma separated sizes of the lists retrieved by the get_many benchmarks",
+    )
+    run_parser.add_argument(
+        "--latency", type=float, default=0, help="seconds the mock API adds to each response"
+    )
+    run_parser.add_argument("--min-time", type=float, default=1.0)
+    run_parser.add_argument("--min-iterations", type=int, default=3)
+    run_parser.add_argument(
+        "--only", action="append", help="only run this benchmark, can be repeated"
+    )
+    run_parser.add_argument("--output", help="save the results as JSON to this file")
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="compare two saved runs, exits with 1 if there are regressions"
+    )
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument(
+        "--threshold", type=float, default=0.1, help="the allowed change, 0.1 is 10%%"
+    )
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        context = multiprocessing.get_context("spawn")
+        ready, stop = context.Queue(), context.Event()
+        server = context.Process(
+            target=serve_mock_api, args=(args.list_sizes, args.latency, ready, stop)
+        )
+        server.start()
+        try:
+            api_base_url, organisation_ids = ready.get(timeout=120)
+            configure_settings(api_base_url)
+            results = run_benchmarks(
+                organisation_ids,
+                args.list_sizes,
+                only=args.only,
+                min_time=args.min_time,
+                min_iterations=args.min_iterations,
+            )
+        finally:
+            stop.set()
+            server.join()
+        print_results(results)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(
+                    {"arguments": vars(args), "python": sys.version, "results": results},
+                    f,
+                    indent=2,
+                )
+    elif args.command == "compare":
+        with open(args.baseline) as baseline, open(args.current) as current:
+            regressions = compare_results(
+                json.load(baseline), json.load(current), threshold=args.threshold
+            )
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
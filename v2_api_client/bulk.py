@@ -0,0 +1,116 @@
+"""Runs many writes at once, see BaseAPIClient.bulk_create(), bulk_update() and bulk_delete().
+
+Each item is written independently, a failure is recorded against its BulkItemResult rather than
+aborting the rest of the batch:
+
+results = client.contacts.bulk_create([{"name": "..."}, {"name": "..."}])
+for failure in results.failed:
+    failure.index, failure.field_errors --> {"email": ["Enter a valid email address."]}
+"""
+from __future__ import annotations
+
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable
+
+from django.conf import settings
+
+from v2_api_client.exceptions import InvalidSerializerError
+
+
+class BulkItemResult:
+    """The outcome of writing a single item, index is its position in the input."""
+
+    def __init__(self, index: int, item, result=None, exception: Exception = None):
+        self.index = index
+        self.item = item
+        self.result = result
+        self.exception = exception
+
+    @property
+    def ok(self) -> bool:
+        return self.exception is None
+
+    @property
+    def field_errors(self) -> dict:
+        """The validation errors returned by the API, if the item was invalid."""
+        if isinstance(self.exception, InvalidSerializerError):
+            return self.exception.field_errors
+        return {}
+
+    def __repr__(self):
+        if self.ok:
+            return f"BulkItemResult({self.index}, ok)"
+        return f"BulkItemResult({self.index}, {self.exception!r})"
+
+
+class BulkResults(list):
+    """A list of BulkItemResult, in the same order as the input."""
+
+    @property
+    def succeeded(self) -> list[BulkItemResult]:
+        return [each for each in self if each.ok]
+
+    @property
+    def failed(self) -> list[BulkItemResult]:
+        return [each for each in self if not each.ok]
+
+    @property
+    def results(self) -> list:
+        """The results of the items that succeeded, e.g. the created TRSObjects."""
+        return [each.result for each in self if each.ok]
+
+
+def get_max_workers(max_workers: int = None) -> int:
+    """The number of concurrent writes, defaults to the API_BULK_MAX_WORKERS setting (5)."""
+    if max_workers is None:
+        max_workers = getattr(settings, "API_BULK_MAX_WORKERS", 5)
+    return max(1, max_workers)
+
+
+def run_bulk(function: Callable, items: Iterable, max_workers: int = None) -> BulkResults:
+    """Calls function(item) for every item, at most max_workers at a time, and returns their
+    BulkResults. Any exception raised is recorded against its item."""
+    items = list(items)
+    results = BulkResults(BulkItemResult(index, item) for index, item in enumerate(items))
+    if not items:
+        return results
+
+    def run(result: BulkItemResult):
+        try:
+            result.result = function(result.item)
+        except Exception as exc:
+            result.exception = exc
+
+    max_workers = min(get_max_workers(max_workers), len(items))
+    if max_workers == 1:
+        for result in results:
+            run(result)
+        return results
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # each call runs in a copy of the current context, so context-local state (e.g. the
+        # APICallTracker of the current request) follows it into the worker thread
+        futures = [
+            executor.submit(contextvars.copy_context().run, run, result) for result in results
+        ]
+        for future in futures:
+            future.result()
+    return results
+
+
+def run_bulk_batches(
+    function: Callable, items: Iterable, batch_size: int, max_workers: int = None
+) -> BulkResults:
+    """Calls function(batch) for batches of batch_size items, function returns a result per item
+    in the batch. A batch that fails fails every item in it."""
+    items = list(items)
+    batches = [items[start : start + batch_size] for start in range(0, len(items), batch_size)]
+    results = BulkResults()
+    for batch, batch_result in zip(batches, run_bulk(function, batches, max_workers)):
+        batch_results = batch_result.result if batch_result.ok else [None] * len(batch)
+        for item, result in zip(batch, batch_results):
+            results.append(
+                BulkItemResult(len(results), item, result, exception=batch_result.exception)
+            )
+    return results
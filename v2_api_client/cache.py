@@ -0,0 +1,138 @@
+import hashlib
+import time
+from typing import Union
+from urllib.parse import urlencode
+
+from django.conf import settings
+
+from v2_api_client import instrumentation
+
+# bump the version if the format of the cached responses changes
+CACHE_KEY_PREFIX = "api_response:v2"
+MISSING = object()
+# how long a failed background refresh holds off the next one
+REFRESH_LOCK_TIMEOUT = 30
+
+
+class ResponseCache:
+    """Caches the responses to GET requests for read-mostly resources, e.g. feature flags.
+
+    Enabled per base_endpoint with the API_RESPONSE_CACHE_TIMEOUTS setting, a dict of
+    {base_endpoint: timeout in seconds}, e.g. {"django-feature-flags": 300}. Responses are
+    stored in the cache with the API_RESPONSE_CACHE alias (default "default").
+
+    Responses are cached per URL and per API token, so a user is only ever served responses
+    made with their own token. The base_endpoints in the API_RESPONSE_CACHE_SHARED setting,
+    e.g. ["django-feature-flags"], are cached per URL alone and shared between all users, only
+    list resources whose responses don't depend on who is asking. Any POST/PUT/PATCH/DELETE
+    made by a client for a cached base_endpoint invalidates all of its cached responses, for
+    every user.
+
+    The API_RESPONSE_CACHE_MAX_STALE setting, {base_endpoint: seconds}, serves expired responses
+    stale-while-revalidate, e.g. {"django-feature-flags": 600}. A response up to that many seconds
+    past its timeout is returned straight away, while a single background request (per cache,
+    not per process) refreshes it. Older responses are fetched as usual. Stale responses are
+    counted in instrumentation.metrics.
+    """
+
+    def __init__(
+        self,
+        cache_alias: str,
+        timeouts: dict,
+        max_stale: dict = None,
+        shared: list = None,
+        registry: instrumentation.MetricsRegistry = None,
+    ):
+        from django.core.cache import caches
+
+        self.cache = caches[cache_alias]
+        self.timeouts = timeouts
+        self.max_stale = max_stale or {}
+        self.shared = set(shared or ())
+
+        registry = registry or instrumentation.metrics
+        self.stale_hits = registry.counter(
+            "trs_api_client_response_cache_stale_total",
+            "Expired TRS API responses served from the cache while they were refreshed",
+        )
+        self.refreshes = registry.counter(
+            "trs_api_client_response_cache_refreshes_total",
+            "Background refreshes of expired TRS API responses, by outcome",
+        )
+
+    @classmethod
+    def from_settings(cls) -> Union["ResponseCache", None]:
+        """Returns a ResponseCache configured from settings, or None if it's disabled."""
+        timeouts = getattr(settings, "API_RESPONSE_CACHE_TIMEOUTS", None)
+        if not timeouts:
+            return None
+        return cls(
+            getattr(settings, "API_RESPONSE_CACHE", "default"),
+            timeouts,
+            getattr(settings, "API_RESPONSE_CACHE_MAX_STALE", None),
+            getattr(settings, "API_RESPONSE_CACHE_SHARED", None),
+        )
+
+    def get_timeout(self, base_endpoint: str) -> Union[int, None]:
+        """Returns how long responses for base_endpoint are cached, None if they aren't."""
+        return self.timeouts.get(base_endpoint)
+
+    def get_max_stale(self, base_endpoint: str) -> int:
+        """Returns how long responses for base_endpoint are served after they expire."""
+        return self.max_stale.get(base_endpoint) or 0
+
+    def get_version(self, base_endpoint: str) -> int:
+        return self.cache.get(f"{CACHE_KEY_PREFIX}:{base_endpoint}:version", 1)
+
+    def is_shared(self, base_endpoint: str) -> bool:
+        """True if the responses for base_endpoint are the same for every user."""
+        return base_endpoint in self.shared
+
+    @staticmethod
+    def get_scope(authorization: str) -> str:
+        """Returns the scope of the responses fetched with an Authorization header, see
+        get_key(). Hashed, so the token never ends up in the cache."""
+        return hashlib.sha256(authorization.encode()).hexdigest()
+
+    def get_key(
+        self, base_endpoint: str, url: str, params: dict = None, scope: str = None
+    ) -> str:
+        """Returns the key of the response to a GET of url, scope is who it's cached for,
+        None if base_endpoint is shared."""
+        if params:
+            url += f"{'&' if '?' in url else '?'}{urlencode(sorted(params.items()))}"
+        # URLs can be longer than memcached's 250 character keys
+        url_hash = hashlib.sha256(f"{scope or ''}\n{url}".encode()).hexdigest()
+        return (
+            f"{CACHE_KEY_PREFIX}:{base_endpoint}:{self.get_version(base_endpoint)}:{url_hash}"
+        )
+
+    def get(self, key: str, default=None) -> tuple:
+        """Returns (data, is_stale), or (default, False) if there's no cached response."""
+        entry = self.cache.get(key)
+        if entry is None:
+            return default, False
+        expires, data = entry
+        return data, time.time() >= expires
+
+    def set(self, key: str, data, timeout: int, max_stale: int = 0) -> None:
+        # the expiry is stored with the data, the cache keeps it until it's too stale to serve
+        self.cache.set(key, (time.time() + timeout, data), timeout=timeout + max_stale)
+
+    def start_refresh(self, key: str) -> bool:
+        """Returns True if the caller should refresh the response for key, False if another
+        thread or process already is."""
+        return self.cache.add(f"{key}:refresh", 1, timeout=REFRESH_LOCK_TIMEOUT)
+
+    def finish_refresh(self, key: str) -> None:
+        self.cache.delete(f"{key}:refresh")
+
+    def invalidate(self, base_endpoint: str) -> None:
+        """Invalidates every cached response for base_endpoint, by bumping its version."""
+        version_key = f"{CACHE_KEY_PREFIX}:{base_endpoint}:version"
+        self.cache.add(version_key, 1, timeout=None)
+        try:
+            self.cache.incr(version_key)
+        except ValueError:
+            # evicted in the meantime
+            self.cache.set(version_key, 2, timeout=None)
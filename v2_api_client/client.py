@@ -1,3 +1,4 @@
+from v2_api_client.identity_map import IdentityMap
 from v2_api_client.library import (
     access,
     cases,
@@ -29,70 +30,78 @@ class TRSAPIClient:
     self.submissions({"case": {case_id}}) --> Creates a new submission object
 
     The objects returned by these calls are instances of TRSObject (or a subclass).
+
+    Pass identity_map=True to get the same TRSObject every time an object is retrieved through
+    this client, see v2_api_client.identity_map.
     """
 
     def __init__(self, *args, **kwargs):
-        token = kwargs.pop("token")
-        timeout = kwargs.pop("timeout", None)
+        identity_map = kwargs.pop("identity_map", None)
+        if identity_map is True:
+            identity_map = IdentityMap()
+        elif identity_map is False:
+            identity_map = None
+        self.identity_map = identity_map
+        # passed to every one of the object clients
+        client_kwargs = {
+            "token": kwargs.pop("token"),
+            "timeout": kwargs.pop("timeout", None),
+            "projection": kwargs.pop("projection", None),
+            "identity_map": self.identity_map,
+            # see v2_api_client.hedging
+            "hedge": kwargs.pop("hedge", None),
+        }
 
         super().__init__(*args, **kwargs)
         self.submissions = submissions.SubmissionsAPIClient(
-            token=token, timeout=timeout, *args, **kwargs
-        )
-        self.users = users.UsersAPIClient(token=token, timeout=timeout, *args, **kwargs)
-        self.cases = cases.CasesAPIClient(token=token, timeout=timeout, *args, **kwargs)
-        self.documents = documents.DocumentsAPIClient(
-            token=token, timeout=timeout, *args, **kwargs
+            *args, **client_kwargs, **kwargs
         )
+        self.users = users.UsersAPIClient(*args, **client_kwargs, **kwargs)
+        self.cases = cases.CasesAPIClient(*args, **client_kwargs, **kwargs)
+        self.documents = documents.DocumentsAPIClient(*args, **client_kwargs, **kwargs)
         self.document_bundles = documents.DocumentBundlesAPIClient(
-            token=token, timeout=timeout, *args, **kwargs
+            *args, **client_kwargs, **kwargs
         )
         self.invitations = invititations.InvitationsAPIClient(
-            token=token, timeout=timeout, *args, **kwargs
+            *args, **client_kwargs, **kwargs
         )
         self.organisations = organisations.OrganisationAPIClient(
-            token=token, timeout=timeout, *args, **kwargs
-        )
-        self.contacts = contacts.ContactsAPIClient(
-            token=token, timeout=timeout, *args, **kwargs
+            *args, **client_kwargs, **kwargs
         )
+        self.contacts = contacts.ContactsAPIClient(*args, **client_kwargs, **kwargs)
         self.case_contacts = contacts.CaseContactsAPIClient(
-            token=token, timeout=timeout, *args, **kwargs
+            *args, **client_kwargs, **kwargs
         )
         self.two_factor_auths = users.TwoFactorAuthsAPIClient(
-            token=token, timeout=timeout, *args, **kwargs
+            *args, **client_kwargs, **kwargs
         )
         self.feature_flags = generic.FeatureFlagsAPIClient(
-            token=token, timeout=timeout, *args, **kwargs
-        )
-        self.feedback = generic.FeedbackAPIClient(
-            token=token, timeout=timeout, *args, **kwargs
+            *args, **client_kwargs, **kwargs
         )
+        self.feedback = generic.FeedbackAPIClient(*args, **client_kwargs, **kwargs)
         self.organisation_case_roles = organisations.OrganisationCaseRoleAPIClient(
-            token=token, timeout=timeout, *args, **kwargs
+            *args, **client_kwargs, **kwargs
         )
         self.organisation_merge_records = (
             organisations.OrganisationMergeRecordAPIClient(
-                token=token, timeout=timeout, *args, **kwargs
+                *args, **client_kwargs, **kwargs
             )
         )
         self.duplicate_organisation_merges = (
             organisations.DuplicateOrganisationMergeAPIClient(
-                token=token, timeout=timeout, *args, **kwargs
+                *args, **client_kwargs, **kwargs
             )
         )
         self.submission_organisation_merge_records = (
             submissions.SubmissionOrganisationMergeRecordAPIClient(
-                token=token, timeout=timeout, *args, **kwargs
+                *args, **client_kwargs, **kwargs
             )
         )
         self.user_profiles = users.UserProfileAPIClient(
-            token=token, timeout=timeout, *args, **kwargs
+            *args, **client_kwargs, **kwargs
         )
         self.organisation_users = organisations.OrganisationUserAPIClient(
-            token=token, timeout=timeout, *args, **kwargs
-        )
-        self.user_cases = access.UserCaseAPIClient(
-            token=token, timeout=timeout, *args, **kwargs
+            *args, **client_kwargs, **kwargs
         )
+        self.user_cases = access.UserCaseAPIClient(*args, **client_kwargs, **kwargs)
         self.healthcheck = healthcheck.get_status
@@ -0,0 +1,48 @@
+"""Compression of the responses from, and (optionally) the requests to, the API.
+
+Every client asks for compressed responses with every encoding urllib3 can decode here, zstd and
+brotli need the zstandard (or Python 3.14's compression.zstd) and brotli packages installed, gzip
+and deflate are always available. The API_ACCEPT_ENCODING setting overrides the header.
+
+Request bodies bigger than the API_COMPRESS_REQUEST_BODIES_OVER setting (bytes, default None, off)
+are gzipped, with a Content-Encoding header. Only enable it if the API accepts compressed request
+bodies.
+"""
+import gzip
+
+from django.conf import settings
+from urllib3.util.request import ACCEPT_ENCODING
+
+# most preferred first
+ENCODINGS = ("zstd", "br", "gzip", "deflate")
+
+
+def get_accept_encoding() -> str:
+    """The Accept-Encoding header sent with every request."""
+    if accept_encoding := getattr(settings, "API_ACCEPT_ENCODING", None):
+        return accept_encoding
+    available = ACCEPT_ENCODING.split(",")
+    return ", ".join(encoding for encoding in ENCODINGS if encoding in available)
+
+
+def compress_request_body(request, threshold: int = None) -> None:
+    """Gzips the body of a requests.PreparedRequest in place if it's bigger than threshold
+    bytes, by default the API_COMPRESS_REQUEST_BODIES_OVER setting."""
+    if threshold is None:
+        threshold = getattr(settings, "API_COMPRESS_REQUEST_BODIES_OVER", None)
+    body = request.body
+    if (
+        threshold is None
+        or not body
+        or len(body) <= threshold
+        or "Content-Encoding" in request.headers
+        # a file or a generator, streamed rather than held in memory
+        or not isinstance(body, (str, bytes))
+    ):
+        return
+    if isinstance(body, str):
+        body = body.encode()
+    # level 6 compresses JSON almost as well as 9, in a fraction of the time
+    request.body = gzip.compress(body, compresslevel=6)
+    request.headers["Content-Encoding"] = "gzip"
+    request.headers["Content-Length"] = str(len(request.body))
@@ -1,7 +1,5 @@
 from json import JSONDecoder
 
-from dateutil import parser
-from dateutil.parser import ParserError
 from dotwiz import DotWiz
 
 
@@ -14,6 +12,10 @@ def encode(string):
 
     # maybe it is a datetime
     if isinstance(string, str) and len(string) in [24, 25, 26, 27] and "T" in string:
+        # imported here as most responses never need it, and it's slow to import
+        from dateutil import parser
+        from dateutil.parser import ParserError
+
         try:
             value = parser.parse(string)
         except (ParserError, TypeError):
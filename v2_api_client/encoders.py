@@ -1,6 +1,7 @@
 from django.core.serializers.json import DjangoJSONEncoder
 
-from v2_api_client.library import TRSObject
+from v2_api_client.json_backends import django_json_default, get_json_backend
+from v2_api_client.trs_object import TRSObject
 
 
 class TRSObjectJsonEncoder(DjangoJSONEncoder):
@@ -8,5 +9,33 @@ class TRSObjectJsonEncoder(DjangoJSONEncoder):
 
     def default(self, o):
         if isinstance(o, TRSObject):
-            return self.encode(o.data_dict.__dict__)
+            # the DotWiz is a dict, so the encoder walks it in the same pass as everything else
+            return o.data_dict
         return super().default(o)
+
+
+def trs_object_json_default(o):
+    """The default= hook used by dumps(), TRSObjectJsonEncoder.default for the JSON backends."""
+    if isinstance(o, TRSObject):
+        return o.data_dict
+    return django_json_default(o)
+
+
+def dumps(obj) -> str:
+    """Encodes obj, which can be (or contain) any number of TRSObjects, as JSON with the
+    configured JSON backend, e.g. when caching a list of thousands of objects or handing them
+    over to JS.
+    """
+    return get_json_backend().dumps(obj, default=trs_object_json_default)
+
+
+def to_python(obj):
+    """Converts TRSObjects and DotWiz trees (including those nested in lists) in obj into plain
+    dicts and lists, leaving everything else (e.g. decoded datetimes) as it is."""
+    if isinstance(obj, TRSObject):
+        obj = obj.data_dict
+    if isinstance(obj, dict):
+        return {key: to_python(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [to_python(value) for value in obj]
+    return obj
@@ -34,3 +34,8 @@ class RateLimitedError(ClientError):
     """A 429 rate-limit was returned from the API."""
 
     status_code = 429
+
+
+class APICallBudgetExceededError(Exception):
+    """Too many API calls were made while handling a single request, see
+    v2_api_client.middleware.APICallBudgetMiddleware."""
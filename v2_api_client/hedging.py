@@ -0,0 +1,177 @@
+"""Hedged GETs, to cut the tail latency of cheap requests that are occasionally slow.
+
+A hedged GET is made in the background. If it hasn't finished after a delay, by default the
+observed p95 latency of its endpoint, a second, identical request is made, and whichever
+finishes first is used. A request that's already running can't be interrupted, so the slower
+one is left to finish in the background and its response is discarded.
+
+Opt in per client, BaseAPIClient(hedge=True) (or TRSAPIClient(token=..., hedge=True)), or for
+every client with the API_HEDGED_REQUESTS setting, True or a dict of HedgePolicy arguments,
+e.g. {"endpoints": ["cases/{id}/get_status"], "budget": 0.02}. Only GETs are ever hedged.
+
+The hedge budget caps the extra load, at most budget (default 5%) of requests are hedged, plus a
+small burst allowance.
+
+Both requests run on the shared executor, see transport.get_shared_executor(), but never wait
+for it. When all its workers are busy the request is made on the calling thread, unhedged, and
+a hedge that can't start straight away isn't made.
+"""
+from __future__ import annotations
+
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+from typing import Callable
+
+from django.conf import settings
+
+from v2_api_client import instrumentation
+from v2_api_client.transport import get_shared_executor
+
+
+class HedgePolicy:
+    """Decides when, and how often, GETs are hedged.
+
+    Parameters
+    ----------
+    delay : seconds to wait before hedging, None to use the observed latency percentile
+    percentile : the latency percentile of an endpoint used as its delay
+    min_samples : how many requests an endpoint needs before it's hedged, when delay is None
+    window : how many recent latencies are kept per endpoint
+    min_delay : the shortest delay, so very fast endpoints aren't always hedged
+    budget : the fraction of requests that can be hedged
+    max_burst : how many hedges can be saved up while things are quiet
+    endpoints : the path templates to hedge, see instrumentation.get_path_template(), None for
+        all of them
+    """
+
+    def __init__(
+        self,
+        delay: float = None,
+        percentile: float = 95,
+        min_samples: int = 20,
+        window: int = 200,
+        min_delay: float = 0.01,
+        budget: float = 0.05,
+        max_burst: int = 10,
+        endpoints: list = None,
+        registry: instrumentation.MetricsRegistry = None,
+    ):
+        self.delay = delay
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.window = window
+        self.min_delay = min_delay
+        self.budget = budget
+        self.max_burst = max_burst
+        self.endpoints = set(endpoints) if endpoints is not None else None
+        self.latencies = {}
+        self.tokens = 0.0
+        self._lock = threading.Lock()
+
+        registry = registry or instrumentation.metrics
+        self.hedges = registry.counter(
+            "trs_api_client_hedged_requests_total",
+            "Duplicate requests made to the TRS API for slow GETs, and whether they won",
+        )
+
+    def applies_to(self, path: str) -> bool:
+        return self.endpoints is None or path in self.endpoints
+
+    def record(self, path: str, latency: float) -> None:
+        with self._lock:
+            if path not in self.latencies:
+                self.latencies[path] = deque(maxlen=self.window)
+            self.latencies[path].append(latency)
+
+    def get_delay(self, path: str) -> float | None:
+        """Seconds to wait before hedging a request to path, None if it shouldn't be."""
+        if self.delay is not None:
+            return self.delay
+        latencies = sorted(self.latencies.get(path, ()))
+        if len(latencies) < self.min_samples:
+            return None
+        index = min(int(len(latencies) * self.percentile / 100), len(latencies) - 1)
+        return max(self.min_delay, latencies[index])
+
+    def add_request(self) -> None:
+        """Every request adds budget to what can be spent on hedges."""
+        with self._lock:
+            self.tokens = min(self.max_burst, self.tokens + self.budget)
+
+    def try_hedge(self) -> bool:
+        """Spends from the budget to make a hedge, returns False if there isn't enough."""
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+_shared_policies = {}
+_shared_policies_lock = threading.Lock()
+
+
+def get_hedge_policy(hedge=None) -> HedgePolicy | None:
+    """Returns the HedgePolicy for a client's hedge argument. None (the default) uses the
+    API_HEDGED_REQUESTS setting, True enables hedging even if the setting doesn't, and False
+    disables it. Clients share a policy, and so the latencies observed, per set of options."""
+    if isinstance(hedge, HedgePolicy):
+        return hedge
+    options = getattr(settings, "API_HEDGED_REQUESTS", None)
+    if hedge is False or not (hedge or options):
+        return None
+    options = options if isinstance(options, dict) else {}
+    key = repr(sorted(options.items()))
+    with _shared_policies_lock:
+        if key not in _shared_policies:
+            _shared_policies[key] = HedgePolicy(**options)
+        return _shared_policies[key]
+
+
+def hedged(policy: HedgePolicy, path: str, function: Callable):
+    """Calls function(), hedging it with a second call if it's slow, see the module
+    docstring."""
+    policy.add_request()
+    delay = policy.get_delay(path)
+    start = time.perf_counter()
+    if delay is None:
+        result = function()
+        policy.record(path, time.perf_counter() - start)
+        return result
+
+    executor = get_shared_executor()
+    # each call runs in a copy of the current context, so context-local state (e.g. the
+    # APICallTracker of the current request) follows it into the worker thread
+    primary = executor.try_submit(contextvars.copy_context().run, function)
+    if primary is None:
+        # queued behind other work, the hedge would only be racing the queue
+        result = function()
+        policy.record(path, time.perf_counter() - start)
+        return result
+    pending = {primary}
+    done, pending = wait(pending, timeout=delay)
+    hedge = None
+    if not done and policy.try_hedge():
+        hedge = executor.try_submit(contextvars.copy_context().run, function)
+        if hedge is not None:
+            pending.add(hedge)
+
+    exception = None
+    while True:
+        for future in done:
+            if future.exception() is None:
+                policy.record(path, time.perf_counter() - start)
+                if hedge is not None:
+                    policy.hedges.inc(endpoint=path, won=future is hedge)
+                for other in pending:
+                    # only cancels it if it hasn't started yet
+                    other.cancel()
+                return future.result()
+            exception = exception or future.exception()
+        if not pending:
+            # they all failed
+            raise exception
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
@@ -0,0 +1,77 @@
+"""Makes sure there's only one TRSObject for each object retrieved through a TRSAPIClient.
+
+Enabled with TRSAPIClient(token=..., identity_map=True), typically one client per request. Every
+object client then looks objects up by (base_endpoint, id) before making new ones, so:
+
+client.cases(case_id) is client.cases(case_id) --> True, and it's only loaded once
+client.cases()[0] is client.cases(client.cases()[0].id) --> True
+
+Newer data for an object (e.g. from listing the objects again, or updating one) is merged into
+the existing instance. Objects are only weakly referenced, they are freed as soon as nothing else
+uses them.
+"""
+from __future__ import annotations
+
+import threading
+import weakref
+from typing import Callable
+
+
+class IdentityMap:
+    def __init__(self):
+        self._objects = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_key(resource: str, object_id) -> tuple:
+        return resource, str(object_id)
+
+    def get(self, resource: str, object_id):
+        """Returns the object with object_id if there is one, else None."""
+        return self._objects.get(self.get_key(resource, object_id))
+
+    def add(self, resource: str, object_id, trs_object) -> None:
+        """Adds trs_object, replacing any existing object with the same ID."""
+        with self._lock:
+            self._objects[self.get_key(resource, object_id)] = trs_object
+
+    def get_or_add(
+        self,
+        resource: str,
+        object_id,
+        make_object: Callable,
+        data: dict = None,
+        partial: bool = False,
+        fields: set = None,
+    ):
+        """Returns the existing object with object_id, with data merged into it, or adds the one
+        returned by make_object().
+
+        partial is True when data only has some of the object's fields, see TRSObject.merge().
+        fields are the fields asked for by a lazy retrieval (data is None), if it only asked for
+        some of them.
+        """
+        key = self.get_key(resource, object_id)
+        with self._lock:
+            trs_object = self._objects.get(key)
+            # an object with only some of its fields can't stand in for a retrieval of others
+            if trs_object is None or (
+                data is None
+                and trs_object._partial
+                and (not partial or (fields is not None and not trs_object.has_fields(fields)))
+            ):
+                trs_object = self._objects[key] = make_object()
+                return trs_object
+        if data is not None:
+            trs_object.merge(data, partial=partial)
+        return trs_object
+
+    def clear(self) -> None:
+        with self._lock:
+            self._objects.clear()
+
+    def __len__(self):
+        return len(self._objects)
+
+    def __contains__(self, key: tuple):
+        return self.get(*key) is not None
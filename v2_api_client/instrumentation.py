@@ -0,0 +1,370 @@
+"""Hooks for observing the requests made by the API client, and the TRSObjects it creates.
+
+Register an observer to be notified every time the client makes a request or a TRSObject is
+lazy-loaded/decoded, e.g.
+
+from v2_api_client import instrumentation
+
+instrumentation.register_observer(instrumentation.LoggingObserver())
+instrumentation.register_observer(instrumentation.MetricsObserver())
+
+When no observers are registered, the client skips collecting the timings altogether.
+"""
+from __future__ import annotations
+
+import bisect
+import logging
+import re
+import threading
+from urllib.parse import urlsplit
+
+from v2_api_client.exceptions import APICallBudgetExceededError
+
+logger = logging.getLogger(__name__)
+
+ID_PATH_SEGMENT = re.compile(
+    r"^([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|\d+)$", re.IGNORECASE
+)
+
+_observers = []
+_observers_lock = threading.Lock()
+
+
+class RequestEvent:
+    """Describes a single request made to the API.
+
+    All timings are in seconds, and are None if they couldn't be measured. connect_time includes
+    the DNS lookup, and is 0 when a pooled connection was reused. retries counts the retries
+    urllib3 made before the response, there are none unless an adapter is mounted with
+    max_retries.
+    """
+
+    def __init__(self, method: str, url: str, base_endpoint: str = None):
+        self.method = method
+        self.url = url
+        self.base_endpoint = base_endpoint
+        self.path = get_path_template(url)
+        self.status_code = None
+        self.response_bytes = None
+        self.connect_time = None
+        self.tls_time = None
+        self.ttfb = None
+        self.total_time = None
+        self.retries = 0
+        self.cache_hit = False
+        # a cache hit served after its timeout, see v2_api_client.cache.ResponseCache
+        self.stale = False
+        self.exception = None
+
+    def as_dict(self) -> dict:
+        return {
+            "method": self.method,
+            "url": self.url,
+            "base_endpoint": self.base_endpoint,
+            "path": self.path,
+            "status_code": self.status_code,
+            "response_bytes": self.response_bytes,
+            "connect_time": self.connect_time,
+            "tls_time": self.tls_time,
+            "ttfb": self.ttfb,
+            "total_time": self.total_time,
+            "retries": self.retries,
+            "cache_hit": self.cache_hit,
+            "stale": self.stale,
+            "exception": repr(self.exception) if self.exception else None,
+        }
+
+
+class ObjectEvent:
+    """Describes work done by a TRSObject, action is either "lazy_load" (the GET and decode
+    of a lazy object) or "decode" (converting the response data of a non-lazy object)."""
+
+    def __init__(self, action: str, base_endpoint: str, object_id=None, duration: float = None):
+        self.action = action
+        self.base_endpoint = base_endpoint
+        self.object_id = object_id
+        self.duration = duration
+
+    def as_dict(self) -> dict:
+        return {
+            "action": self.action,
+            "base_endpoint": self.base_endpoint,
+            "object_id": str(self.object_id) if self.object_id else None,
+            "duration": self.duration,
+        }
+
+
+class BaseObserver:
+    """Subclass and override the methods for the events you are interested in."""
+
+    def request_finished(self, event: RequestEvent) -> None:
+        pass
+
+    def object_event(self, event: ObjectEvent) -> None:
+        pass
+
+
+def register_observer(observer: BaseObserver) -> BaseObserver:
+    with _observers_lock:
+        if observer not in _observers:
+            _observers.append(observer)
+    return observer
+
+
+def unregister_observer(observer: BaseObserver) -> None:
+    with _observers_lock:
+        if observer in _observers:
+            _observers.remove(observer)
+
+
+def has_observers() -> bool:
+    return bool(_observers)
+
+
+def notify_request_finished(event: RequestEvent) -> None:
+    for observer in list(_observers):
+        try:
+            observer.request_finished(event)
+        except APICallBudgetExceededError:
+            # raised on purpose, so the offending call site shows up in the traceback
+            raise
+        except Exception:
+            # a broken observer should never break a request
+            logger.exception("Observer %r failed to handle a request event", observer)
+
+
+def notify_object_event(event: ObjectEvent) -> None:
+    for observer in list(_observers):
+        try:
+            observer.object_event(event)
+        except Exception:
+            logger.exception("Observer %r failed to handle an object event", observer)
+
+
+def get_path_template(url: str) -> str:
+    """Returns the path of an API URL with the object IDs replaced by {id}, so requests to the
+    same endpoint can be grouped together, e.g.
+
+    https://api/api/v2/cases/0a4b...ef/get_status/?query=... --> cases/{id}/get_status
+    """
+    path = urlsplit(url).path
+    if "/api/v2/" in path:
+        path = path.split("/api/v2/", 1)[1]
+    return "/".join(
+        "{id}" if ID_PATH_SEGMENT.match(segment) else segment
+        for segment in path.strip("/").split("/")
+    )
+
+
+class LoggingObserver(BaseObserver):
+    """Logs a line for every request (and optionally every TRSObject event).
+
+    The event is passed as extra={"api_request": {...}} so it's available on the record as
+    record.api_request, and to v2_api_client.shared.logging.get_extra_details().
+    """
+
+    def __init__(
+        self,
+        logger_name: str = "v2_api_client.requests",
+        level: int = logging.INFO,
+        log_object_events: bool = False,
+    ):
+        self.logger = logging.getLogger(logger_name)
+        self.level = level
+        self.log_object_events = log_object_events
+
+    def request_finished(self, event: RequestEvent) -> None:
+        if not self.logger.isEnabledFor(self.level):
+            return
+        self.logger.log(
+            self.level,
+            "API %s %s %s %.1fms %s bytes%s",
+            event.method,
+            event.path,
+            event.status_code or type(event.exception).__name__,
+            (event.total_time or 0) * 1000,
+            event.response_bytes,
+            (" (stale)" if event.stale else " (cached)") if event.cache_hit else "",
+            extra={"api_request": event.as_dict()},
+        )
+
+    def object_event(self, event: ObjectEvent) -> None:
+        if not self.log_object_events or not self.logger.isEnabledFor(self.level):
+            return
+        self.logger.log(
+            self.level,
+            "TRSObject %s %s %.1fms",
+            event.action,
+            event.base_endpoint,
+            (event.duration or 0) * 1000,
+            extra={"api_object": event.as_dict()},
+        )
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = label_key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(label_key(labels), 0)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{format_labels(key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, value: float, **labels) -> None:
+        key = label_key(labels)
+        with self._lock:
+            self.values[key] = value
+
+    def render(self) -> list:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20)
+
+    def __init__(self, name: str, documentation: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        # {labels: [bucket counts..., +Inf count, sum]}
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            if key not in self.values:
+                self.values[key] = [0] * (len(self.buckets) + 2)
+            counts = self.values[key]
+            counts[index] += 1
+            counts[-1] += value
+
+    def get_count(self, **labels) -> int:
+        counts = self.values.get(label_key(labels))
+        return sum(counts[:-1]) if counts else 0
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, counts in sorted(self.values.items()):
+            cumulative = 0
+            for bucket, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                bucket_key = key + (("le", str(bucket)),)
+                lines.append(f"{self.name}_bucket{format_labels(bucket_key)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(key)} {counts[-1]}")
+            lines.append(f"{self.name}_count{format_labels(key)} {cumulative}")
+        return lines
+
+
+def label_key(labels: dict) -> tuple:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def format_labels(key: tuple) -> str:
+    if not key:
+        return ""
+    labels = ",".join(f'{name}="{value}"' for name, value in key)
+    return f"{{{labels}}}"
+
+
+class MetricsRegistry:
+    """A minimal Prometheus-style registry, render() returns the text exposition format so it
+    can be served from a /metrics view, or fed into prometheus_client if you already use it."""
+
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, metric_class, name: str, documentation: str, **kwargs):
+        with self._lock:
+            if name not in self.metrics:
+                self.metrics[name] = metric_class(name, documentation, **kwargs)
+            return self.metrics[name]
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self._get_or_create(Counter, name, documentation)
+
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation)
+
+    def histogram(self, name: str, documentation: str, **kwargs) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, **kwargs)
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+class MetricsObserver(BaseObserver):
+    """Records the requests and TRSObject events into a MetricsRegistry."""
+
+    def __init__(self, registry: MetricsRegistry = None):
+        self.registry = registry or metrics
+        self.requests = self.registry.counter(
+            "trs_api_client_requests_total", "Requests made to the TRS API"
+        )
+        self.request_duration = self.registry.histogram(
+            "trs_api_client_request_duration_seconds", "Total time taken by TRS API requests"
+        )
+        self.ttfb = self.registry.histogram(
+            "trs_api_client_request_ttfb_seconds", "Time to the first byte of TRS API responses"
+        )
+        self.connect_duration = self.registry.histogram(
+            "trs_api_client_connect_duration_seconds",
+            "Time taken to open new connections to the TRS API, including DNS",
+        )
+        self.response_bytes = self.registry.counter(
+            "trs_api_client_response_bytes_total", "Bytes received from the TRS API"
+        )
+        self.object_duration = self.registry.histogram(
+            "trs_api_client_object_duration_seconds",
+            "Time taken to lazy-load and decode TRSObjects",
+        )
+
+    def request_finished(self, event: RequestEvent) -> None:
+        status = event.status_code or "error"
+        self.requests.inc(
+            method=event.method,
+            endpoint=event.path,
+            status=status,
+            cache_hit=event.cache_hit,
+        )
+        if event.total_time is not None:
+            self.request_duration.observe(
+                event.total_time, method=event.method, endpoint=event.path
+            )
+        if event.ttfb is not None:
+            self.ttfb.observe(event.ttfb, method=event.method, endpoint=event.path)
+        if event.connect_time:
+            self.connect_duration.observe(event.connect_time)
+        if event.response_bytes:
+            self.response_bytes.inc(event.response_bytes, endpoint=event.path)
+
+    def object_event(self, event: ObjectEvent) -> None:
+        if event.duration is not None:
+            self.object_duration.observe(
+                event.duration, action=event.action, endpoint=event.base_endpoint
+            )
+
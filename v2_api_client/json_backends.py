@@ -0,0 +1,176 @@
+"""Pluggable JSON (de)serialization used for response bodies, JSON request bodies and the
+filter_parameters encoded into URLs.
+
+Set API_JSON_BACKEND to "stdlib", "orjson", or "msgspec". The default, "auto", uses orjson if
+it's installed and falls back to the standard library json module.
+
+Every backend encodes datetimes, dates, times, timedeltas, Decimals, UUIDs and Promises the same
+way as Django's DjangoJSONEncoder. msgspec encodes datetimes, times and timedeltas itself, never
+asking the default hook, so they are converted before the data is handed to it. That makes it
+slower than orjson at encoding, it's only used when it's chosen explicitly.
+"""
+import datetime
+import json
+from functools import lru_cache
+
+from apiclient.exceptions import ResponseParseError
+from apiclient.request_formatters import JsonRequestFormatter
+from apiclient.response_handlers import JsonResponseHandler
+from django.conf import settings
+
+
+@lru_cache(maxsize=None)
+def get_django_json_encoder():
+    """Returns an instance of DjangoJSONEncoder, imported on first use as its module pulls in
+    the whole of django.db.models."""
+    from django.core.serializers.json import DjangoJSONEncoder
+
+    return DjangoJSONEncoder()
+
+
+def django_json_default(o):
+    """The default= hook for the fast backends, encodes o like DjangoJSONEncoder would."""
+    return get_django_json_encoder().default(o)
+
+
+class JSONDecodeError(ValueError):
+    """Raised by every backend when data is not valid JSON."""
+
+
+class StdlibJSONBackend:
+    name = "stdlib"
+
+    def dumps(self, obj, default=None) -> str:
+        """Encodes obj as a JSON string. default overrides how unknown types are encoded, it
+        is called for datetimes too, e.g. default=str."""
+        if default:
+            return json.dumps(obj, default=default)
+        return json.dumps(obj, cls=type(get_django_json_encoder()))
+
+    def dumps_bytes(self, obj, default=None) -> bytes:
+        return self.dumps(obj, default=default).encode()
+
+    def loads(self, data):
+        try:
+            return json.loads(data)
+        except json.JSONDecodeError as exc:
+            raise JSONDecodeError(str(exc)) from exc
+
+
+class OrjsonJSONBackend(StdlibJSONBackend):
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+
+        self.orjson = orjson
+        # orjson would otherwise encode datetimes itself, with more precision than Django does
+        self.options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def dumps_bytes(self, obj, default=None) -> bytes:
+        return self.orjson.dumps(
+            obj, default=default or django_json_default, option=self.options
+        )
+
+    def dumps(self, obj, default=None) -> str:
+        return self.dumps_bytes(obj, default=default).decode()
+
+    def loads(self, data):
+        try:
+            return self.orjson.loads(data)
+        except self.orjson.JSONDecodeError as exc:
+            raise JSONDecodeError(str(exc)) from exc
+
+
+# the types msgspec always encodes itself, differently to DjangoJSONEncoder
+MSGSPEC_NATIVE_TYPES = (datetime.datetime, datetime.time, datetime.timedelta)
+
+
+def convert_native_types(obj, default):
+    """Returns a copy of obj with the values msgspec would encode itself replaced by
+    default(value)."""
+    if isinstance(obj, MSGSPEC_NATIVE_TYPES):
+        return default(obj)
+    if isinstance(obj, dict):
+        return {key: convert_native_types(value, default) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [convert_native_types(value, default) for value in obj]
+    return obj
+
+
+class MsgspecJSONBackend(StdlibJSONBackend):
+    name = "msgspec"
+
+    def __init__(self):
+        import msgspec
+
+        self.msgspec = msgspec
+        self.encoder = msgspec.json.Encoder(enc_hook=django_json_default)
+        self.decoder = msgspec.json.Decoder()
+
+    def dumps_bytes(self, obj, default=None) -> bytes:
+        obj = convert_native_types(obj, default or django_json_default)
+        if default:
+            return self.msgspec.json.encode(obj, enc_hook=default)
+        return self.encoder.encode(obj)
+
+    def dumps(self, obj, default=None) -> str:
+        return self.dumps_bytes(obj, default=default).decode()
+
+    def loads(self, data):
+        try:
+            return self.decoder.decode(data)
+        except self.msgspec.DecodeError as exc:
+            raise JSONDecodeError(str(exc)) from exc
+
+
+JSON_BACKENDS = {
+    "stdlib": StdlibJSONBackend,
+    "orjson": OrjsonJSONBackend,
+    "msgspec": MsgspecJSONBackend,
+}
+
+
+@lru_cache(maxsize=None)
+def load_json_backend(name: str):
+    if name != "auto":
+        return JSON_BACKENDS[name]()
+    try:
+        return OrjsonJSONBackend()
+    except ImportError:
+        return StdlibJSONBackend()
+
+
+def get_json_backend():
+    """Returns the JSON backend configured by the API_JSON_BACKEND setting."""
+    return load_json_backend(getattr(settings, "API_JSON_BACKEND", "auto"))
+
+
+class TRSJsonResponseHandler(JsonResponseHandler):
+    """Decodes the response body with the configured JSON backend, straight from the raw bytes
+    rather than decoding them to text first."""
+
+    @staticmethod
+    def get_request_data(response):
+        content = response.get_original().content
+        if not content:
+            return None
+
+        try:
+            return get_json_backend().loads(content)
+        except JSONDecodeError as error:
+            raise ResponseParseError(
+                f"Unable to decode response data to json. data='{response.get_raw_data()}'"
+            ) from error
+
+
+class TRSJsonRequestFormatter(JsonRequestFormatter):
+    """Sends request bodies as JSON encoded with the configured JSON backend.
+
+    Used instead of the default form-encoding when API_JSON_REQUEST_BODIES is True.
+    """
+
+    @classmethod
+    def format(cls, data):
+        if data:
+            return get_json_backend().dumps_bytes(data)
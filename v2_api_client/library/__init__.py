@@ -2,15 +2,28 @@ from __future__ import annotations
 
 import base64
 import concurrent.futures
-import json
+import contextvars
+import re
+import time
 import urllib
 from typing import Union
 from uuid import UUID
 
-from apiclient import APIClient, HeaderAuthentication, JsonResponseHandler
+from apiclient import APIClient, HeaderAuthentication
 from django.conf import settings
 
+from v2_api_client import instrumentation
+from v2_api_client.bulk import BulkItemResult, BulkResults, run_bulk, run_bulk_batches
+from v2_api_client.cache import MISSING, ResponseCache
 from v2_api_client.error_handling import APIErrorHandler
+from v2_api_client.hedging import get_hedge_policy, hedged
+from v2_api_client.json_backends import (
+    TRSJsonRequestFormatter,
+    TRSJsonResponseHandler,
+    get_json_backend,
+)
+from v2_api_client.projection import Projection, field_projector
+from v2_api_client.transport import TRSRequestStrategy, get_shared_executor, mount_adapters
 from v2_api_client.trs_object import TRSObject
 
 
@@ -25,26 +38,43 @@ class BaseAPIClient(APIClient):
 
     base_endpoint = None
     trs_object_class = TRSObject
+    # the path, relative to the base_endpoint, of a bulk endpoint on the API if it has one, see
+    # bulk_create()
+    bulk_endpoint = None
 
     def __init__(
         self,
-        response_handler=JsonResponseHandler,
+        response_handler=TRSJsonResponseHandler,
         error_handler=APIErrorHandler,
         **kwargs,
     ):
         self.timeout = kwargs.pop("timeout", None)
+        projection = kwargs.pop("projection", None)
+        if projection is None:
+            projection = getattr(settings, "API_FIELD_PROJECTION", False)
+        self.projection = projection
+        self.response_cache = kwargs.pop("response_cache", None) or ResponseCache.from_settings()
+        # shared by all the object clients of a TRSAPIClient, see v2_api_client.identity_map
+        self.identity_map = kwargs.pop("identity_map", None)
+        # slow GETs are duplicated if this is set, see v2_api_client.hedging
+        self.hedge_policy = get_hedge_policy(kwargs.pop("hedge", None))
         authentication_method = HeaderAuthentication(
             token=kwargs.pop("token", settings.HEALTH_CHECK_TOKEN),
             parameter="Authorization",
             scheme="Token",
             extra={"X-Origin-Environment": settings.ENVIRONMENT_KEY},
         )
+        kwargs.setdefault("request_strategy", TRSRequestStrategy())
+        if getattr(settings, "API_JSON_REQUEST_BODIES", False):
+            # the default is to form-encode request bodies
+            kwargs.setdefault("request_formatter", TRSJsonRequestFormatter)
         super().__init__(
             authentication_method=authentication_method,
             response_handler=response_handler,
             error_handler=error_handler,
             **kwargs,
         )
+        mount_adapters(self.get_session())
 
     def __call__(
         self,
@@ -69,6 +99,10 @@ class BaseAPIClient(APIClient):
         filter : a dict of query parameters to append to the URL
         slim : True if you want to return a slim object (no additional fields on the serializer)
 
+        If projection is enabled on this client and no fields are passed, retrievals only ask
+        for the fields previously used by the objects retrieved from the same call site, see
+        v2_api_client.projection.
+
         Returns
         -------
         An instance of a TRSObject OR list of TRSObjects
@@ -80,6 +114,11 @@ class BaseAPIClient(APIClient):
         self(created_at={user_id}) --> Lists all instances of object with field created_at=user_id - GET
         self({"key": "value"}) --> Creates and retrieves a single instance - POST
         """
+        projection = None
+        if self.projection and fields is None and not isinstance(arg, dict):
+            projection = field_projector.start(self.get_base_endpoint())
+            fields = projection.fields
+
         if kwargs:
             # additional filters to apply to the queryset returned, whereby the argument name is
             # the name of the model field, and the argument value is the desired value you want to
@@ -90,19 +129,19 @@ class BaseAPIClient(APIClient):
                 filter_parameters=kwargs,
                 slim=slim,
             )
-            return self._get_many(url)
+            return self._get_many(url, projection=projection)
         if arg is None:
             # it's called with no args, return all
             url = self.url(
                 self.get_base_endpoint(), fields=fields, params=params, slim=slim
             )
-            return self._get_many(url)
+            return self._get_many(url, projection=projection)
         if isinstance(arg, str) or isinstance(arg, UUID):
             # it's called with a str or UUID ID, retrieve one instance
             url = self.url(
                 self.get_retrieve_endpoint(arg), fields=fields, params=params, slim=slim
             )
-            return self._get(url=url, object_id=arg)
+            return self._get(url=url, object_id=arg, projection=projection)
         if isinstance(arg, dict):
             # it's called with a dict, create and retrieve one instance
             url = self.url(
@@ -110,6 +149,117 @@ class BaseAPIClient(APIClient):
             )
             return self._post(url=url, data=arg)
 
+    def get(self, endpoint: str, params: dict = None, **kwargs):
+        """GETs endpoint, from the response cache if it's enabled for this base_endpoint, see
+        v2_api_client.cache.ResponseCache."""
+        base_endpoint = self.get_base_endpoint()
+        if not self.response_cache or not (
+            timeout := self.response_cache.get_timeout(base_endpoint)
+        ):
+            return self._get_response(endpoint, params=params, **kwargs)
+
+        start = time.perf_counter()
+        max_stale = self.response_cache.get_max_stale(base_endpoint)
+        scope = None
+        if not self.response_cache.is_shared(base_endpoint):
+            scope = self.response_cache.get_scope(
+                self._authentication_method.get_headers()["Authorization"]
+            )
+        key = self.response_cache.get_key(base_endpoint, endpoint, params, scope=scope)
+        data, is_stale = self.response_cache.get(key, MISSING)
+        if data is MISSING or (is_stale and not max_stale):
+            data = self._get_response(endpoint, params=params, **kwargs)
+            self.response_cache.set(key, data, timeout, max_stale)
+            return data
+
+        if is_stale:
+            self.response_cache.stale_hits.inc(endpoint=base_endpoint)
+            if self.response_cache.start_refresh(key):
+                # in a new, empty, context, the refresh isn't part of the current request
+                refresh = get_shared_executor().try_submit(
+                    contextvars.Context().run,
+                    self._refresh_response,
+                    key,
+                    endpoint,
+                    params,
+                    kwargs,
+                    timeout,
+                    max_stale,
+                )
+                if refresh is None:
+                    # too busy, a later read will try again
+                    self.response_cache.finish_refresh(key)
+        if instrumentation.has_observers():
+            event = instrumentation.RequestEvent("GET", endpoint, base_endpoint)
+            event.cache_hit = True
+            event.stale = is_stale
+            event.total_time = time.perf_counter() - start
+            instrumentation.notify_request_finished(event)
+        return data
+
+    def _refresh_response(
+        self, key: str, endpoint: str, params: dict, kwargs: dict, timeout: int, max_stale: int
+    ) -> None:
+        """Replaces a stale cached response, in the background. A failed refresh leaves the
+        stale response to be served, and holds off the next attempt for
+        cache.REFRESH_LOCK_TIMEOUT seconds."""
+        base_endpoint = self.get_base_endpoint()
+        try:
+            # not hedged, no one is waiting for it, and hedges would queue on the same executor
+            data = super().get(endpoint, params=dict(params or {}), **kwargs)
+        except Exception:
+            self.response_cache.refreshes.inc(endpoint=base_endpoint, outcome="error")
+            return
+        self.response_cache.set(key, data, timeout, max_stale)
+        self.response_cache.finish_refresh(key)
+        self.response_cache.refreshes.inc(endpoint=base_endpoint, outcome="success")
+
+    def _get_response(self, endpoint: str, params: dict = None, **kwargs):
+        """GETs endpoint from the API, hedged if it's enabled for it."""
+        if self.hedge_policy is not None:
+            path = instrumentation.get_path_template(endpoint)
+            if self.hedge_policy.applies_to(path):
+                return hedged(
+                    self.hedge_policy,
+                    path,
+                    # the params are updated in place with the default ones, so each call gets
+                    # its own copy
+                    lambda: super(BaseAPIClient, self).get(
+                        endpoint, params=dict(params or {}), **kwargs
+                    ),
+                )
+        return super().get(endpoint, params=params, **kwargs)
+
+    def post(self, *args, **kwargs):
+        try:
+            return super().post(*args, **kwargs)
+        finally:
+            self.invalidate_response_cache()
+
+    def put(self, *args, **kwargs):
+        try:
+            return super().put(*args, **kwargs)
+        finally:
+            self.invalidate_response_cache()
+
+    def patch(self, *args, **kwargs):
+        try:
+            return super().patch(*args, **kwargs)
+        finally:
+            self.invalidate_response_cache()
+
+    def delete(self, *args, **kwargs):
+        try:
+            return super().delete(*args, **kwargs)
+        finally:
+            self.invalidate_response_cache()
+
+    def invalidate_response_cache(self) -> None:
+        """Forgets the cached responses for this base_endpoint, called after every write."""
+        base_endpoint = self.get_base_endpoint()
+        if self.response_cache and self.response_cache.get_timeout(base_endpoint):
+            self.response_cache.invalidate(base_endpoint)
+
     def get_trs_object_class(self):
         return self.trs_object_class
 
@@ -145,7 +295,6 @@ class BaseAPIClient(APIClient):
         fields = fields if fields else dict()
         params = params if params else dict()
         filter_parameters = filter_parameters if filter_parameters else dict()
-        slim = {}
 
         url = f"{settings.API_BASE_URL}/api/v2/{path}/"
         if fields:
@@ -155,11 +304,10 @@ class BaseAPIClient(APIClient):
             # can pass it over a URL (we could do this a different way with custom delimeters but
             # this seems nicer
             base64_json_filter_parameters = base64.urlsafe_b64encode(
-                json.dumps(filter_parameters, default=str).encode()
+                get_json_backend().dumps_bytes(filter_parameters, default=str)
             ).decode()
             filter_parameters = {"filter_parameters": base64_json_filter_parameters}
-        if slim:
-            slim = {"slim": "true"}
+        slim = {"slim": "true"} if slim else dict()
         if query_parameters := urllib.parse.urlencode(
             {**params, **fields, **filter_parameters, **slim}
         ):
@@ -204,11 +352,10 @@ class BaseAPIClient(APIClient):
         -------
         TRSObject
         """
-        trs_object_class = self.get_trs_object_class()
         data = self.patch(
             self.url(self.get_retrieve_endpoint(object_id), fields=fields), data=data
         )
-        return trs_object_class(data=data, api_client=self, object_id=data["id"])
+        return self.make_trs_object(data["id"], data=data, partial=bool(fields))
 
     def delete_object(self, object_id: Union[str, UUID]):
         """
@@ -220,34 +367,338 @@ class BaseAPIClient(APIClient):
         """
         return self.delete(self.url(self.get_retrieve_endpoint(object_id)))
 
+    def bulk_create(
+        self,
+        items: list[dict],
+        fields: list = None,
+        max_workers: int = None,
+        batch_size: int = 100,
+    ) -> BulkResults:
+        """
+        Creates an object for each dictionary of data in items, max_workers (default
+        API_BULK_MAX_WORKERS, 5) at a time.
+
+        If this client has a bulk_endpoint, items are instead POSTed to it as JSON lists of up to
+        batch_size items, and the API must respond with a list of the created objects in the same
+        order.
+
+        Parameters
+        ----------
+        items : a list of dictionaries of data, one per object
+        fields : what fields you want returned for each object
+        max_workers : how many requests to make at the same time
+        batch_size : the number of items sent per request to the bulk_endpoint
+
+        Returns
+        -------
+        BulkResults, with the TRSObject created (or the exception raised) for each item, in the
+        same order as items
+        """
+        if self.bulk_endpoint:
+            return run_bulk_batches(
+                lambda batch: self._bulk_objects(
+                    self._bulk_request("post", batch, fields=fields), partial=bool(fields)
+                ),
+                items,
+                batch_size,
+                max_workers,
+            )
+        url = self.url(self.get_base_endpoint(), fields=fields)
+        return run_bulk(lambda data: self._post(url, data=data), items, max_workers)
+
+    def bulk_update(
+        self,
+        items: list,
+        fields: list = None,
+        max_workers: int = None,
+        batch_size: int = 100,
+    ) -> BulkResults:
+        """
+        Updates many objects, max_workers at a time. Each item is either a dictionary of data
+        including the object's "id", or a TRSObject whose changed fields are saved, see
+        TRSObject.save().
+
+        If this client has a bulk_endpoint, items are instead PATCHed to it as JSON lists of up
+        to batch_size items, see bulk_create().
+
+        Returns
+        -------
+        BulkResults, with the updated TRSObject (or the exception raised) for each item, in the
+        same order as items
+        """
+        if self.bulk_endpoint:
+            return run_bulk_batches(
+                lambda batch: self._bulk_update_batch(batch, fields=fields),
+                items,
+                batch_size,
+                max_workers,
+            )
+
+        def update(item):
+            if isinstance(item, TRSObject):
+                return item.save(fields=fields)
+            data = {key: value for key, value in item.items() if key != "id"}
+            return self.update(item["id"], data, fields=fields)
+
+        return run_bulk(update, items, max_workers)
+
+    def bulk_delete(
+        self,
+        object_ids: list[Union[str, UUID]],
+        max_workers: int = None,
+        batch_size: int = 100,
+    ) -> BulkResults:
+        """
+        Deletes many objects by ID, max_workers at a time.
+
+        If this client has a bulk_endpoint, the IDs are instead sent to it in a DELETE request,
+        {"ids": [...]}, batch_size at a time.
+
+        Returns
+        -------
+        BulkResults, with the exception raised (if any) for each ID, in the same order
+        """
+        if self.bulk_endpoint:
+
+            def delete_batch(batch):
+                self._bulk_request("delete", {"ids": [str(each) for each in batch]})
+                return [None] * len(batch)
+
+            return run_bulk_batches(delete_batch, object_ids, batch_size, max_workers)
+        return run_bulk(self.delete_object, object_ids, max_workers)
+
+    def custom_action(
+        self,
+        object_id: Union[str, UUID],
+        method: str,
+        action_name: str,
+        data: dict = None,
+        fields: list = None,
+        params: dict = None,
+    ):
+        """
+        Sends a request to a custom @action of the object with object_id, see
+        TRSObject.custom_action().
+        """
+        request_method = getattr(self, method.lower())
+        url = self.url(
+            self.get_retrieve_endpoint(object_id, action_name),
+            fields=fields,
+            params=params,
+        )
+        if method in ["GET", "get"]:
+            return request_method(url)
+        return request_method(url, data=data or dict())
+
+    def run_action(
+        self,
+        action_name: str,
+        method: str,
+        object_ids: list[Union[str, UUID]],
+        data: Union[dict, list[dict]] = None,
+        fields: list = None,
+        params: dict = None,
+        max_workers: int = None,
+    ) -> BulkResults:
+        """
+        Sends the same custom @action to many objects, max_workers (default
+        API_BULK_MAX_WORKERS, 5) at a time.
+
+        Parameters
+        ----------
+        action_name : the name of the action in the API, see TRSObject.custom_action()
+        method : the method to make the requests with, e.g. GET or POST
+        object_ids : the IDs of the objects, an ID can be repeated to call it with different data,
+            those calls are made one after another, in order
+        data : the data sent to every object, or a list of data, one per object ID
+        fields : what fields do you want the API to return
+        params : what URL parameters you want to add to the API requests
+        max_workers : how many requests to make at the same time
+
+        Returns
+        -------
+        BulkResults, with the response (or the exception raised) for each object ID, in the same
+        order
+
+        Usage
+        -------
+        client.contacts.run_action("add_to_case", "patch", contact_ids, data={"case_id": ...})
+        """
+        object_ids = list(object_ids)
+        if isinstance(data, list):
+            if len(data) != len(object_ids):
+                raise ValueError("data must have one item per object ID")
+        else:
+            data = [data] * len(object_ids)
+
+        results = BulkResults(
+            BulkItemResult(index, object_id) for index, object_id in enumerate(object_ids)
+        )
+        # concurrent writes to the same object would race on the server, so the calls to each
+        # object are made one after another, and only different objects are called at once
+        calls_by_object = {}
+        for result in results:
+            calls_by_object.setdefault(str(result.item), []).append(result)
+
+        def run_calls(calls: list[BulkItemResult]):
+            for result in calls:
+                try:
+                    result.result = self.custom_action(
+                        result.item,
+                        method,
+                        action_name,
+                        data=data[result.index],
+                        fields=fields,
+                        params=params,
+                    )
+                except Exception as exc:
+                    result.exception = exc
+
+        run_bulk(run_calls, calls_by_object.values(), max_workers)
+        return results
+
+    def prefetch(self, trs_objects: list[TRSObject], max_workers: int = None) -> BulkResults:
+        """Loads many lazy objects at once, max_workers at a time, see TRSObject.prefetch().
+        Objects that are already loaded are skipped."""
+        return run_bulk(
+            TRSObject.prefetch,
+            [each for each in trs_objects if not each.is_loaded],
+            max_workers,
+        )
+
+    def _bulk_update_batch(self, batch: list, fields: list = None) -> list:
+        data = []
+        for item in batch:
+            if isinstance(item, TRSObject):
+                item = {**item.changed_data, "id": str(item.object_id)}
+            data.append(item)
+        results = self._bulk_objects(
+            self._bulk_request("patch", data, fields=fields), partial=bool(fields)
+        )
+        for item, result in zip(batch, results):
+            if isinstance(item, TRSObject):
+                item.changed_data = {}
+            if isinstance(item, TRSObject) and result is not item:
+                item.merge(result.data_dict, partial=bool(fields))
+        return results
+
+    def _bulk_request(self, method: str, data, fields: list = None):
+        """Sends data to the bulk_endpoint as JSON."""
+        url = self.url(f"{self.get_base_endpoint()}/{self.bulk_endpoint}", fields=fields)
+        kwargs = {}
+        if not issubclass(self.get_request_formatter(), TRSJsonRequestFormatter):
+            # lists can't be form-encoded
+            data = get_json_backend().dumps_bytes(data)
+            kwargs["headers"] = {"Content-Type": "application/json"}
+        return getattr(self, method)(url, data=data, **kwargs)
+
+    def _bulk_objects(self, response: list, partial: bool = False) -> list[TRSObject]:
+        return [
+            self.make_trs_object(
+                each["id"],
+                data=each,
+                partial=partial,
+            )
+            for each in response
+        ]
+
+    def make_trs_object(
+        self, object_id=None, data: dict = None, partial: bool = False, **kwargs
+    ) -> TRSObject:
+        """
+        Returns a new instance of the trs_object_class, or if this client has an identity map, the
+        existing object with object_id, with data merged into it.
+
+        Parameters
+        ----------
+        object_id : ID of the object
+        data : the object's data, None for a lazy object
+        partial : True if data only has some of the object's fields
+        kwargs : passed to the trs_object_class
+        """
+
+        def make_object():
+            if data is not None:
+                kwargs["data"] = data
+            trs_object = self.get_trs_object_class()(
+                api_client=self, object_id=object_id, **kwargs
+            )
+            trs_object._partial = partial
+            return trs_object
+
+        if self.identity_map is None or object_id is None:
+            return make_object()
+        fields = None
+        if data is None and partial:
+            fields = self.get_url_fields(kwargs.get("retrieval_url"))
+        return self.identity_map.get_or_add(
+            self.get_base_endpoint(),
+            object_id,
+            make_object,
+            data=data,
+            partial=partial,
+            fields=fields,
+        )
+
+    @staticmethod
+    def is_partial_url(url: str) -> bool:
+        """True if url only asks for some of the fields of the objects, see url()."""
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)
+        return "query" in query or "slim" in query
+
+    @staticmethod
+    def get_url_fields(url: str) -> Union[set, None]:
+        """Returns the (top-level) fields url asks for, None if it doesn't ask for any, see
+        url()."""
+        if not url:
+            return None
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query).get("query")
+        if not query:
+            return None
+        fields = query[0].strip()[1:-1]
+        # drops the fields of nested objects, e.g. "{id,type{name}}" -> "id,type"
+        while (nested := re.sub(r"{[^{}]*}", "", fields)) != fields:
+            fields = nested
+        return {field.strip() for field in fields.split(",") if field.strip()}
+
     def _post(self, url: str, data: dict):
         """Wraps POST requests to return a TRSObject"""
-        trs_object_class = self.get_trs_object_class()
         data = self.post(url, data=data)
-        return trs_object_class(
+        return self.make_trs_object(
+            data["id"],
             data=data,
-            api_client=self,
-            object_id=data["id"],
-            retrieval_url=self.get_retrieve_endpoint(object_id=data["id"]),
+            partial=self.is_partial_url(url),
         )
 
-    def _get(self, url: str, object_id: Union[str, UUID, None] = None):
+    def _get(
+        self,
+        url: str,
+        object_id: Union[str, UUID, None] = None,
+        projection: Projection = None,
+    ):
         """Wraps GET requests to return a TRSObject"""
-        trs_object_class = self.get_trs_object_class()
-        return trs_object_class(
-            api_client=self, retrieval_url=url, lazy=True, object_id=object_id
+        if projection is not None:
+            projection.set_url(url)
+        return self.make_trs_object(
+            object_id,
+            partial=self.is_partial_url(url),
+            retrieval_url=url,
+            lazy=True,
+            projection=projection,
         )
 
-    def _get_many(self, url: str):
+    def _get_many(self, url: str, projection: Projection = None):
         """Wraps GET requests to an endpoint that returns a list of objects"""
-        trs_object_class = self.get_trs_object_class()
+        if projection is not None:
+            projection.set_url(url)
+        partial = self.is_partial_url(url)
         return [
-            trs_object_class(
+            self.make_trs_object(
+                each["id"],
                 data=each,
-                api_client=self,
+                partial=partial,
                 lazy=False,
-                retrieval_url=self.get_retrieve_endpoint(object_id=each["id"]),
-                object_id=each["id"],
+                projection=projection,
             )
             for each in self.get(url)
         ]
@@ -257,7 +708,12 @@ class BaseAPIClient(APIClient):
         results = []
         with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
             # Start the load operations and mark each future with its URL
-            future_to_url = {executor.submit(self.get, url): url for url in urls}
+            # each call runs in a copy of the current context, so context-local state (e.g. the
+            # APICallTracker of the current request) follows it into the worker thread
+            future_to_url = {
+                executor.submit(contextvars.copy_context().run, self.get, url): url
+                for url in urls
+            }
 
             for future in concurrent.futures.as_completed(future_to_url):
                 url = future_to_url[future]
@@ -267,8 +723,11 @@ class BaseAPIClient(APIClient):
                     print("%r generated an exception: %s" % (url, exc))
 
         return [
-            self.trs_object_class(
-                data=each, api_client=self, lazy=False, object_id=each["id"]
+            self.make_trs_object(
+                each["id"],
+                data=each,
+                partial=any(self.is_partial_url(url) for url in urls),
+                lazy=False,
             )
             for each in results
         ]
@@ -2,6 +2,8 @@ from v2_api_client.library import BaseAPIClient, TRSObject
 
 
 class CaseObject(TRSObject):
+    __slots__ = ()
+
     def add_user(self, user_id):
         self.custom_action("post", "add_user", data={"user": user_id})
 
@@ -3,6 +3,8 @@ from v2_api_client.trs_object import TRSObject
 
 
 class ContactObject(TRSObject):
+    __slots__ = ()
+
     def change_organisation(self, organisation_id):
         return self.custom_action(
             "patch",
@@ -28,6 +30,19 @@ class ContactsAPIClient(BaseAPIClient):
     base_endpoint = "contacts"
     trs_object_class = ContactObject
 
+    def add_to_case(self, contact_ids, case_id, organisation_id=None, primary=False):
+        """Adds many contacts to a case concurrently, see ContactObject.add_to_case"""
+        return self.run_action(
+            "add_to_case",
+            "patch",
+            contact_ids,
+            data={
+                "case_id": case_id,
+                "organisation_id": organisation_id,
+                "primary": "yes" if primary else "no",
+            },
+        )
+
 
 class CaseContactsAPIClient(BaseAPIClient):
     base_endpoint = "case_contacts"
@@ -1,8 +1,130 @@
+"""The API's health check, used by our own liveness probes.
+
+Checks use the shared connection pool and time out after API_HEALTHCHECK_TIMEOUT seconds
+(default 2). When API_HEALTHCHECK_MAX_AGE (default 0, no caching) is set, a result is reused for
+that many seconds, after which the stale result is still returned while a single background
+thread refreshes it, so frequent probes from several load balancers don't each hit the API.
+"""
+import threading
+import time
+
 import requests
 from django.conf import settings
 
+from v2_api_client.transport import get_shared_session
+
+
+class HealthCheckResult:
+    """The outcome of a single health check, latency is in seconds."""
+
+    def __init__(
+        self,
+        status: str = None,
+        status_code: int = None,
+        latency: float = None,
+        exception: Exception = None,
+    ):
+        self.status = status
+        self.status_code = status_code
+        self.latency = latency
+        self.exception = exception
+        self.checked_at = time.monotonic()
+
+    @property
+    def ok(self) -> bool:
+        return self.exception is None and self.status_code == 200
+
+    @property
+    def age(self) -> float:
+        """Seconds since the check was made."""
+        return time.monotonic() - self.checked_at
+
+    def as_dict(self) -> dict:
+        return {
+            "ok": self.ok,
+            "status": self.status,
+            "status_code": self.status_code,
+            "latency": self.latency,
+            "age": self.age,
+            "exception": repr(self.exception) if self.exception else None,
+        }
+
+
+def check(timeout: float = None) -> HealthCheckResult:
+    """Calls the API's health check, a failure to connect is returned rather than raised."""
+    if timeout is None:
+        timeout = getattr(settings, "API_HEALTHCHECK_TIMEOUT", 2.0)
+    start = time.perf_counter()
+    try:
+        response = get_shared_session().get(
+            f"{settings.API_BASE_URL}/healthcheck", timeout=timeout
+        )
+    except requests.RequestException as exc:
+        return HealthCheckResult(latency=time.perf_counter() - start, exception=exc)
+    return HealthCheckResult(
+        status=response.text,
+        status_code=response.status_code,
+        latency=time.perf_counter() - start,
+    )
+
+
+class CachedHealthCheck:
+    """Reuses a health check result for max_age seconds, then refreshes it in the background."""
+
+    def __init__(self, max_age: float, timeout: float = None):
+        self.max_age = max_age
+        self.timeout = timeout
+        self.result = None
+        self.refreshing = False
+        self._lock = threading.Lock()
+
+    def get_result(self) -> HealthCheckResult:
+        if self.result is None:
+            # nothing to serve yet, the first callers have to wait
+            with self._lock:
+                if self.result is None:
+                    self.result = check(self.timeout)
+        elif self.result.age >= self.max_age:
+            self.refresh_in_background()
+        return self.result
+
+    def refresh_in_background(self) -> None:
+        with self._lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+        threading.Thread(target=self.refresh, daemon=True).start()
+
+    def refresh(self) -> None:
+        try:
+            self.result = check(self.timeout)
+        finally:
+            self.refreshing = False
+
+
+_cached_health_checks = {}
+_cached_health_checks_lock = threading.Lock()
+
+
+def get_result(max_age: float = None, timeout: float = None) -> HealthCheckResult:
+    """Returns a HealthCheckResult, no older than max_age seconds (plus the time it takes to
+    refresh it). max_age defaults to the API_HEALTHCHECK_MAX_AGE setting."""
+    if max_age is None:
+        max_age = getattr(settings, "API_HEALTHCHECK_MAX_AGE", 0)
+    if not max_age:
+        return check(timeout)
+
+    key = (settings.API_BASE_URL, max_age, timeout)
+    with _cached_health_checks_lock:
+        if key not in _cached_health_checks:
+            _cached_health_checks[key] = CachedHealthCheck(max_age, timeout)
+        cached_health_check = _cached_health_checks[key]
+    return cached_health_check.get_result()
+
 
-def get_status():
-    url = f"{settings.API_BASE_URL}/healthcheck"
-    response = requests.get(url)
-    return response.text
+def get_status(max_age: float = None, timeout: float = None) -> str:
+    """Returns the text of the API's health check response, raises if it couldn't be reached."""
+    result = get_result(max_age, timeout)
+    if result.exception:
+        raise result.exception
+    return result.status
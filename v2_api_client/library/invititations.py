@@ -2,6 +2,8 @@ from v2_api_client.library import BaseAPIClient, TRSObject
 
 
 class InvitationObject(TRSObject):
+    __slots__ = ()
+
     def send(self):
         return self.custom_action("post", "send_invitation")
 
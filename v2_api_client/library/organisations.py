@@ -3,6 +3,8 @@ from v2_api_client.trs_object import TRSObject
 
 
 class OrganisationObject(TRSObject):
+    __slots__ = ()
+
     def add_user(self, user_id, group_name, confirmed, **kwargs):
         return self.custom_action(
             "put",
@@ -63,6 +65,8 @@ class OrganisationCaseRoleAPIClient(BaseAPIClient):
 
 
 class OrganisationMergeRecordObject(TRSObject):
+    __slots__ = ()
+
     def get_draft_merged_organisation(self, **kwargs):
         return self.custom_action("get", "get_draft_merged_organisation", **kwargs)
 
@@ -4,6 +4,8 @@ from v2_api_client.library import BaseAPIClient, TRSObject
 
 
 class SubmissionObject(TRSObject):
+    __slots__ = ()
+
     def add_organisation_to_registration_of_interest(
             self,
             organisation_id,
@@ -27,6 +29,8 @@ class SubmissionObject(TRSObject):
 
 
 class SubmissionOrganisationMergeRecordObject(TRSObject):
+    __slots__ = ()
+
     def update(self, data: dict, fields: list = None) -> TRSObject:
         """The SubmissionOrganisationMergeRecordViewSet requires an organisation_id query parameter to
         be passed in the URL, so we need to override the update method to use the self.retrieval_url
@@ -36,6 +40,10 @@ class SubmissionOrganisationMergeRecordObject(TRSObject):
         )
         return self.__class__(data=data, api_client=self.api_client, object_id=data["id"])
 
+    def get_update_url(self, fields: list = None) -> str:
+        # see update()
+        return self.retrieval_url
+
 
 class SubmissionsAPIClient(BaseAPIClient):
     base_endpoint = "submissions"
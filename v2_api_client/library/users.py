@@ -2,6 +2,8 @@ from v2_api_client.library import BaseAPIClient, TRSObject
 
 
 class UserObject(TRSObject):
+    __slots__ = ()
+
     def send_verification_email(self):
         return self.custom_action("get", "send_verification_email")
 
@@ -0,0 +1,305 @@
+"""Adapts how hard the client pushes the API to how the API is coping.
+
+Enabled with the API_ADAPTIVE_LIMITER setting, True or a dict of AdaptiveLimiter arguments, e.g.
+{"max_limit": 20, "latency_target": 0.5}. One AdaptiveLimiter is shared by every client in the
+process, and every request made by a BaseAPIClient waits for it first.
+
+It limits both the number of requests in flight and (once the API has pushed back) their rate,
+using AIMD, like TCP's congestion control:
+
+- every successful request raises the in-flight limit by 1 / limit, so by about 1 per "round"
+  of requests, and the rate by rate_increase per second's worth of requests
+- a 429 or a timeout halves both (decrease_factor), at most once per cooldown, so a burst of
+  429s from requests that were already in flight only counts once
+- a request slower than latency_target, if set, shrinks the limit by latency_decrease_factor
+
+Set "cache" to a Django cache alias to share backoffs between processes, e.g. gunicorn workers
+on one host using a local memcached. A process that backs off publishes its new limits, and
+the others adopt them if they are lower.
+
+The current limits are exposed as gauges in v2_api_client.instrumentation.metrics.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import requests
+from apiclient.exceptions import UnexpectedError
+from django.conf import settings
+
+from v2_api_client import instrumentation
+from v2_api_client.exceptions import RateLimitedError
+
+SUCCESS = "success"
+THROTTLED = "throttled"
+TIMEOUT = "timeout"
+# e.g. a 404, the API coped fine, but it says nothing about how much more it could take
+IGNORED = "ignored"
+
+CACHE_KEY = "api_limiter:v1:backoff"
+
+
+def classify(exception: Exception = None) -> str:
+    """Returns the outcome of a request from the exception it raised, if any."""
+    if exception is None:
+        return SUCCESS
+    if isinstance(exception, RateLimitedError):
+        return THROTTLED
+    if isinstance(exception, UnexpectedError) and isinstance(
+        exception.__cause__, requests.Timeout
+    ):
+        return TIMEOUT
+    return IGNORED
+
+
+class AdaptiveLimiter:
+    """Limits the requests in flight, and their rate, with AIMD, see the module docstring.
+
+    Parameters
+    ----------
+    initial_limit, min_limit, max_limit : the number of requests allowed in flight at once
+    rate : requests per second, None for no rate limit until the API first pushes back
+    min_rate, max_rate : the bounds of rate, once it is set
+    rate_increase : how much the rate grows per second's worth of successful requests
+    burst : the most requests that can be made at once after being idle, by default the limit
+    decrease_factor : what the limit and rate are multiplied by after a 429 or a timeout
+    latency_target : seconds, slower requests shrink the limit by latency_decrease_factor
+    cooldown : seconds after a decrease before the next one
+    max_wait : seconds to wait for permission to make a request, before raising
+        RateLimitedError
+    cache : the alias of a Django cache to share backoffs between processes
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = 10,
+        min_limit: int = 1,
+        max_limit: int = 50,
+        rate: float = None,
+        min_rate: float = 1.0,
+        max_rate: float = 1000.0,
+        rate_increase: float = 1.0,
+        burst: int = None,
+        decrease_factor: float = 0.5,
+        latency_target: float = None,
+        latency_decrease_factor: float = 0.9,
+        cooldown: float = 1.0,
+        max_wait: float = 30.0,
+        cache: str = None,
+        registry: instrumentation.MetricsRegistry = None,
+    ):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.rate_increase = rate_increase
+        self.burst = burst
+        self.decrease_factor = decrease_factor
+        self.latency_target = latency_target
+        self.latency_decrease_factor = latency_decrease_factor
+        self.cooldown = cooldown
+        self.max_wait = max_wait
+        self.cache_alias = cache
+        self.in_flight = 0
+        self.tokens = float(burst or initial_limit)
+        self.last_refill = time.monotonic()
+        self.last_decrease = 0.0
+        self.last_sync = 0.0
+        # when recent requests finished, to set the first rate from the observed throughput
+        self.finished = deque(maxlen=1000)
+        self._condition = threading.Condition()
+
+        registry = registry or instrumentation.metrics
+        self.limit_gauge = registry.gauge(
+            "trs_api_client_limiter_limit", "Requests allowed in flight to the TRS API"
+        )
+        self.in_flight_gauge = registry.gauge(
+            "trs_api_client_limiter_in_flight", "Requests in flight to the TRS API"
+        )
+        self.rate_gauge = registry.gauge(
+            "trs_api_client_limiter_rate",
+            "Requests per second allowed to the TRS API, 0 when unlimited",
+        )
+        self.backoffs = registry.counter(
+            "trs_api_client_limiter_backoffs_total", "Times the limits were decreased"
+        )
+        self.update_gauges()
+
+    @classmethod
+    def from_settings(cls) -> AdaptiveLimiter | None:
+        options = getattr(settings, "API_ADAPTIVE_LIMITER", None)
+        if not options:
+            return None
+        return cls(**(options if isinstance(options, dict) else {}))
+
+    @property
+    def allowed_in_flight(self) -> int:
+        return max(self.min_limit, int(self.limit))
+
+    def refill(self, now: float) -> None:
+        if self.rate is None:
+            return
+        burst = self.burst or self.allowed_in_flight
+        self.tokens = min(burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def acquire(self) -> None:
+        """Waits until a request is allowed, raises RateLimitedError after max_wait seconds."""
+        deadline = time.monotonic() + self.max_wait
+        self.sync()
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                self.refill(now)
+                has_token = self.rate is None or self.tokens >= 1
+                if self.in_flight < self.allowed_in_flight and has_token:
+                    break
+                if now >= deadline:
+                    raise RateLimitedError(
+                        message="Waited too long for the client-side rate limit"
+                    )
+                wait = deadline - now
+                if not has_token:
+                    wait = min(wait, (1 - self.tokens) / self.rate)
+                self._condition.wait(wait)
+            if self.rate is not None:
+                self.tokens -= 1
+            self.in_flight += 1
+            self.update_gauges()
+
+    def release(self, outcome: str, latency: float) -> None:
+        """Records how a request went, adjusting the limits."""
+        publish = False
+        with self._condition:
+            now = time.monotonic()
+            self.in_flight -= 1
+            self.finished.append(now)
+            if outcome in (THROTTLED, TIMEOUT):
+                publish = self.decrease(now, self.decrease_factor, rate=True)
+            elif outcome == SUCCESS:
+                if self.latency_target and latency > self.latency_target:
+                    self.decrease(now, self.latency_decrease_factor, rate=False)
+                else:
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                    if self.rate is not None:
+                        self.rate = min(self.max_rate, self.rate + self.rate_increase / self.rate)
+            self.update_gauges()
+            self._condition.notify_all()
+        if publish:
+            self.publish()
+
+    def decrease(self, now: float, factor: float, rate: bool) -> bool:
+        """Multiplies the limit, and the rate if rate is True, by factor, unless it was already
+        decreased in the last cooldown seconds. Returns True if it was decreased."""
+        if now - self.last_decrease < self.cooldown:
+            return False
+        self.last_decrease = now
+        self.limit = max(self.min_limit, self.limit * factor)
+        if rate:
+            if self.rate is None:
+                # the first push back, start from the throughput that caused it
+                self.rate = self.get_observed_rate(now)
+                self.tokens = 0
+                self.last_refill = now
+            self.rate = max(self.min_rate, self.rate * factor)
+        self.backoffs.inc()
+        return True
+
+    def get_observed_rate(self, now: float) -> float:
+        """Requests per second finished in the last second."""
+        recent = sum(1 for each in self.finished if now - each <= 1)
+        return float(max(recent, self.min_rate))
+
+    @contextmanager
+    def request(self):
+        """Waits for permission to make a request, and records how it went."""
+        self.acquire()
+        start = time.perf_counter()
+        exception = None
+        try:
+            yield
+        except Exception as exc:
+            exception = exc
+            raise
+        finally:
+            self.release(classify(exception), time.perf_counter() - start)
+
+    def update_gauges(self) -> None:
+        self.limit_gauge.set(self.allowed_in_flight)
+        self.in_flight_gauge.set(self.in_flight)
+        self.rate_gauge.set(self.rate or 0)
+
+    def as_dict(self) -> dict:
+        return {
+            "limit": self.allowed_in_flight,
+            "in_flight": self.in_flight,
+            "rate": self.rate,
+        }
+
+    def get_cache(self):
+        from django.core.cache import caches
+
+        return caches[self.cache_alias]
+
+    def publish(self) -> None:
+        """Shares this process' backoff with the others using the same cache."""
+        if not self.cache_alias:
+            return
+        try:
+            self.get_cache().set(
+                CACHE_KEY,
+                {"limit": self.limit, "rate": self.rate},
+                timeout=max(1, int(self.cooldown * 10)),
+            )
+        except Exception:
+            # never fail a request because the cache is down
+            pass
+
+    def sync(self) -> None:
+        """Adopts a lower limit published by another process, checked at most once per
+        cooldown."""
+        now = time.monotonic()
+        if not self.cache_alias or now - self.last_sync < self.cooldown:
+            return
+        self.last_sync = now
+        try:
+            shared = self.get_cache().get(CACHE_KEY)
+        except Exception:
+            return
+        if not shared:
+            return
+        with self._condition:
+            if shared["limit"] < self.limit:
+                self.limit = shared["limit"]
+                self.last_decrease = now
+            if shared["rate"] is not None and (self.rate is None or shared["rate"] < self.rate):
+                self.rate = shared["rate"]
+                self.tokens = min(self.tokens, 1)
+            self.update_gauges()
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter() -> AdaptiveLimiter | None:
+    """Returns the limiter shared by every client in this process, None if it's disabled."""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = AdaptiveLimiter.from_settings() or False
+    return _limiter or None
+
+
+def reset_limiter() -> None:
+    """Forgets the shared limiter, e.g. after the settings change or in a worker after a
+    fork."""
+    global _limiter
+    with _limiter_lock:
+        _limiter = None
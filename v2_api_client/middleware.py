@@ -0,0 +1,173 @@
+import contextvars
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from v2_api_client import instrumentation
+from v2_api_client.exceptions import APICallBudgetExceededError
+
+logger = logging.getLogger(__name__)
+
+_current_tracker = contextvars.ContextVar("api_call_tracker", default=None)
+
+
+class APICallTracker:
+    """Counts the API calls made while handling a single request.
+
+    Parameters
+    ----------
+    budget : the maximum number of API calls allowed, None for no limit
+    repeat_threshold : the maximum number of consecutive calls to the same endpoint pattern
+    (e.g. GET cases/{id}), None for no limit. Hitting this is the tell-tale sign of lazy
+    TRSObjects being loaded one by one in a loop
+    raise_on_violation : if True, APICallBudgetExceededError is raised from the call that broke
+    a limit, otherwise the violation is only logged
+    """
+
+    def __init__(
+        self,
+        budget: int = None,
+        repeat_threshold: int = None,
+        raise_on_violation: bool = False,
+    ):
+        self.budget = budget
+        self.repeat_threshold = repeat_threshold
+        self.raise_on_violation = raise_on_violation
+        self.calls = 0
+        self.cache_hits = 0
+        self.total_time = 0.0
+        self.url_counts = Counter()
+        self.violations = []
+        self._last_pattern = None
+        self._repeat_count = 0
+        self._lock = threading.Lock()
+
+    def record(self, event: instrumentation.RequestEvent) -> None:
+        if event.cache_hit:
+            # served from the response cache, the API wasn't called
+            with self._lock:
+                self.cache_hits += 1
+            return
+
+        with self._lock:
+            self.calls += 1
+            self.total_time += event.total_time or 0
+            self.url_counts[f"{event.method} {event.url}"] += 1
+
+            pattern = f"{event.method} {event.path}"
+            if pattern == self._last_pattern:
+                self._repeat_count += 1
+            else:
+                self._last_pattern = pattern
+                self._repeat_count = 1
+
+            violation = None
+            if self.budget is not None and self.calls == self.budget + 1:
+                violation = f"More than {self.budget} API calls were made"
+            elif self.repeat_threshold is not None and (
+                self._repeat_count == self.repeat_threshold + 1
+            ):
+                violation = (
+                    f"{pattern} was called more than {self.repeat_threshold} times in a row, "
+                    "this is likely an N+1 query"
+                )
+            if violation:
+                self.violations.append(violation)
+
+        if violation and self.raise_on_violation:
+            raise APICallBudgetExceededError(violation)
+
+    @property
+    def duplicate_urls(self) -> dict:
+        """{"METHOD url": number of calls} for the URLs that were called more than once."""
+        return {url: count for url, count in self.url_counts.items() if count > 1}
+
+    def summary(self) -> dict:
+        return {
+            "api_calls": self.calls,
+            "cache_hits": self.cache_hits,
+            "api_time": round(self.total_time, 4),
+            "duplicate_urls": self.duplicate_urls,
+            "violations": self.violations,
+        }
+
+
+class APICallTrackingObserver(instrumentation.BaseObserver):
+    """Passes request events on to the APICallTracker of the current request, if any."""
+
+    def request_finished(self, event: instrumentation.RequestEvent) -> None:
+        if tracker := _current_tracker.get():
+            tracker.record(event)
+
+
+_tracking_observer = APICallTrackingObserver()
+
+
+def get_current_tracker():
+    """Returns the APICallTracker for the current context, or None if calls aren't tracked."""
+    return _current_tracker.get()
+
+
+@contextmanager
+def track_api_calls(**kwargs):
+    """Tracks the API calls made inside the block, e.g. in a management command or test
+
+    with track_api_calls(budget=10) as tracker:
+        ...
+    tracker.calls --> 3
+    """
+    instrumentation.register_observer(_tracking_observer)
+    tracker = APICallTracker(**kwargs)
+    token = _current_tracker.set(tracker)
+    try:
+        yield tracker
+    finally:
+        _current_tracker.reset(token)
+
+
+class APICallBudgetMiddleware:
+    """Counts the API calls (and the time spent on them) made while handling each request, and
+    logs a summary.
+
+    The tracker is available as request.api_calls. Configured with the following settings:
+
+    API_CALL_BUDGET : the maximum number of API calls per request, default None (no limit)
+    API_CALL_REPEAT_THRESHOLD : the maximum number of consecutive calls to the same endpoint
+    pattern, default None (no limit)
+    API_CALL_BUDGET_RAISE : raise APICallBudgetExceededError when a limit is broken rather than
+    logging a warning, defaults to DEBUG so it only raises in dev/test
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.budget = getattr(settings, "API_CALL_BUDGET", None)
+        self.repeat_threshold = getattr(settings, "API_CALL_REPEAT_THRESHOLD", None)
+        self.raise_on_violation = getattr(
+            settings, "API_CALL_BUDGET_RAISE", getattr(settings, "DEBUG", False)
+        )
+        instrumentation.register_observer(_tracking_observer)
+
+    def __call__(self, request):
+        with track_api_calls(
+            budget=self.budget,
+            repeat_threshold=self.repeat_threshold,
+            raise_on_violation=self.raise_on_violation,
+        ) as tracker:
+            request.api_calls = tracker
+            response = self.get_response(request)
+
+        if tracker.calls:
+            summary = tracker.summary()
+            logger.log(
+                logging.WARNING if tracker.violations else logging.INFO,
+                "%s %s made %s API calls taking %.1fms",
+                request.method,
+                request.path,
+                tracker.calls,
+                tracker.total_time * 1000,
+                extra={"api_calls": summary},
+            )
+        return response
@@ -25,3 +25,11 @@ class APIClientMixin:
         else:
             kwargs.setdefault("token", settings.HEALTH_CHECK_TOKEN)
         return TRSAPIClient(*args, **kwargs)
+
+    @property
+    def api_calls(self):
+        """
+        Return the APICallTracker counting the API calls made for this request, if the
+        APICallBudgetMiddleware is installed, else None.
+        """
+        return getattr(self.request, "api_calls", None)
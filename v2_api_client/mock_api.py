@@ -0,0 +1,384 @@
+"""Local stand-ins for the TRS API, for tests and benchmarks.
+
+ReplayAdapter is a requests transport adapter that serves recorded responses, keyed by method and
+URL, without any network access at all:
+
+adapter = ReplayAdapter.from_file("fixtures/cases.json")
+mount_on_client(client, adapter)  # client is a TRSAPIClient
+client.cases(case_id).name --> served from the recording
+
+MockAPIServer is a small in-process HTTP server emulating the /api/v2/<resource>/ CRUD,
+filter_parameters and @action routes used by the library modules, with configurable injected
+latency, errors and 429s. Everything random is seeded, so runs are deterministic:
+
+with MockAPIServer(latency=0.005, throttle_rate=0.1, seed=1, compress_responses=True) as server:
+    server.add("cases", {"id": case_id, "name": "Steel"})
+    settings.API_BASE_URL = server.url
+    ...
+"""
+from __future__ import annotations
+
+import base64
+import gzip
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from django.conf import settings
+from requests import Response
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+from v2_api_client.library import BaseAPIClient
+
+
+class MissingRecordingError(LookupError):
+    """The ReplayAdapter has no recorded response for a request."""
+
+
+def mount_on_client(client, adapter, prefix: str = None):
+    """Mounts adapter on the session of every object client of a TRSAPIClient (or on a single
+    BaseAPIClient) for URLs starting with prefix, by default the API_BASE_URL."""
+    prefix = prefix or settings.API_BASE_URL
+    api_clients = [client] if isinstance(client, BaseAPIClient) else vars(client).values()
+    for api_client in api_clients:
+        if isinstance(api_client, BaseAPIClient):
+            api_client.get_session().mount(prefix, adapter)
+    return client
+
+
+class ReplayAdapter(BaseAdapter):
+    """Serves recorded responses, {(method, url): (status, body)}.
+
+    URLs are relative to the API_BASE_URL, e.g. "/api/v2/cases/?slim=true", so recordings work
+    whatever the API is called in a particular environment.
+    """
+
+    def __init__(self, recordings: dict = None):
+        super().__init__()
+        self.recordings = dict(recordings or {})
+        self.requests = []
+
+    @staticmethod
+    def get_key(method: str, url: str) -> tuple:
+        parts = urlsplit(url)
+        path = f"{parts.path}?{parts.query}" if parts.query else parts.path
+        return method.upper(), path
+
+    def add(self, method: str, url: str, body, status: int = 200) -> None:
+        self.recordings[self.get_key(method, url)] = (status, body)
+
+    @classmethod
+    def from_file(cls, path: str) -> ReplayAdapter:
+        """Loads recordings saved with save(), or by RecordingAdapter.save()."""
+        with open(path) as recordings_file:
+            recordings = json.load(recordings_file)
+        return cls(
+            {
+                (each["method"], each["url"]): (each["status"], each["body"])
+                for each in recordings
+            }
+        )
+
+    def save(self, path: str) -> None:
+        recordings = [
+            {"method": method, "url": url, "status": status, "body": body}
+            for (method, url), (status, body) in self.recordings.items()
+        ]
+        with open(path, "w") as recordings_file:
+            json.dump(recordings, recordings_file, indent=2, default=str)
+
+    def send(self, request, **kwargs):
+        key = self.get_key(request.method, request.url)
+        self.requests.append(key)
+        try:
+            status, body = self.recordings[key]
+        except KeyError:
+            raise MissingRecordingError(f"No recorded response for {key[0]} {key[1]}")
+
+        response = Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict({"Content-Type": "application/json"})
+        response._content = json.dumps(body).encode() if body is not None else b""
+        response.url = request.url
+        response.request = request
+        response.reason = "Recorded"
+        return response
+
+    def close(self):
+        pass
+
+
+class RecordingAdapter(ReplayAdapter):
+    """Makes real requests, recording the responses so they can be saved and replayed later."""
+
+    def __init__(self, adapter: BaseAdapter = None, recordings: dict = None):
+        super().__init__(recordings)
+        if adapter is None:
+            from v2_api_client.transport import TimedHTTPAdapter
+
+            adapter = TimedHTTPAdapter()
+        self.adapter = adapter
+
+    def send(self, request, **kwargs):
+        response = self.adapter.send(request, **kwargs)
+        body = response.json() if response.content else None
+        self.recordings[self.get_key(request.method, request.url)] = (
+            response.status_code,
+            body,
+        )
+        return response
+
+    def close(self):
+        self.adapter.close()
+
+
+class MockAPIRequestHandler(BaseHTTPRequestHandler):
+    # keep-alive, so connection pooling can be benchmarked
+    protocol_version = "HTTP/1.1"
+    # the headers and body are written separately, without TCP_NODELAY every response on a
+    # kept-alive connection waits for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.handle_api_request()
+
+    def do_POST(self):
+        self.handle_api_request()
+
+    def do_PUT(self):
+        self.handle_api_request()
+
+    def do_PATCH(self):
+        self.handle_api_request()
+
+    def do_DELETE(self):
+        self.handle_api_request()
+
+    def read_body(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        body = self.rfile.read(length)
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+            self.server.mock_api.compressed_request_bodies += 1
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            return json.loads(body)
+        # the client form-encodes request bodies by default
+        return {
+            key: value[0] if len(value) == 1 else value
+            for key, value in parse_qs(body.decode(), keep_blank_values=True).items()
+        }
+
+    def handle_api_request(self):
+        data = self.read_body()
+        path, _, query_string = self.path.partition("?")
+        status, body, headers = self.server.mock_api.handle(
+            self.command, path, parse_qs(query_string), data
+        )
+        if isinstance(body, str):
+            content, content_type = body.encode(), "text/plain"
+        else:
+            content = json.dumps(body, default=str).encode() if body is not None else b""
+            content_type = "application/json"
+        self.send_response(status)
+        if self.server.mock_api.compress_responses and "gzip" in self.headers.get(
+            "Accept-Encoding", ""
+        ):
+            content = gzip.compress(content, compresslevel=6)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        for header, value in headers.items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class MockAPIServer:
+    """An in-process HTTP server emulating the TRS API.
+
+    Parameters
+    ----------
+    latency : seconds added to every response, or a (min, max) tuple to pick from at random
+    error_rate : the fraction of requests that get a 500 response
+    throttle_rate : the fraction of requests that get a 429 response
+    retry_after : the Retry-After header sent with the 429s
+    seed : seeds the random number generator used for latency, errors, throttling and IDs
+    compress_responses : gzips the responses to requests that accept it
+    """
+
+    def __init__(
+        self,
+        latency: float | tuple = 0,
+        error_rate: float = 0,
+        throttle_rate: float = 0,
+        retry_after: int = 1,
+        seed: int = 0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        compress_responses: bool = False,
+    ):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.compress_responses = compress_responses
+        self.compressed_request_bodies = 0
+        self.random = random.Random(seed)
+        self.resources = {}
+        self.actions = {}
+        self.requests = []
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), MockAPIRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.mock_api = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """The URL to use as the API_BASE_URL."""
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> MockAPIServer:
+        self._thread = threading.Thread(
+            target=self.httpd.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def add(self, resource: str, *objects: dict) -> list:
+        """Adds objects to resource, an "id" is generated for those that don't have one."""
+        with self._lock:
+            store = self.resources.setdefault(resource, {})
+            for each in objects:
+                each.setdefault("id", self.new_id())
+                store[str(each["id"])] = each
+        return list(objects)
+
+    def generate(self, resource: str, count: int, factory=None) -> list:
+        """Adds count objects to resource, factory(index) returns each object's data."""
+        factory = factory or (lambda index: {"name": f"{resource} {index}"})
+        return self.add(resource, *(factory(index) for index in range(count)))
+
+    def add_action(self, resource: str, action_name: str, handler, detail: bool = True):
+        """Adds an @action route, /api/v2/<resource>/<id>/<action_name>/ when detail is True,
+        else /api/v2/<resource>/<action_name>/.
+
+        handler(method, obj, data, query) returns the response body, or a (status, body) tuple,
+        obj is None for non-detail actions.
+        """
+        self.actions[(resource, action_name, detail)] = handler
+
+    def new_id(self) -> str:
+        return str(uuid.UUID(int=self.random.getrandbits(128), version=4))
+
+    def handle(self, method: str, path: str, query: dict, data: dict) -> tuple:
+        """Returns (status, body, headers) for a request."""
+        with self._lock:
+            self.requests.append((method, path))
+            latency = self.latency
+            if isinstance(latency, tuple):
+                latency = self.random.uniform(*latency)
+            fault = self.random.random()
+        if latency:
+            time.sleep(latency)
+        if fault < self.throttle_rate:
+            return 429, {"detail": "Request was throttled."}, {
+                "Retry-After": str(self.retry_after)
+            }
+        if fault < self.throttle_rate + self.error_rate:
+            return 500, {"detail": "Injected error."}, {}
+
+        if path.rstrip("/") == "/healthcheck":
+            return 200, "OK", {}
+        parts = path.strip("/").split("/")
+        if parts[:2] != ["api", "v2"] or len(parts) < 3:
+            return 404, {"detail": "Not found."}, {}
+        status, body = self.route(method, parts[2], parts[3:], query, data)
+        if query.get("query") and status < 300:
+            body = self.select_fields(body, query["query"][0])
+        return status, body, {}
+
+    def route(self, method: str, resource: str, parts: list, query: dict, data: dict):
+        store = self.resources.setdefault(resource, {})
+        if not parts:
+            if method == "GET":
+                return 200, self.filter(list(store.values()), query)
+            if method == "POST":
+                return 201, self.add(resource, dict(data))[0]
+        elif len(parts) == 1 and (resource, parts[0], False) in self.actions:
+            return self.run_action(
+                self.actions[(resource, parts[0], False)], method, None, data, query
+            )
+        elif (obj := store.get(parts[0])) is None:
+            return 404, {"detail": "Not found."}
+        elif len(parts) == 1:
+            if method == "GET":
+                return 200, obj
+            if method in ("PATCH", "PUT"):
+                with self._lock:
+                    obj.update(data)
+                return 200, obj
+            if method == "DELETE":
+                with self._lock:
+                    del store[parts[0]]
+                return 204, None
+        elif (resource, parts[1], True) in self.actions:
+            return self.run_action(
+                self.actions[(resource, parts[1], True)], method, obj, data, query
+            )
+        else:
+            return 404, {"detail": "Not found."}
+        return 405, {"detail": f'Method "{method}" not allowed.'}
+
+    @staticmethod
+    def run_action(handler, method: str, obj, data: dict, query: dict) -> tuple:
+        result = handler(method, obj, data, query)
+        if isinstance(result, tuple):
+            return result
+        return 200, result
+
+    @staticmethod
+    def filter(objects: list, query: dict) -> list:
+        """Applies the equality filters passed as filter_parameters, like the API does."""
+        if encoded := query.get("filter_parameters"):
+            filter_parameters = json.loads(base64.urlsafe_b64decode(encoded[0]))
+            objects = [
+                each
+                for each in objects
+                if all(
+                    str(each.get(key)) == str(value)
+                    for key, value in filter_parameters.items()
+                )
+            ]
+        return objects
+
+    @staticmethod
+    def select_fields(body, query: str):
+        """A minimal version of the API's field selection, "{id,name}"."""
+        fields = query.strip("{}").split(",")
+        if isinstance(body, list):
+            return [{k: v for k, v in each.items() if k in fields} for each in body]
+        if isinstance(body, dict):
+            return {k: v for k, v in body.items() if k in fields}
+        return body
@@ -0,0 +1,126 @@
+"""Automatic field projection, opt-in with TRSAPIClient(projection=True) or the
+API_FIELD_PROJECTION setting.
+
+The first time a call site (e.g. a particular line in a view) retrieves objects, the full
+serializer is returned and the TRSObjects record which fields are actually accessed. Later calls
+from the same call site only ask the API for those fields using the "query" GET parameter.
+
+If a projected object is asked for a field it wasn't retrieved with, it is re-fetched in full
+(and the field remembered for next time), so projection can never change what your code sees.
+The objects of a list are re-fetched together, by listing them again without the projection,
+once for the whole list rather than once per object.
+
+Using a whole object (its data_dict, e.g. encoders.dumps() or iterating over it) re-fetches it
+in full too, and turns projection off for that call site.
+"""
+from __future__ import annotations
+
+import sys
+import threading
+import urllib.parse
+
+# frames in these modules are part of the client, the call site is the first frame outside them
+INTERNAL_MODULE_PREFIXES = (
+    "v2_api_client.library",
+    "v2_api_client.trs_object",
+    "v2_api_client.client",
+    "v2_api_client.mixins",
+    "v2_api_client.projection",
+)
+
+
+class Projection:
+    """The fields requested for a single call from a particular call site."""
+
+    def __init__(self, projector: FieldProjector, key: tuple, fields: list = None):
+        self.projector = projector
+        self.key = key
+        self.fields = fields
+        # the URL the objects were retrieved from, without the projection
+        self.unprojected_url = None
+        self.unprojected_data = None
+        self._lock = threading.Lock()
+
+    def record(self, field: str) -> None:
+        self.projector.record(self.key, field)
+
+    def record_all(self) -> None:
+        self.projector.record_all(self.key)
+
+    def set_url(self, url: str) -> None:
+        """Records the URL the objects were retrieved from, so they can be re-fetched in full."""
+        parts = urllib.parse.urlsplit(url)
+        query = [
+            (name, value)
+            for name, value in urllib.parse.parse_qsl(parts.query)
+            if name != "query"
+        ]
+        self.unprojected_url = parts._replace(query=urllib.parse.urlencode(query)).geturl()
+
+    def get_unprojected_data(self, api_client, object_id) -> dict | None:
+        """Returns all the fields of the object with object_id, re-fetching every object
+        retrieved by this call the first time it's called. None if it wasn't re-fetched."""
+        if self.unprojected_url is None:
+            return None
+        with self._lock:
+            if self.unprojected_data is None:
+                data = api_client.get(self.unprojected_url)
+                if isinstance(data, dict):
+                    data = [data]
+                self.unprojected_data = {str(each["id"]): each for each in data}
+            # each object only needs its data once, so it's not kept alive by the projection
+            return self.unprojected_data.pop(str(object_id), None)
+
+
+class FieldProjector:
+    """Remembers which fields are accessed on the objects retrieved from each call site."""
+
+    def __init__(self):
+        self.accessed_fields = {}
+        # call sites that use whole objects, so there's no telling which fields they need
+        self.unprojected_keys = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_call_site() -> tuple:
+        """Returns (filename, line number) of the first frame outside the API client."""
+        frame = sys._getframe(1)
+        while frame is not None:
+            if not frame.f_globals.get("__name__", "").startswith(INTERNAL_MODULE_PREFIXES):
+                return frame.f_code.co_filename, frame.f_lineno
+            frame = frame.f_back
+        return None, None
+
+    def start(self, base_endpoint: str) -> Projection:
+        """Returns the Projection to use for a call to base_endpoint from the current call site.
+
+        The fields are None if nothing has been recorded yet, so everything is retrieved.
+        """
+        key = (base_endpoint, *self.get_call_site())
+        with self._lock:
+            fields = None if key in self.unprojected_keys else self.accessed_fields.get(key)
+            if fields:
+                fields = sorted(fields | {"id"})
+        return Projection(self, key, fields or None)
+
+    def record(self, key: tuple, field: str) -> None:
+        fields = self.accessed_fields.get(key)
+        if fields is not None and field in fields:
+            # the common case, no need to take the lock
+            return
+        with self._lock:
+            self.accessed_fields.setdefault(key, set()).add(field)
+
+    def record_all(self, key: tuple) -> None:
+        if key in self.unprojected_keys:
+            return
+        with self._lock:
+            self.unprojected_keys.add(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.accessed_fields = {}
+            self.unprojected_keys = set()
+
+
+field_projector = FieldProjector()
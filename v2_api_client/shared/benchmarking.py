@@ -0,0 +1,35 @@
+"""Helpers shared by the benchmarks, see v2_api_client.benchmarks and
+v2_api_client.shared.upload_handler.benchmarks."""
+
+
+def percentile(values: list, percent: float) -> float:
+    """The nearest-rank percentile of values."""
+    ordered = sorted(values)
+    index = max(int(round(percent / 100 * len(ordered))) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def compare_results(
+    baseline: dict, current: dict, checks: tuple, threshold: float = 0.1, name_width: int = 22
+) -> list:
+    """Compares two saved runs of a benchmark, printing the change in every metric.
+
+    checks are (metric, True if bigger is better) pairs. Returns a list of regression messages,
+    a regression is when a metric gets worse by more than threshold (a fraction).
+    """
+    regressions = []
+    for name, current_result in current["results"].items():
+        if not (baseline_result := baseline["results"].get(name)):
+            continue
+        for metric, bigger_is_better in checks:
+            if metric not in baseline_result or metric not in current_result:
+                # saved by an older version of the benchmarks, or not measured by this one
+                continue
+            before, after = baseline_result[metric], current_result[metric]
+            change = (after - before) / before if before else 0
+            print(f"{name:<{name_width}}{metric:<22}{before:>14.2f}{after:>14.2f}{change:>+9.1%}")
+            if (bigger_is_better and change < -threshold) or (
+                not bigger_is_better and change > threshold
+            ):
+                regressions.append(f"{name} {metric} regressed by {abs(change):.1%}")
+    return regressions
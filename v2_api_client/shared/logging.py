@@ -5,6 +5,24 @@ import environ
 from django_log_formatter_ecs import ECSFormatter
 
 
+# every LogRecord has these attributes, anything else on a record was passed with extra=
+LOG_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message",
+    "asctime",
+}
+
+
+def get_extra_details(record: logging.LogRecord):
+    """Returns the extra= dict a record was logged with, or None."""
+    if (extra_details := getattr(record, "extra_details", None)) is not None:
+        return extra_details
+    return {
+        key: value
+        for key, value in vars(record).items()
+        if key not in LOG_RECORD_ATTRIBUTES
+    } or None
+
+
 def make_record_with_extra(
     self, name, level, fn, lno, msg, args, exc_info, func=None, extra=None, sinfo=None
 ):
@@ -16,13 +34,19 @@ def make_record_with_extra(
 
 
 original_makeRecord = logging.Logger.makeRecord
-logging.Logger.makeRecord = make_record_with_extra
+
+
+def install_make_record_with_extra():
+    """Patches every LogRecord to have an extra_details attribute, the extra= dict it was logged
+    with. This used to happen on import of this module, call it (e.g. in settings) if you rely
+    on record.extra_details, the formatters here use get_extra_details() instead."""
+    logging.Logger.makeRecord = make_record_with_extra
 
 
 class AuditLogFormatter(ECSFormatter):
     def format(self, record):
         formatted_log = f"AUDIT LOG - {record.levelname} - {record.msg}"
-        if extra_details := getattr(record, "extra_details", None):
+        if extra_details := get_extra_details(record):
             formatted_log += f" - {extra_details}"
 
         return formatted_log
@@ -90,6 +114,13 @@ PRODUCTION_LOGGING = {
             "level": env("DJANGO_REQUEST_LOG_LEVEL", default="ERROR"),
             "propagate": False,
         },
+        "v2_api_client": {
+            "handlers": [
+                "ecs",
+            ],
+            "level": env("API_CLIENT_LOG_LEVEL", default="INFO"),
+            "propagate": False,
+        },
         "django.db.backends": {
             "handlers": [
                 "ecs",
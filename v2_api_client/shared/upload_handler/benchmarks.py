@@ -0,0 +1,451 @@
+"""Benchmarks for the metadata extractors.
+
+These aren't collected by pytest, run them directly, e.g.
+
+python -m v2_api_client.shared.upload_handler.benchmarks extractors --output before.json
+python -m v2_api_client.shared.upload_handler.benchmarks extractors --output after.json
+python -m v2_api_client.shared.upload_handler.benchmarks compare before.json after.json
+python -m v2_api_client.shared.upload_handler.benchmarks pdf-save --corpus ~/sample_pdfs
+
+The documents are generated from a fixed seed, so runs with the same arguments benchmark
+exactly the same bytes.
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import platform
+import random
+import resource
+import statistics
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pikepdf
+from openpyxl import Workbook
+
+from v2_api_client.shared import benchmarking
+from v2_api_client.shared.benchmarking import percentile
+from v2_api_client.shared.upload_handler.metadata import (
+    DOCX_CONTENT_TYPE,
+    ODT_CONTENT_TYPE,
+    PDF_CONTENT_TYPE,
+    XLSX_CONTENT_TYPE,
+    ZIP_CONTENT_TYPE,
+    MicrosoftDocExtractor,
+    OpenDocumentExtractor,
+    PDFExtractor,
+    PDFSaveOptions,
+    ZIPExtractor,
+    read_sanitised_data,
+)
+
+SEED = 1234
+PDF_SAVE_PRESETS = {
+    # what PDFExtractor did before the save options were configurable
+    "pikepdf-defaults": PDFSaveOptions(object_stream_mode="preserve"),
+    "object-streams": PDFSaveOptions(),
+    "recompressed": PDFSaveOptions(recompress_flate=True),
+    "linearized": PDFSaveOptions(linearize=True),
+    "spooled": PDFSaveOptions(spool_max_size=1024 * 1024),
+}
+CORE_PROPERTIES = (
+    b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    b'<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/'
+    b'core-properties" xmlns:dc="http://purl.org/dc/elements/1.1/">'
+    b"<dc:creator>TRA</dc:creator><dc:title>Synthetic benchmark document</dc:title>"
+    b"<cp:lastModifiedBy>TRA</cp:lastModifiedBy></cp:coreProperties>"
+)
+
+
+def random_bytes(rng: random.Random, size: int) -> bytes:
+    """Incompressible bytes, standing in for embedded images."""
+    return rng.getrandbits(size * 8).to_bytes(size, "little") if size else b""
+
+
+def generate_pdf(pages: int = 10, images: int = 0, image_size: int = 64 * 1024) -> bytes:
+    """Generates a PDF with some text on each page, images spread across the pages, and
+    document metadata to strip."""
+    rng = random.Random(SEED)
+    pdf = pikepdf.new()
+    font = pdf.make_indirect(
+        pikepdf.Dictionary(
+            Type=pikepdf.Name.Font,
+            Subtype=pikepdf.Name.Type1,
+            BaseFont=pikepdf.Name.Helvetica,
+        )
+    )
+    # a square RGB image that is image_size bytes
+    image_side = max(int((image_size / 3) ** 0.5), 1)
+    for page_number in range(pages):
+        lines = b"".join(
+            b"(Page %d, line %d of the synthetic benchmark document) Tj T* "
+            % (page_number, line)
+            for line in range(40)
+        )
+        content = b"BT /F1 10 Tf 14 TL 50 800 Td " + lines + b"ET"
+        page = pdf.add_blank_page(page_size=(595, 842))
+        page.Resources = pikepdf.Dictionary(
+            Font=pikepdf.Dictionary(F1=font), XObject=pikepdf.Dictionary()
+        )
+        for image_number in range(page_number, images, max(pages, 1)):
+            image = pdf.make_stream(
+                random_bytes(rng, image_side * image_side * 3),
+                Type=pikepdf.Name.XObject,
+                Subtype=pikepdf.Name.Image,
+                Width=image_side,
+                Height=image_side,
+                ColorSpace=pikepdf.Name.DeviceRGB,
+                BitsPerComponent=8,
+            )
+            page.Resources.XObject[f"/Im{image_number}"] = image
+            content += b" q 100 0 0 100 50 50 cm /Im%d Do Q" % image_number
+        page.Contents = pdf.make_stream(content)
+
+    with pdf.open_metadata() as meta:
+        meta["dc:creator"] = ["TRA"]
+        meta["dc:title"] = "Synthetic benchmark document"
+    data = io.BytesIO()
+    pdf.save(data, compress_streams=False, object_stream_mode=pikepdf.ObjectStreamMode.disable)
+    return data.getvalue()
+
+
+def generate_xlsx(sheets: int = 3, rows: int = 1000) -> bytes:
+    workbook = Workbook()
+    workbook.properties.creator = "TRA"
+    workbook.properties.title = "Synthetic benchmark document"
+    for sheet_number in range(sheets):
+        if sheet_number == 0:
+            sheet = workbook.active
+        else:
+            sheet = workbook.create_sheet()
+        for row in range(rows):
+            sheet.append([row, f"Sheet {sheet_number} row {row}", row * 1.5, "anti-dumping"])
+    data = io.BytesIO()
+    workbook.save(data)
+    return data.getvalue()
+
+
+def generate_docx(paragraphs: int = 200, images: int = 0, image_size: int = 64 * 1024) -> bytes:
+    """Generates a minimal (but valid) OOXML word processing package."""
+    rng = random.Random(SEED)
+    body = "".join(
+        f"<w:p><w:r><w:t>Paragraph {paragraph} of the synthetic benchmark document"
+        "</w:t></w:r></w:p>"
+        for paragraph in range(paragraphs)
+    )
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr(
+            "[Content_Types].xml",
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" '
+            'ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Default Extension="png" ContentType="image/png"/>'
+            '<Override PartName="/word/document.xml" ContentType="application/'
+            'vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+            '<Override PartName="/docProps/core.xml" ContentType="application/'
+            'vnd.openxmlformats-package.core-properties+xml"/></Types>',
+        )
+        archive.writestr(
+            "_rels/.rels",
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/'
+            '2006/relationships/officeDocument" Target="word/document.xml"/>'
+            '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/package/2006/'
+            'relationships/metadata/core-properties" Target="docProps/core.xml"/>'
+            "</Relationships>",
+        )
+        archive.writestr(
+            "word/document.xml",
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+            f"<w:body>{body}</w:body></w:document>",
+        )
+        archive.writestr("docProps/core.xml", CORE_PROPERTIES)
+        for image in range(images):
+            archive.writestr(f"word/media/image{image}.png", random_bytes(rng, image_size))
+    return data.getvalue()
+
+
+def generate_odt(paragraphs: int = 200) -> bytes:
+    """Generates a minimal (but valid) ODF text document."""
+    body = "".join(
+        f"<text:p>Paragraph {paragraph} of the synthetic benchmark document</text:p>"
+        for paragraph in range(paragraphs)
+    )
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w", zipfile.ZIP_DEFLATED) as archive:
+        # the mimetype must be the first member, and stored
+        archive.writestr("mimetype", ODT_CONTENT_TYPE, compress_type=zipfile.ZIP_STORED)
+        archive.writestr(
+            "META-INF/manifest.xml",
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<manifest:manifest xmlns:manifest="urn:oasis:names:tc:opendocument:xmlns:'
+            'manifest:1.0" manifest:version="1.2"><manifest:file-entry '
+            f'manifest:full-path="/" manifest:media-type="{ODT_CONTENT_TYPE}"/>'
+            "</manifest:manifest>",
+        )
+        archive.writestr(
+            "content.xml",
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<office:document-content xmlns:office="urn:oasis:names:tc:opendocument:xmlns:'
+            'office:1.0" xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0">'
+            f"<office:body><office:text>{body}</office:text></office:body>"
+            "</office:document-content>",
+        )
+        archive.writestr(
+            "meta.xml",
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<office:document-meta xmlns:office="urn:oasis:names:tc:opendocument:xmlns:'
+            'office:1.0" xmlns:dc="http://purl.org/dc/elements/1.1/"><office:meta>'
+            "<dc:creator>TRA</dc:creator><dc:title>Synthetic benchmark document</dc:title>"
+            "</office:meta></office:document-meta>",
+        )
+    return data.getvalue()
+
+
+def generate_zip(members: int = 10, pages: int = 1) -> bytes:
+    """Generates a ZIP of PDFs, DOCXs, and plain text files, the mix you'd find in a bundle."""
+    pdf = generate_pdf(pages)
+    docx = generate_docx()
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w", zipfile.ZIP_DEFLATED) as archive:
+        for member in range(members):
+            if member % 3 == 0:
+                archive.writestr(f"document_{member}.pdf", pdf)
+            elif member % 3 == 1:
+                archive.writestr(f"document_{member}.docx", docx)
+            else:
+                archive.writestr(f"notes_{member}.txt", "Synthetic benchmark notes\n" * 100)
+    return data.getvalue()
+
+
+def generate_documents(args) -> dict:
+    """Returns {extractor name: (extractor class, content type, document bytes)}."""
+    return {
+        "PDFExtractor": (
+            PDFExtractor,
+            PDF_CONTENT_TYPE,
+            generate_pdf(args.pages, args.images, args.image_size),
+        ),
+        "MicrosoftDocExtractor (docx)": (
+            MicrosoftDocExtractor,
+            DOCX_CONTENT_TYPE,
+            generate_docx(args.paragraphs, args.images, args.image_size),
+        ),
+        "MicrosoftDocExtractor (xlsx)": (
+            MicrosoftDocExtractor,
+            XLSX_CONTENT_TYPE,
+            generate_xlsx(args.sheets, args.rows),
+        ),
+        "OpenDocumentExtractor": (
+            OpenDocumentExtractor,
+            ODT_CONTENT_TYPE,
+            generate_odt(args.paragraphs),
+        ),
+        "ZIPExtractor": (ZIPExtractor, ZIP_CONTENT_TYPE, generate_zip(args.members)),
+    }
+
+
+def peak_rss_bytes() -> int:
+    """The peak resident set size of this process, ru_maxrss is in KB on Linux, bytes on macOS."""
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss if platform.system() == "Darwin" else peak_rss * 1024
+
+
+def run_extractor(extractor_class, raw_data: bytes, iterations: int, warmup: int) -> dict:
+    """Times extractor_class over raw_data. Runs in its own process so the peak RSS is only
+    that of this extractor."""
+    baseline_rss = peak_rss_bytes()
+    for _ in range(warmup):
+        extractor_class().extract(io.BytesIO(raw_data))
+
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        read_sanitised_data(extractor_class().extract(io.BytesIO(raw_data)))
+        latencies.append(time.perf_counter() - start)
+
+    total_seconds = sum(latencies)
+    return {
+        "file_bytes": len(raw_data),
+        "iterations": iterations,
+        "mb_per_second": len(raw_data) * iterations / total_seconds / (1024 * 1024),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p90_ms": percentile(latencies, 90) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "baseline_rss_bytes": baseline_rss,
+        "peak_rss_bytes": peak_rss_bytes(),
+        "rss_growth_bytes": peak_rss_bytes() - baseline_rss,
+    }
+
+
+def benchmark_extractors(documents: dict, iterations: int = 20, warmup: int = 2) -> dict:
+    results = {}
+    # spawn rather than fork, so every extractor starts from a clean process
+    context = multiprocessing.get_context("spawn")
+    for name, (extractor_class, _, raw_data) in documents.items():
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results[name] = executor.submit(
+                run_extractor, extractor_class, raw_data, iterations, warmup
+            ).result()
+    return results
+
+
+def print_extractor_results(results: dict) -> None:
+    print(
+        f"{'extractor':<30}{'size (KB)':>11}{'MB/s':>9}{'p50 (ms)':>10}{'p90 (ms)':>10}"
+        f"{'p99 (ms)':>10}{'peak RSS (MB)':>15}{'RSS growth (MB)':>17}"
+    )
+    for name, result in results.items():
+        print(
+            f"{name:<30}{result['file_bytes'] / 1024:>11.1f}{result['mb_per_second']:>9.2f}"
+            f"{result['p50_ms']:>10.2f}{result['p90_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+            f"{result['peak_rss_bytes'] / (1024 * 1024):>15.1f}"
+            f"{result['rss_growth_bytes'] / (1024 * 1024):>17.1f}"
+        )
+
+
+# (metric, True if bigger is better)
+COMPARED_METRICS = (
+    ("mb_per_second", True),
+    ("p50_ms", False),
+    ("p99_ms", False),
+    ("peak_rss_bytes", False),
+)
+
+
+def compare_results(baseline: dict, current: dict, threshold: float = 0.1) -> list:
+    """Compares two runs of the extractors benchmark.
+
+    Returns a list of regression messages, a regression is when throughput drops, or latency or
+    peak RSS grows, by more than threshold (a fraction).
+    """
+    return benchmarking.compare_results(
+        baseline, current, COMPARED_METRICS, threshold, name_width=30
+    )
+
+
+def load_pdf_corpus(directory: str = None) -> dict:
+    """Returns a dict of {name: bytes} of the PDFs in directory, or a synthetic corpus."""
+    if directory:
+        return {path.name: path.read_bytes() for path in sorted(Path(directory).glob("*.pdf"))}
+    return {
+        f"synthetic-{pages}-pages-{images}-images.pdf": generate_pdf(pages, images)
+        for pages, images in ((1, 0), (10, 2), (100, 0))
+    }
+
+
+def benchmark_pdf_save(corpus: dict, repeat: int = 5) -> list:
+    """Sanitises every PDF in the corpus with each of the PDF_SAVE_PRESETS.
+
+    Returns a list of result dicts, one per preset.
+    """
+    results = []
+    input_bytes = sum(len(raw_data) for raw_data in corpus.values())
+    for preset, save_options in PDF_SAVE_PRESETS.items():
+        timings = []
+        output_bytes = 0
+        for _ in range(repeat):
+            output_bytes = 0
+            start = time.perf_counter()
+            for raw_data in corpus.values():
+                sanitised_data = PDFExtractor(save_options=save_options).extract(
+                    io.BytesIO(raw_data)
+                )
+                output_bytes += len(read_sanitised_data(sanitised_data))
+            timings.append(time.perf_counter() - start)
+        results.append(
+            {
+                "preset": preset,
+                "input_bytes": input_bytes,
+                "output_bytes": output_bytes,
+                "size_ratio": output_bytes / input_bytes,
+                "median_seconds": statistics.median(timings),
+            }
+        )
+    return results
+
+
+def print_pdf_save_results(results: list) -> None:
+    print(f"{'preset':<20}{'input':>12}{'output':>12}{'ratio':>8}{'median (ms)':>14}")
+    for result in results:
+        print(
+            f"{result['preset']:<20}{result['input_bytes']:>12}{result['output_bytes']:>12}"
+            f"{result['size_ratio']:>8.2f}{result['median_seconds'] * 1000:>14.1f}"
+        )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    extractors_parser = subparsers.add_parser(
+        "extractors", help="measure the throughput, latency, and memory of each extractor"
+    )
+    extractors_parser.add_argument("--pages", type=int, default=20)
+    extractors_parser.add_argument("--paragraphs", type=int, default=500)
+    extractors_parser.add_argument("--sheets", type=int, default=3)
+    extractors_parser.add_argument("--rows", type=int, default=1000)
+    extractors_parser.add_argument("--images", type=int, default=2)
+    extractors_parser.add_argument("--image-size", type=int, default=64 * 1024)
+    extractors_parser.add_argument("--members", type=int, default=30)
+    extractors_parser.add_argument("--iterations", type=int, default=20)
+    extractors_parser.add_argument("--warmup", type=int, default=2)
+    extractors_parser.add_argument("--output", help="save the results as JSON to this file")
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="compare two saved runs, exits with 1 if there are regressions"
+    )
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument(
+        "--threshold", type=float, default=0.1, help="the allowed change, 0.1 is 10%%"
+    )
+
+    pdf_save_parser = subparsers.add_parser(
+        "pdf-save", help="compare the size and speed of the PDF save options"
+    )
+    pdf_save_parser.add_argument(
+        "--corpus", help="a directory of sample PDFs, synthetic ones are used if not passed"
+    )
+    pdf_save_parser.add_argument("--repeat", type=int, default=5)
+
+    args = parser.parse_args(argv)
+    if args.command == "extractors":
+        results = benchmark_extractors(
+            generate_documents(args), iterations=args.iterations, warmup=args.warmup
+        )
+        print_extractor_results(results)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(
+                    {"arguments": vars(args), "python": sys.version, "results": results},
+                    f,
+                    indent=2,
+                )
+    elif args.command == "compare":
+        with open(args.baseline) as baseline, open(args.current) as current:
+            regressions = compare_results(
+                json.load(baseline), json.load(current), threshold=args.threshold
+            )
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        return 1 if regressions else 0
+    elif args.command == "pdf-save":
+        print_pdf_save_results(
+            benchmark_pdf_save(load_pdf_corpus(args.corpus), repeat=args.repeat)
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+import hashlib
+from typing import Union
+
+from django.conf import settings
+from django.core.cache import caches
+
+# bump the version if the sanitisation logic changes, so stale outputs are never served
+CACHE_KEY_PREFIX = "sanitised_upload:v1"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def content_hash(raw_data: bytes, content_type: str = None) -> str:
+    """Returns a SHA-256 hex digest of the raw bytes and content type of an upload.
+
+    The bytes are hashed in chunks through a memoryview so large uploads aren't copied.
+    """
+    digest = hashlib.sha256()
+    view = memoryview(raw_data)
+    for offset in range(0, len(view), HASH_CHUNK_SIZE):
+        digest.update(view[offset:offset + HASH_CHUNK_SIZE])
+    digest.update(b"\0")
+    digest.update((content_type or "").encode())
+    return digest.hexdigest()
+
+
+class SanitisedUploadCache:
+    """Memoizes the output of the metadata Extractor, keyed by the content of the upload.
+
+    The same templates and documents get uploaded again and again, there's no point sanitising
+    them each time. Any Django cache backend can be used, the FileBasedCache is a good fit as
+    the entries can be large, the number of entries is bounded by the backend's MAX_ENTRIES
+    option and outputs larger than max_entry_bytes are never cached.
+
+    Enabled by setting UPLOAD_SANITISATION_CACHE to the alias of a cache in CACHES.
+    """
+
+    def __init__(self, cache_alias: str, timeout: int = None, max_entry_bytes: int = None):
+        self.cache = caches[cache_alias]
+        self.timeout = timeout
+        self.max_entry_bytes = max_entry_bytes
+
+    @classmethod
+    def from_settings(cls) -> Union["SanitisedUploadCache", None]:
+        """Returns a SanitisedUploadCache configured from settings, or None if it's disabled."""
+        cache_alias = getattr(settings, "UPLOAD_SANITISATION_CACHE", None)
+        if not cache_alias:
+            return None
+        return cls(
+            cache_alias,
+            timeout=getattr(settings, "UPLOAD_SANITISATION_CACHE_TIMEOUT", 60 * 60 * 24),
+            max_entry_bytes=getattr(
+                settings, "UPLOAD_SANITISATION_CACHE_MAX_ENTRY_BYTES", 10 * 1024 * 1024
+            ),
+        )
+
+    @staticmethod
+    def get_key(raw_data: bytes, content_type: str = None, save_options: str = None) -> str:
+        """save_options identifies the options the output is written with (see
+        PDFSaveOptions.get_cache_key()), the same upload is sanitised differently with others."""
+        key = f"{CACHE_KEY_PREFIX}:{content_hash(raw_data, content_type)}"
+        if save_options:
+            key = f"{key}:{save_options}"
+        return key
+
+    def get(self, key: str) -> Union[tuple, None]:
+        """Returns the cached (was_stripped, sanitised_bytes) tuple, or None on a miss."""
+        return self.cache.get(key)
+
+    def set(self, key: str, was_stripped: bool, sanitised_bytes: bytes) -> None:
+        if self.max_entry_bytes is not None and len(sanitised_bytes) > self.max_entry_bytes:
+            return
+        self.cache.set(key, (was_stripped, sanitised_bytes), timeout=self.timeout)
@@ -2,32 +2,63 @@ from zipfile import BadZipFile
 
 from django.conf import settings
 from django.core.files.uploadhandler import FileUploadHandler, StopUpload
-from pikepdf import PdfError
 
-from v2_api_client.shared.upload_handler.metadata import Extractor
-
-FILE_MAX_SIZE_BYTES_ERROR = (
-    f"The selected file must be smaller than "
-    f"{round(settings.FILE_MAX_SIZE_BYTES / (1024 * 1024))}MB"
+from v2_api_client.shared.upload_handler.cache import SanitisedUploadCache
+from v2_api_client.shared.upload_handler.metadata import (
+    ExtractionLimitExceeded,
+    Extractor,
+    PDFSaveOptions,
+    UnrecognisedFileError,
+    get_pdf_error,
+    read_sanitised_data,
 )
 
 
+def get_file_max_size_bytes_error() -> str:
+    # built on demand, so importing this module doesn't need the settings to be configured
+    return (
+        f"The selected file must be smaller than "
+        f"{round(settings.FILE_MAX_SIZE_BYTES / (1024 * 1024))}MB"
+    )
+
+
+def __getattr__(name):
+    if name == "FILE_MAX_SIZE_BYTES_ERROR":
+        return get_file_max_size_bytes_error()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def get_pdf_save_options() -> PDFSaveOptions:
+    """The UPLOAD_SANITISATION_PDF_SPOOL_MAX_SIZE setting (bytes, default None, off) writes
+    sanitised PDFs bigger than it to a temporary file rather than to memory."""
+    return PDFSaveOptions(
+        spool_max_size=getattr(settings, "UPLOAD_SANITISATION_PDF_SPOOL_MAX_SIZE", None)
+    )
+
+
 class ExtractMetadataFileUploadHandler(FileUploadHandler):
     def file_complete(self, file_size):
         pass
 
     def receive_data_chunk(self, raw_data, start):
-        if len(raw_data) > settings.FILE_MAX_SIZE_BYTES:
-            raise StopUpload(FILE_MAX_SIZE_BYTES_ERROR)
+        # start is the offset of this chunk in the file, so this catches files that are too large
+        # even when they arrive over multiple chunks
+        if start + len(raw_data) > settings.FILE_MAX_SIZE_BYTES:
+            raise StopUpload(get_file_max_size_bytes_error())
 
-        extractor = Extractor()
+        extractor = Extractor(
+            cache=SanitisedUploadCache.from_settings(), pdf_save_options=get_pdf_save_options()
+        )
         try:
             _, sanitised_data = extractor(raw_data, self.content_type)
-        except (BadZipFile, PdfError):
+        except (BadZipFile, get_pdf_error(), UnrecognisedFileError):
             raise StopUpload("There was an error processing this file")
+        except ExtractionLimitExceeded:
+            raise StopUpload("The selected file is too large when uncompressed")
 
 
         if isinstance(sanitised_data, bytes):
             return sanitised_data
-        else:
-            return sanitised_data.getvalue()
+        with sanitised_data:
+            # closing a spooled file deletes it straight away
+            return read_sanitised_data(sanitised_data)
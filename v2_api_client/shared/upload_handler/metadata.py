@@ -5,54 +5,418 @@ import tempfile
 import zipfile
 import shutil
 import glob
+import struct
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
 from pathlib import Path
-import pikepdf
-from lxml import etree
+from typing import Union
+
+# pikepdf and lxml are slow to import, so they are only imported once an extractor needs them
+
+PDF_CONTENT_TYPE = "application/pdf"
+DOCX_CONTENT_TYPE = (
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+)
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+PPTX_CONTENT_TYPE = (
+    "application/vnd.openxmlformats-officedocument.presentationml.presentation"
+)
+ODT_CONTENT_TYPE = "application/vnd.oasis.opendocument.text"
+ODS_CONTENT_TYPE = "application/vnd.oasis.opendocument.spreadsheet"
+ZIP_CONTENT_TYPE = "application/zip"
+
+# the PDF spec allows for junk before the header, readers (and pikepdf) look in the first 1KB
+PDF_HEADER_SEARCH_BYTES = 1024
+ZIP_LOCAL_FILE_HEADER = b"PK\x03\x04"
+ZIP_EMPTY_ARCHIVE_HEADER = b"PK\x05\x06"
+ODF_MIMETYPE_PREFIX = "application/vnd.oasis.opendocument."
+
+# the part that identifies what kind of OOXML package we are looking at
+OOXML_MAIN_PARTS = {
+    "word/document.xml": DOCX_CONTENT_TYPE,
+    "xl/workbook.xml": XLSX_CONTENT_TYPE,
+    "ppt/presentation.xml": PPTX_CONTENT_TYPE,
+}
+
+
+class UnrecognisedFileError(ValueError):
+    """The contents of a file do not match the (supported) content type it was uploaded with."""
+
+
+def get_pdf_error():
+    """Returns pikepdf.PdfError, the exception raised for invalid PDFs, without importing
+    pikepdf up front. Use it in an except clause, which is only evaluated when something was
+    raised:
+
+    except get_pdf_error():
+        ...
+    """
+    from pikepdf import PdfError
+
+    return PdfError
+
+
+class ExtractionLimitExceeded(Exception):
+    """An archive would inflate past one of the ExtractionLimits, likely a zip bomb."""
+
+
+class ExtractionLimits:
+    """The limits enforced while decompressing archives (ZIP, OOXML, and ODF files).
+
+    Any of the defaults can be overridden with keyword arguments, e.g.
+    ExtractionLimits(max_depth=1).
+    """
+
+    # the total number of uncompressed bytes across every member of every (nested) archive
+    max_total_uncompressed_bytes = 250 * 1024 * 1024
+    # the largest uncompressed / compressed ratio allowed for a single member...
+    max_member_ratio = 200
+    # ...once it has inflated past this many bytes, small XML parts can legitimately compress well
+    ratio_grace_bytes = 1024 * 1024
+    # the total number of members across every (nested) archive
+    max_members = 2000
+    # how many archives deep we will go, e.g. a DOCX inside a ZIP is a depth of 1
+    max_depth = 2
+
+    def __init__(self, **kwargs):
+        for limit, value in kwargs.items():
+            if not hasattr(self, limit):
+                raise TypeError(f"{limit} is not a valid extraction limit")
+            setattr(self, limit, value)
+
+
+class PDFSaveOptions:
+    """How PDFExtractor writes out the sanitised PDF.
+
+    Any of the defaults can be overridden with keyword arguments, e.g.
+    PDFSaveOptions(linearize=True).
+    """
+
+    # "generate" packs objects into compressed object streams, "preserve" keeps whatever the
+    # input had, "disable" writes every object uncompressed
+    object_stream_mode = "generate"
+    # compress streams that are currently uncompressed
+    compress_streams = True
+    # decompress and recompress existing Flate streams at the best level, slow but smaller
+    recompress_flate = False
+    # linearize (a.k.a "fast web view") so the first page can be shown before it's all downloaded
+    linearize = False
+    # if set, write to a SpooledTemporaryFile that rolls over to disk after this many bytes rather
+    # than holding the whole document in memory
+    spool_max_size = None
+
+    def __init__(self, **kwargs):
+        for option, value in kwargs.items():
+            if not hasattr(self, option):
+                raise TypeError(f"{option} is not a valid PDF save option")
+            setattr(self, option, value)
+
+    def get_save_kwargs(self) -> dict:
+        import pikepdf
+
+        return {
+            "object_stream_mode": getattr(pikepdf.ObjectStreamMode, self.object_stream_mode),
+            "compress_streams": self.compress_streams,
+            "recompress_flate": self.recompress_flate,
+            "linearize": self.linearize,
+        }
+
+    def get_cache_key(self) -> str:
+        """Identifies the options that change the sanitised output, spool_max_size only changes
+        where it's written."""
+        return "-".join(
+            str(value)
+            for value in (
+                self.object_stream_mode,
+                int(self.compress_streams),
+                int(self.recompress_flate),
+                int(self.linearize),
+            )
+        )
+
+    def get_output_file(self):
+        if self.spool_max_size is not None:
+            return tempfile.SpooledTemporaryFile(max_size=self.spool_max_size)
+        return io.BytesIO()
+
+
+def read_sanitised_data(data) -> bytes:
+    """Returns the bytes of the file-like object returned by an extractor, leaving it rewound."""
+    data.seek(0)
+    sanitised_bytes = data.read()
+    data.seek(0)
+    return sanitised_bytes
+
+
+class ExtractionBudget:
+    """Tracks how much of the ExtractionLimits a single upload has used up.
+
+    The same budget is shared with the extractors of any nested archives, so a ZIP full of ZIPs
+    can't get around the limits by spreading the payload thin.
+    """
+
+    read_chunk_size = 64 * 1024
+
+    def __init__(self, limits: ExtractionLimits = None):
+        self.limits = limits or ExtractionLimits()
+        self.total_uncompressed_bytes = 0
+        self.members = 0
+        self.depth = 0
+
+    @contextmanager
+    def nested(self):
+        """Marks that we are now extracting a file found inside an archive."""
+        self.depth += 1
+        try:
+            yield
+        finally:
+            self.depth -= 1
+
+    def check_archive(self, archive: zipfile.ZipFile) -> None:
+        """Checks the central directory of an archive against the limits before anything is
+        inflated. zipfile won't read past the declared size of a member, so these sizes are an
+        upper bound and a lying archive is still caught here.
+        """
+        if self.depth > self.limits.max_depth:
+            raise ExtractionLimitExceeded(
+                f"Archives are nested more than {self.limits.max_depth} levels deep"
+            )
+
+        infolist = archive.infolist()
+        self.members += len(infolist)
+        if self.members > self.limits.max_members:
+            raise ExtractionLimitExceeded(
+                f"Archives contain more than {self.limits.max_members} files"
+            )
+
+        declared_bytes = sum(info.file_size for info in infolist)
+        if (
+            self.total_uncompressed_bytes + declared_bytes
+            > self.limits.max_total_uncompressed_bytes
+        ):
+            raise ExtractionLimitExceeded(
+                "Archives would be larger than "
+                f"{self.limits.max_total_uncompressed_bytes} bytes uncompressed"
+            )
+
+    def iter_member(self, archive: zipfile.ZipFile, info: zipfile.ZipInfo):
+        """Yields the uncompressed bytes of an archive member in chunks, aborting as soon as
+        a limit is exceeded rather than after fully inflating it."""
+        member_bytes = 0
+        with archive.open(info) as member:
+            while chunk := member.read(self.read_chunk_size):
+                member_bytes += len(chunk)
+                self.total_uncompressed_bytes += len(chunk)
+                if (
+                    self.total_uncompressed_bytes
+                    > self.limits.max_total_uncompressed_bytes
+                ):
+                    raise ExtractionLimitExceeded(
+                        "Archives are larger than "
+                        f"{self.limits.max_total_uncompressed_bytes} bytes uncompressed"
+                    )
+                if (
+                    member_bytes > self.limits.ratio_grace_bytes
+                    and member_bytes / max(info.compress_size, 1)
+                    > self.limits.max_member_ratio
+                ):
+                    raise ExtractionLimitExceeded(
+                        f"{info.filename} has a compression ratio larger than "
+                        f"{self.limits.max_member_ratio}"
+                    )
+                yield chunk
+
+    def read_member(self, archive: zipfile.ZipFile, info: zipfile.ZipInfo) -> bytes:
+        return b"".join(self.iter_member(archive, info))
+
+    def copy_member(self, archive: zipfile.ZipFile, info: zipfile.ZipInfo, path: str) -> None:
+        with open(path, "wb") as f:
+            for chunk in self.iter_member(archive, info):
+                f.write(chunk)
+
+
+def _sniff_odf_mimetype(raw_data) -> Union[str, None]:
+    """ODF packages must store an uncompressed "mimetype" member first in the archive, so we can
+    read the exact document type straight out of the first local file header without having to
+    parse the central directory.
+    """
+    if len(raw_data) < 30:
+        return None
+    (compression_method,) = struct.unpack("<H", raw_data[8:10])
+    name_length, extra_length = struct.unpack("<HH", raw_data[26:30])
+    name_end = 30 + name_length
+    if compression_method != zipfile.ZIP_STORED or raw_data[30:name_end] != b"mimetype":
+        return None
+    (content_length,) = struct.unpack("<I", raw_data[22:26])
+    content_start = name_end + extra_length
+    mimetype = bytes(raw_data[content_start:content_start + content_length])
+    try:
+        mimetype = mimetype.decode("ascii")
+    except UnicodeDecodeError:
+        return None
+    return mimetype if mimetype.startswith(ODF_MIMETYPE_PREFIX) else None
+
+
+def _sniff_zip_content_type(raw_data) -> Union[str, None]:
+    """Works out if a ZIP archive is an OOXML package, an ODF package, or just a plain ZIP.
+
+    Only the local header of the first member and the central directory are read, none of the
+    members are decompressed (apart from a mislaid ODF "mimetype" member, which is tiny).
+    """
+    if mimetype := _sniff_odf_mimetype(raw_data):
+        return mimetype
+
+    try:
+        with zipfile.ZipFile(io.BytesIO(raw_data), "r") as archive:
+            names = set(archive.namelist())
+            if "[Content_Types].xml" in names:
+                for part_name, content_type in OOXML_MAIN_PARTS.items():
+                    if part_name in names:
+                        return content_type
+                # an OPC package we don't know how to sanitise, e.g. a Visio drawing, not a plain
+                # ZIP, repackaging it would break it
+                return None
+            if "mimetype" in names and archive.getinfo("mimetype").file_size < 256:
+                mimetype = archive.read("mimetype").decode("ascii", errors="ignore")
+                if mimetype.startswith(ODF_MIMETYPE_PREFIX):
+                    return mimetype.strip()
+    except zipfile.BadZipFile:
+        return None
+    return ZIP_CONTENT_TYPE
+
+
+def sniff_content_type(raw_data) -> Union[str, None]:
+    """Determines the content type of a file from its magic bytes rather than trusting the
+    content type provided by the client.
+
+    Parameters
+    ----------
+    raw_data : the bytes of the file
+
+    Returns
+    -------
+    The content type of the file if it is one we know how to sanitise, else None
+    """
+    # magic bytes at offset 0 first, a stored (uncompressed) zip can contain a PDF header
+    if raw_data[:4] in (ZIP_LOCAL_FILE_HEADER, ZIP_EMPTY_ARCHIVE_HEADER):
+        return _sniff_zip_content_type(raw_data)
+    # PDF readers accept junk before the header, so it's searched for
+    if b"%PDF-" in raw_data[:PDF_HEADER_SEARCH_BYTES]:
+        return PDF_CONTENT_TYPE
+    return None
 
 
 class Extractor:
+    def __init__(
+        self,
+        cache=None,
+        limits: ExtractionLimits = None,
+        pdf_save_options: PDFSaveOptions = None,
+    ):
+        """
+        Parameters
+        ----------
+        cache : optional SanitisedUploadCache (or anything with the same get_key/get/set
+        interface), if passed, the sanitised output of an upload is memoized by its content
+        limits : the ExtractionLimits enforced when decompressing archives, the defaults are used
+        if not passed
+        pdf_save_options : the PDFSaveOptions used to write sanitised PDFs, the defaults are used
+        if not passed
+        """
+        self.cache = cache
+        self.limits = limits or ExtractionLimits()
+        self.pdf_save_options = pdf_save_options or PDFSaveOptions()
+
     def __call__(self, raw_data, content_type):
+        if not self.cache:
+            return self.extract(raw_data, content_type)
+
+        cache_key = self.cache.get_key(
+            raw_data, content_type, self.pdf_save_options.get_cache_key()
+        )
+        if cached := self.cache.get(cache_key):
+            was_stripped, sanitised_bytes = cached
+            return was_stripped, io.BytesIO(sanitised_bytes)
+
+        was_stripped, data = self.extract(raw_data, content_type)
+        if was_stripped:
+            # there's no work to save by caching files we don't sanitise
+            self.cache.set(cache_key, was_stripped, read_sanitised_data(data))
+        return was_stripped, data
+
+    def extract(self, raw_data, content_type, budget: ExtractionBudget = None):
         data = io.BytesIO(raw_data)
-        file_format = content_type
+        file_format = sniff_content_type(raw_data)
         was_stripped = True
 
-        if file_format == "application/pdf":
-            data = PDFExtractor().extract(data)
-        elif file_format in (
-            "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        ):
-            data = MicrosoftDocExtractor().extract(data)
-        elif file_format in (
-            "application/vnd.oasis.opendocument.text",
-            "application/vnd.oasis.opendocument.spreadsheet",
-        ):
-            data = OpenDocumentExtractor().extract(data)
-        elif file_format == "application/zip":
-            data = ZIPExtractor().extract(data)
+        if file_format == ZIP_CONTENT_TYPE and content_type != ZIP_CONTENT_TYPE:
+            # plenty of formats are ZIP archives underneath, they're only repackaged by
+            # ZIPExtractor when the client says it's a ZIP
+            file_format = None
+
+        if file_format is None and self.get_extractor_class(content_type):
+            # the client says this is a file we sanitise, but it doesn't look like one, rather
+            # than letting the parser fail slowly, we fail now
+            raise UnrecognisedFileError(
+                f"The file contents do not match the content type {content_type}"
+            )
+
+        if extractor_class := self.get_extractor_class(file_format):
+            data = extractor_class(
+                **self.get_extractor_kwargs(
+                    extractor_class, budget or ExtractionBudget(self.limits)
+                )
+            ).extract(data)
         else:
             # mimetype is not supported
             was_stripped = False
 
         return was_stripped, data
 
+    def get_extractor_kwargs(self, extractor_class, budget: ExtractionBudget) -> dict:
+        """Returns the keyword arguments used to instantiate an extractor_class."""
+        kwargs = {"budget": budget}
+        if issubclass(extractor_class, PDFExtractor):
+            kwargs["save_options"] = self.pdf_save_options
+        elif issubclass(extractor_class, ZIPExtractor):
+            # so the members are sanitised with the same options
+            kwargs["extractor"] = self
+        return kwargs
 
-extractor = Extractor()
+    @staticmethod
+    def get_extractor_class(file_format):
+        """Returns the BaseExtractMetaData subclass used to sanitise a particular content type."""
+        if file_format == PDF_CONTENT_TYPE:
+            return PDFExtractor
+        elif file_format in (DOCX_CONTENT_TYPE, XLSX_CONTENT_TYPE, PPTX_CONTENT_TYPE):
+            return MicrosoftDocExtractor
+        elif file_format and file_format.startswith(ODF_MIMETYPE_PREFIX):
+            return OpenDocumentExtractor
+        elif file_format == ZIP_CONTENT_TYPE:
+            return ZIPExtractor
+        return None
 
 
 class BaseExtractMetaData(ABC):
+    def __init__(self, budget: ExtractionBudget = None):
+        self.budget = budget or ExtractionBudget()
+
     @abstractmethod
     def extract(self, data) -> io.BytesIO:
         raise NotImplementedError()
 
 
 class ZIPExtractor(BaseExtractMetaData):
+    def __init__(self, budget: ExtractionBudget = None, extractor: Extractor = None):
+        super().__init__(budget=budget)
+        self.extractor = extractor or Extractor(limits=self.budget.limits)
+
     def extract(self, data):
         with zipfile.ZipFile(data, "r") as input_zip:
+            self.budget.check_archive(input_zip)
             with tempfile.TemporaryDirectory() as tmpdirname:
                 with tempfile.TemporaryDirectory() as output_tmpdirname:
-                    input_zip.extractall(tmpdirname)
+                    self.extract_members(input_zip, tmpdirname)
                     tmpdirname += "/**"
                     file_length_counter = 0
                     for input_file_path in glob.glob(tmpdirname, recursive=True):
@@ -61,15 +425,19 @@ class ZIPExtractor(BaseExtractMetaData):
                         file_length_counter += 1
                         file_name = Path(input_file_path).name
                         output_file_path = os.path.join(output_tmpdirname, file_name)
-                        if mimetype := mimetypes.guess_type(file_name)[0]:
-                            with open(input_file_path, "rb") as file_bytes:
-                                _, stripped_bytes = extractor(
-                                    file_bytes.read(), mimetype
+                        # the extractor sniffs the contents, so files with a misleading (or
+                        # missing) extension are still sanitised
+                        mimetype = mimetypes.guess_type(file_name)[0]
+                        with open(input_file_path, "rb") as file_bytes:
+                            with self.budget.nested():
+                                was_stripped, stripped_bytes = self.extractor.extract(
+                                    file_bytes.read(), mimetype, budget=self.budget
                                 )
-                                with open(output_file_path, "wb") as f:
-                                    f.write(stripped_bytes.read())
+                        if was_stripped:
+                            with open(output_file_path, "wb") as f:
+                                f.write(read_sanitised_data(stripped_bytes))
                         else:
-                            # the mimetype cannot be determined, so we just copy the file
+                            # the file is not one we sanitise, so we just copy it
                             shutil.copyfile(input_file_path, output_file_path)
 
                     # checking that the new zip file contains the same number of files as the
@@ -78,26 +446,53 @@ class ZIPExtractor(BaseExtractMetaData):
                     stripped_zip_path = shutil.make_archive(
                         os.path.join(tmpdirname, "stripped"), "zip", output_tmpdirname
                     )
-                    stripped_zip_file = open(stripped_zip_path, "rb")
-                    stripped_zip_bytes = stripped_zip_file.read()
-                    stripped_zip_file.close()
+                    with open(stripped_zip_path, "rb") as stripped_zip_file:
+                        stripped_zip_bytes = io.BytesIO(stripped_zip_file.read())
 
         return stripped_zip_bytes
 
+    def extract_members(self, input_zip: zipfile.ZipFile, path: str) -> None:
+        """Extracts all members of input_zip to path, enforcing the extraction limits as it goes.
+
+        Replaces ZipFile.extractall(), which would inflate everything before we could object.
+        """
+        for info in input_zip.infolist():
+            # the same sanitisation of member names as ZipFile.extractall()
+            parts = [
+                part
+                for part in info.filename.replace("\\", "/").split("/")
+                if part not in ("", ".", "..")
+            ]
+            if not parts:
+                continue
+            target_path = os.path.join(path, *parts)
+            if info.is_dir():
+                os.makedirs(target_path, exist_ok=True)
+                continue
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            self.budget.copy_member(input_zip, info, target_path)
+
 
 class OpenDocumentExtractor(BaseExtractMetaData):
     def extract(self, data):
+        from lxml import etree
+
         sanitised_data = io.BytesIO()
         tags = ["creator", "title", "description", "subject"]
+        # meta.xml is optional in an ODF package, there's nothing to strip without it
+        metadata = None
 
         with zipfile.ZipFile(data, "r") as input_odf:
+            self.budget.check_archive(input_odf)
             with zipfile.ZipFile(sanitised_data, "w") as output_odf:
                 output_odf.comment = input_odf.comment  # preserve the comment
                 for file in input_odf.infolist():
                     if file.filename != "meta.xml":
-                        output_odf.writestr(file, input_odf.read(file.filename))
+                        output_odf.writestr(
+                            file, self.budget.read_member(input_odf, file)
+                        )
                     else:
-                        root = etree.parse(input_odf.open("meta.xml")).getroot()
+                        root = etree.fromstring(self.budget.read_member(input_odf, file))
 
                         for fields in root[0]:
                             if any([field in fields.tag for field in tags]):
@@ -105,8 +500,9 @@ class OpenDocumentExtractor(BaseExtractMetaData):
 
                         metadata = etree.tostring(root)
 
-        with zipfile.ZipFile(sanitised_data, "a", zipfile.ZIP_DEFLATED) as zf:
-            zf.writestr("meta.xml", metadata)
+        if metadata is not None:
+            with zipfile.ZipFile(sanitised_data, "a", zipfile.ZIP_DEFLATED) as zf:
+                zf.writestr("meta.xml", metadata)
 
         sanitised_data.seek(0)
         return sanitised_data
@@ -114,17 +510,20 @@ class OpenDocumentExtractor(BaseExtractMetaData):
 
 class MicrosoftDocExtractor(BaseExtractMetaData):
     def extract(self, data) -> io.BytesIO:
+        from lxml import etree
+
         sanitised_data = io.BytesIO()
         with zipfile.ZipFile(data, "r") as input_file:
+            self.budget.check_archive(input_file)
             with zipfile.ZipFile(sanitised_data, "w") as output_file:
                 for sub_file in input_file.infolist():
                     if sub_file.filename != "docProps/core.xml":
                         output_file.writestr(
-                            sub_file, input_file.read(sub_file.filename)
+                            sub_file, self.budget.read_member(input_file, sub_file)
                         )
                     else:
                         core_properties = etree.fromstring(
-                            input_file.read(sub_file.filename)
+                            self.budget.read_member(input_file, sub_file)
                         )
                         potentially_sensitive_fields = [
                             child
@@ -154,7 +553,15 @@ class MicrosoftDocExtractor(BaseExtractMetaData):
 
 
 class PDFExtractor(BaseExtractMetaData):
+    def __init__(
+        self, budget: ExtractionBudget = None, save_options: PDFSaveOptions = None
+    ):
+        super().__init__(budget=budget)
+        self.save_options = save_options or PDFSaveOptions()
+
     def extract(self, data) -> io.BytesIO:
+        import pikepdf
+
         pdf = pikepdf.open(data)
 
         try:
@@ -167,8 +574,8 @@ class PDFExtractor(BaseExtractMetaData):
             pass
 
         # saving the stripped PDF
-        new_stripped = io.BytesIO()
-        pdf.save(new_stripped)
+        new_stripped = self.save_options.get_output_file()
+        pdf.save(new_stripped, **self.save_options.get_save_kwargs())
         pdf.close()
 
         new_stripped.seek(0)
@@ -1,3 +1,4 @@
+import io
 import os
 import shutil
 import tempfile
@@ -5,11 +6,67 @@ import zipfile
 
 import pikepdf
 import pytest
+from django.conf import settings
 from docx import Document
 from lxml import etree
 from openpyxl import Workbook, load_workbook
 
-from v2_api_client.shared.upload_handler.metadata import Extractor
+from v2_api_client.shared.upload_handler import benchmarks
+from v2_api_client.shared.upload_handler.cache import SanitisedUploadCache, content_hash
+from v2_api_client.shared.upload_handler.django_upload_handler import (
+    ExtractMetadataFileUploadHandler,
+)
+from v2_api_client.shared.upload_handler.metadata import (
+    DOCX_CONTENT_TYPE,
+    ODS_CONTENT_TYPE,
+    ODT_CONTENT_TYPE,
+    PDF_CONTENT_TYPE,
+    XLSX_CONTENT_TYPE,
+    ZIP_CONTENT_TYPE,
+    ExtractionLimitExceeded,
+    ExtractionLimits,
+    Extractor,
+    PDFSaveOptions,
+    UnrecognisedFileError,
+    sniff_content_type,
+)
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def pdf_bytes(author="TRA"):
+    pdf = pikepdf.new()
+    pdf.add_blank_page()
+    with pdf.open_metadata() as meta:
+        meta["dc:creator"] = [author]
+    pdf.docinfo["/Author"] = author
+    data = io.BytesIO()
+    pdf.save(data)
+    return data.getvalue()
+
+
+def docx_bytes(author="TRA"):
+    docx = Document()
+    docx.core_properties.author = author
+    data = io.BytesIO()
+    docx.save(data)
+    return data.getvalue()
+
+
+def xlsx_bytes(author="TRA"):
+    xlsx = Workbook()
+    xlsx.properties.creator = author
+    data = io.BytesIO()
+    xlsx.save(data)
+    return data.getvalue()
+
+
+def zip_bytes(members, compression=zipfile.ZIP_DEFLATED):
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w", compression) as archive:
+        for name, content in members.items():
+            archive.writestr(name, content)
+    return data.getvalue()
 
 
 class TestDocumentMetadata:
@@ -212,3 +269,282 @@ class TestDocumentMetadata:
             zf.writestr("meta.xml", metadata)
 
         self.odf_document = Extractor()
+
+
+class TestContentSniffing:
+    @pytest.mark.parametrize(
+        "raw_data, expected_content_type",
+        [
+            (pdf_bytes(), PDF_CONTENT_TYPE),
+            (b"junk before the header\n" + pdf_bytes(), PDF_CONTENT_TYPE),
+            (docx_bytes(), DOCX_CONTENT_TYPE),
+            (xlsx_bytes(), XLSX_CONTENT_TYPE),
+            (zip_bytes({"a.txt": "hello"}), ZIP_CONTENT_TYPE),
+            (b"just some text", None),
+            (b"PK\x03\x04 not really a zip", None),
+        ],
+    )
+    def test_sniff_content_type(self, raw_data, expected_content_type):
+        assert sniff_content_type(raw_data) == expected_content_type
+
+    @pytest.mark.parametrize(
+        "file_name, expected_content_type",
+        [("sample.odt", ODT_CONTENT_TYPE), ("sample.ods", ODS_CONTENT_TYPE)],
+    )
+    def test_sniff_odf_content_type(self, file_name, expected_content_type):
+        with open(os.path.join(FIXTURES_DIR, file_name), "rb") as file:
+            assert sniff_content_type(file.read()) == expected_content_type
+
+    def test_mislabelled_pdf_is_sanitised(self):
+        was_stripped, sanitised_data = Extractor()(pdf_bytes(), DOCX_CONTENT_TYPE)
+
+        assert was_stripped
+        pdf = pikepdf.open(sanitised_data)
+        assert "TRA" not in str(pdf.open_metadata())
+        assert "/Author" not in pdf.docinfo
+
+    def test_mislabelled_docx_is_sanitised(self):
+        was_stripped, sanitised_data = Extractor()(docx_bytes(), "text/plain")
+
+        assert was_stripped
+        assert Document(sanitised_data).core_properties.author == ""
+
+    def test_unrecognised_contents_raise(self):
+        with pytest.raises(UnrecognisedFileError):
+            Extractor()(b"definitely not a PDF", PDF_CONTENT_TYPE)
+
+    def test_unsupported_file_is_not_stripped(self):
+        was_stripped, data = Extractor()(b"just some text", "text/plain")
+
+        assert not was_stripped
+        assert data.getvalue() == b"just some text"
+
+    def test_zip_members_are_sniffed(self):
+        raw_data = zip_bytes({"letter_of_authority": pdf_bytes()})
+
+        was_stripped, sanitised_data = Extractor()(raw_data, ZIP_CONTENT_TYPE)
+
+        assert was_stripped
+        with zipfile.ZipFile(sanitised_data, "r") as archive:
+            pdf = pikepdf.open(io.BytesIO(archive.read("letter_of_authority")))
+            assert "/Author" not in pdf.docinfo
+
+    def test_stored_zip_of_a_pdf_stays_a_zip(self):
+        raw_data = zip_bytes({"letter_of_authority.pdf": pdf_bytes()}, zipfile.ZIP_STORED)
+        assert sniff_content_type(raw_data) == ZIP_CONTENT_TYPE
+
+        was_stripped, sanitised_data = Extractor()(raw_data, ZIP_CONTENT_TYPE)
+
+        assert was_stripped
+        with zipfile.ZipFile(sanitised_data, "r") as archive:
+            assert archive.namelist() == ["letter_of_authority.pdf"]
+
+    def test_odf_without_meta_xml(self):
+        raw_data = zip_bytes({"mimetype": ODT_CONTENT_TYPE, "content.xml": "<content/>"})
+        assert sniff_content_type(raw_data) == ODT_CONTENT_TYPE
+
+        was_stripped, sanitised_data = Extractor()(raw_data, ODT_CONTENT_TYPE)
+
+        assert was_stripped
+        with zipfile.ZipFile(sanitised_data, "r") as archive:
+            assert archive.namelist() == ["mimetype", "content.xml"]
+
+
+    def test_unknown_opc_package_is_passed_through(self):
+        raw_data = zip_bytes(
+            {
+                "[Content_Types].xml": "<Types/>",
+                "_rels/.rels": "<Relationships/>",
+                "visio/document.xml": "<VisioDocument/>",
+            }
+        )
+
+        was_stripped, data = Extractor()(raw_data, "application/vnd.ms-visio.drawing")
+
+        assert not was_stripped
+        assert data.getvalue() == raw_data
+        with pytest.raises(UnrecognisedFileError):
+            Extractor()(raw_data, ZIP_CONTENT_TYPE)
+
+    def test_zip_is_only_repackaged_when_claimed(self):
+        raw_data = zip_bytes({"a/readme.txt": "a", "b/readme.txt": "b"})
+
+        was_stripped, data = Extractor()(raw_data, "application/octet-stream")
+
+        assert not was_stripped
+        assert data.getvalue() == raw_data
+
+
+class TestSanitisedUploadCache:
+    @pytest.fixture
+    def upload_cache(self):
+        upload_cache = SanitisedUploadCache("default")
+        yield upload_cache
+        upload_cache.cache.clear()
+
+    def test_content_hash(self):
+        raw_data = os.urandom(3 * 1024 * 1024 + 7)
+
+        assert content_hash(raw_data, PDF_CONTENT_TYPE) == content_hash(
+            raw_data, PDF_CONTENT_TYPE
+        )
+        assert content_hash(raw_data, PDF_CONTENT_TYPE) != content_hash(
+            raw_data, DOCX_CONTENT_TYPE
+        )
+        assert content_hash(raw_data) != content_hash(raw_data[:-1])
+
+    def test_repeat_uploads_skip_extraction(self, upload_cache, monkeypatch):
+        raw_data = pdf_bytes()
+        was_stripped, sanitised_data = Extractor(cache=upload_cache)(
+            raw_data, PDF_CONTENT_TYPE
+        )
+
+        def fail(*args, **kwargs):
+            raise AssertionError("the extractor should not have been called")
+
+        monkeypatch.setattr(Extractor, "extract", fail)
+        cached_was_stripped, cached_data = Extractor(cache=upload_cache)(
+            raw_data, PDF_CONTENT_TYPE
+        )
+
+        assert was_stripped and cached_was_stripped
+        assert cached_data.getvalue() == sanitised_data.getvalue()
+
+    def test_large_outputs_are_not_cached(self, upload_cache):
+        upload_cache.max_entry_bytes = 10
+        raw_data = pdf_bytes()
+        Extractor(cache=upload_cache)(raw_data, PDF_CONTENT_TYPE)
+
+        cache_key = upload_cache.get_key(
+            raw_data, PDF_CONTENT_TYPE, PDFSaveOptions().get_cache_key()
+        )
+        assert upload_cache.get(cache_key) is None
+
+    def test_pdf_save_options_are_part_of_the_key(self, upload_cache):
+        raw_data = pdf_bytes()
+        Extractor(cache=upload_cache)(raw_data, PDF_CONTENT_TYPE)
+
+        extractor = Extractor(
+            cache=upload_cache, pdf_save_options=PDFSaveOptions(linearize=True)
+        )
+        _, sanitised_data = extractor(raw_data, PDF_CONTENT_TYPE)
+
+        assert pikepdf.open(sanitised_data).is_linearized
+
+    def test_disabled_without_setting(self):
+        assert SanitisedUploadCache.from_settings() is None
+
+
+class TestExtractionLimits:
+    def test_total_uncompressed_bytes(self):
+        raw_data = zip_bytes({"a.txt": b"0" * 1024, "b.txt": b"0" * 1024})
+        extractor = Extractor(limits=ExtractionLimits(max_total_uncompressed_bytes=1500))
+
+        with pytest.raises(ExtractionLimitExceeded):
+            extractor(raw_data, ZIP_CONTENT_TYPE)
+
+    def test_member_ratio(self):
+        raw_data = zip_bytes({"bomb.txt": b"0" * 4 * 1024 * 1024})
+        extractor = Extractor(limits=ExtractionLimits(max_member_ratio=100))
+
+        with pytest.raises(ExtractionLimitExceeded, match="compression ratio"):
+            extractor(raw_data, ZIP_CONTENT_TYPE)
+
+    def test_member_count(self):
+        raw_data = zip_bytes({f"{i}.txt": b"0" for i in range(11)})
+        extractor = Extractor(limits=ExtractionLimits(max_members=10))
+
+        with pytest.raises(ExtractionLimitExceeded):
+            extractor(raw_data, ZIP_CONTENT_TYPE)
+
+    def test_nesting_depth(self):
+        raw_data = zip_bytes({"a.zip": zip_bytes({"b.zip": zip_bytes({"c.txt": b"0"})})})
+
+        Extractor(limits=ExtractionLimits(max_depth=2))(raw_data, ZIP_CONTENT_TYPE)
+        with pytest.raises(ExtractionLimitExceeded, match="nested"):
+            Extractor(limits=ExtractionLimits(max_depth=1))(raw_data, ZIP_CONTENT_TYPE)
+
+    def test_office_documents_are_limited(self):
+        extractor = Extractor(limits=ExtractionLimits(max_total_uncompressed_bytes=10))
+
+        with pytest.raises(ExtractionLimitExceeded):
+            extractor(docx_bytes(), DOCX_CONTENT_TYPE)
+
+    def test_nested_archives_are_sanitised(self):
+        raw_data = zip_bytes({"inner.zip": zip_bytes({"loa.pdf": pdf_bytes()})})
+
+        was_stripped, sanitised_data = Extractor()(raw_data, ZIP_CONTENT_TYPE)
+
+        assert was_stripped
+        with zipfile.ZipFile(sanitised_data, "r") as archive:
+            with zipfile.ZipFile(io.BytesIO(archive.read("inner.zip"))) as inner:
+                pdf = pikepdf.open(io.BytesIO(inner.read("loa.pdf")))
+                assert "/Author" not in pdf.docinfo
+
+
+class TestPDFSaveOptions:
+    def test_linearized(self):
+        extractor = Extractor(pdf_save_options=PDFSaveOptions(linearize=True))
+
+        _, sanitised_data = extractor(pdf_bytes(), PDF_CONTENT_TYPE)
+
+        assert pikepdf.open(sanitised_data).is_linearized
+
+    def test_spooled_to_disk(self):
+        extractor = Extractor(pdf_save_options=PDFSaveOptions(spool_max_size=10))
+
+        _, sanitised_data = extractor(pdf_bytes(), PDF_CONTENT_TYPE)
+
+        assert isinstance(sanitised_data, tempfile.SpooledTemporaryFile)
+        assert sanitised_data._rolled
+        assert "/Author" not in pikepdf.open(sanitised_data).docinfo
+
+    def test_invalid_option(self):
+        with pytest.raises(TypeError):
+            PDFSaveOptions(compression_level=9)
+
+    def test_upload_handler_spools_from_settings(self, monkeypatch):
+        monkeypatch.setattr(settings, "UPLOAD_SANITISATION_PDF_SPOOL_MAX_SIZE", 10, raising=False)
+        spooled = []
+        get_output_file = PDFSaveOptions.get_output_file
+        monkeypatch.setattr(
+            PDFSaveOptions,
+            "get_output_file",
+            lambda self: spooled.append(self.spool_max_size) or get_output_file(self),
+        )
+        handler = ExtractMetadataFileUploadHandler()
+        handler.content_type = PDF_CONTENT_TYPE
+
+        sanitised_bytes = handler.receive_data_chunk(pdf_bytes(), 0)
+
+        assert spooled == [10]
+        assert "/Author" not in pikepdf.open(io.BytesIO(sanitised_bytes)).docinfo
+
+
+class TestBenchmarks:
+    @pytest.mark.parametrize(
+        "raw_data, content_type",
+        [
+            (benchmarks.generate_pdf(pages=2, images=1, image_size=1024), PDF_CONTENT_TYPE),
+            (benchmarks.generate_docx(paragraphs=2, images=1), DOCX_CONTENT_TYPE),
+            (benchmarks.generate_xlsx(sheets=2, rows=2), XLSX_CONTENT_TYPE),
+            (benchmarks.generate_odt(paragraphs=2), ODT_CONTENT_TYPE),
+            (benchmarks.generate_zip(members=3), ZIP_CONTENT_TYPE),
+        ],
+    )
+    def test_generated_documents_are_sanitised(self, raw_data, content_type):
+        assert sniff_content_type(raw_data) == content_type
+        was_stripped, _ = Extractor()(raw_data, content_type)
+        assert was_stripped
+
+    def test_compare_results(self):
+        baseline = {"results": {"PDFExtractor": {
+            "mb_per_second": 10, "p50_ms": 10, "p99_ms": 20, "peak_rss_bytes": 100
+        }}}
+        current = {"results": {"PDFExtractor": {
+            "mb_per_second": 5, "p50_ms": 10.5, "p99_ms": 20, "peak_rss_bytes": 100
+        }}}
+
+        assert benchmarks.compare_results(baseline, current, threshold=0.1) == [
+            "PDFExtractor mb_per_second regressed by 50.0%"
+        ]
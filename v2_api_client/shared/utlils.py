@@ -1,15 +1,14 @@
 from typing import Union
 
-import phonenumbers
 from django.conf import settings
 
-from v2_api_client.client import TRSAPIClient
-
 
 def get_loa_document_bundle() -> Union[dict, None]:
     """Helper function to retrieve the LOA document application bundle from the API.
 
     Returns the LOA document bundle in a dict if it exists, else None"""
+    from v2_api_client.client import TRSAPIClient
+
     client = TRSAPIClient(token=settings.HEALTH_CHECK_TOKEN)
     trs_document_bundles = client.document_bundles()
 
@@ -48,6 +47,9 @@ def is_phone_number_valid(country_code: str, phone_number: str) -> bool:
     """Helper function to validate a phone number given a country code and phone number.
 
     Returns True if the phone number is valid, else False."""
+    # imported here as its metadata makes it slow to import, and it's rarely needed
+    import phonenumbers
+
     try:
         phone_number_obj = phonenumbers.parse(phone_number, country_code)
     except phonenumbers.phonenumberutil.NumberParseException:
@@ -0,0 +1,1371 @@
+import base64
+import datetime
+import decimal
+import json
+import logging
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+from apiclient.exceptions import UnexpectedError
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from urllib3.util import Retry
+
+from v2_api_client import (
+    benchmarks,
+    compression,
+    encoders,
+    hedging,
+    instrumentation,
+    limiter,
+    warmup,
+)
+from v2_api_client.client import TRSAPIClient
+from v2_api_client.exceptions import APICallBudgetExceededError, RateLimitedError
+from v2_api_client.json_backends import (
+    JSON_BACKENDS,
+    JSONDecodeError,
+    TRSJsonRequestFormatter,
+    load_json_backend,
+)
+from v2_api_client.library import BaseAPIClient, healthcheck
+from v2_api_client.middleware import APICallBudgetMiddleware, track_api_calls
+from v2_api_client.mock_api import (
+    MissingRecordingError,
+    MockAPIServer,
+    ReplayAdapter,
+    mount_on_client,
+)
+from v2_api_client.projection import field_projector
+from v2_api_client.transport import BackgroundExecutor, TimedHTTPAdapter, get_shared_adapter
+from v2_api_client.trs_object import TRSObject, get_load_lock
+
+CASE_ID = "0a4b5c6d-1234-4abc-8def-0123456789ab"
+
+
+class StubAPIRequestHandler(BaseHTTPRequestHandler):
+    """Serves canned JSON responses, {path: (status, body)} from the server's responses."""
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        self.respond()
+
+    def do_PATCH(self):
+        self.respond()
+
+    def respond(self):
+        if length := int(self.headers.get("Content-Length") or 0):
+            self.rfile.read(length)
+        self.server.requests.append((self.command, self.path))
+        path, _, query_string = self.path.partition("?")
+        status, body = self.server.responses.get(path, (404, {"detail": "Not found."}))
+        if query := parse_qs(query_string).get("query"):
+            # a minimal version of the API's field selection, "{id,name}"
+            fields = query[0].strip("{}").split(",")
+            if isinstance(body, list):
+                body = [{k: v for k, v in each.items() if k in fields} for each in body]
+            else:
+                body = {k: v for k, v in body.items() if k in fields}
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def api_server(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubAPIRequestHandler)
+    server.responses = {}
+    server.requests = []
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+    )
+    thread.start()
+    monkeypatch.setattr(settings, "API_BASE_URL", f"http://127.0.0.1:{server.server_port}")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client():
+    return TRSAPIClient(token="test-token")
+
+
+class RecordingObserver(instrumentation.BaseObserver):
+    def __init__(self):
+        self.request_events = []
+        self.object_events = []
+
+    def request_finished(self, event):
+        self.request_events.append(event)
+
+    def object_event(self, event):
+        self.object_events.append(event)
+
+
+@pytest.fixture
+def observer():
+    observer = instrumentation.register_observer(RecordingObserver())
+    yield observer
+    instrumentation.unregister_observer(observer)
+
+
+class TestInstrumentation:
+    def test_request_events(self, api_server, client, observer):
+        api_server.responses[f"/api/v2/cases/{CASE_ID}/get_status/"] = (200, {"id": 1})
+
+        client.cases.get(client.cases.url(f"cases/{CASE_ID}/get_status"))
+
+        (event,) = observer.request_events
+        assert event.method == "GET"
+        assert event.base_endpoint == "cases"
+        assert event.path == "cases/{id}/get_status"
+        assert event.status_code == 200
+        assert event.response_bytes == len(b'{"id": 1}')
+        assert event.connect_time > 0
+        assert event.ttfb > 0
+        assert event.total_time >= event.ttfb
+
+    def test_retries_are_counted(self, mock_api, client, observer):
+        mock_api.add("cases", {"id": CASE_ID, "name": "Steel"})
+        calls = []
+
+        def get_status(method, obj, data, query):
+            calls.append(method)
+            return (503, {}) if len(calls) == 1 else {"stage": 1}
+
+        mock_api.add_action("cases", "get_status", get_status)
+        mount_on_client(
+            client, TimedHTTPAdapter(max_retries=Retry(total=1, status_forcelist=[503]))
+        )
+
+        assert client.cases.make_trs_object(CASE_ID, lazy=True).get_status() == {"stage": 1}
+        (event,) = observer.request_events
+        assert event.retries == 1
+
+    def test_failed_request_events(self, api_server, client, observer):
+        with pytest.raises(Exception):
+            client.cases.get(client.cases.url("cases/missing"))
+
+        (event,) = observer.request_events
+        assert event.status_code == 404
+        assert event.exception is not None
+
+    def test_object_events(self, api_server, client, observer):
+        api_server.responses[f"/api/v2/cases/{CASE_ID}/"] = (
+            200,
+            {"id": CASE_ID, "created_at": "2023-03-21T13:23:20.123456Z"},
+        )
+
+        case = client.cases(CASE_ID)
+        assert case.id == CASE_ID
+
+        assert [event.action for event in observer.object_events] == ["lazy_load"]
+        assert observer.object_events[0].base_endpoint == "cases"
+
+    def test_metrics_observer(self, api_server, client):
+        registry = instrumentation.MetricsRegistry()
+        metrics_observer = instrumentation.register_observer(
+            instrumentation.MetricsObserver(registry)
+        )
+        api_server.responses["/api/v2/cases/"] = (200, [{"id": CASE_ID}])
+        try:
+            client.cases()
+            client.cases()
+        finally:
+            instrumentation.unregister_observer(metrics_observer)
+
+        assert (
+            metrics_observer.requests.get(
+                method="GET", endpoint="cases", status=200, cache_hit=False
+            )
+            == 2
+        )
+        assert metrics_observer.request_duration.get_count(method="GET", endpoint="cases") == 2
+        assert 'trs_api_client_requests_total{cache_hit="False"' in registry.render()
+
+    def test_logging_observer(self, api_server, client, caplog):
+        logging_observer = instrumentation.register_observer(instrumentation.LoggingObserver())
+        api_server.responses["/api/v2/cases/"] = (200, [])
+        try:
+            with caplog.at_level("INFO", logger="v2_api_client.requests"):
+                client.cases()
+        finally:
+            instrumentation.unregister_observer(logging_observer)
+
+        (record,) = caplog.records
+        assert record.getMessage().startswith("API GET cases 200")
+        assert record.api_request["status_code"] == 200
+
+    def test_path_template(self):
+        assert (
+            instrumentation.get_path_template(
+                f"http://api/api/v2/cases/{CASE_ID}/get_status/?query=%7Bid%7D"
+            )
+            == "cases/{id}/get_status"
+        )
+        assert instrumentation.get_path_template("http://api/api/v2/users/12/") == "users/{id}"
+
+
+class TestAPICallBudget:
+    @pytest.fixture
+    def cases(self, api_server):
+        api_server.responses["/api/v2/cases/"] = (200, [{"id": CASE_ID}])
+        api_server.responses[f"/api/v2/cases/{CASE_ID}/"] = (200, {"id": CASE_ID})
+        api_server.responses[f"/api/v2/organisations/{CASE_ID}/get_organisation_card_data/"] = (
+            200,
+            {"id": CASE_ID},
+        )
+
+    def test_track_api_calls(self, cases, client):
+        with track_api_calls() as tracker:
+            client.cases()
+            client.cases()
+            client.cases(CASE_ID).id
+
+        assert tracker.calls == 3
+        assert tracker.total_time > 0
+        assert tracker.duplicate_urls == {
+            f"GET {settings.API_BASE_URL}/api/v2/cases/": 2
+        }
+
+    def test_calls_outside_of_tracking_are_ignored(self, cases, client):
+        with track_api_calls() as tracker:
+            pass
+        client.cases()
+
+        assert tracker.calls == 0
+
+    def test_budget(self, cases, client):
+        with track_api_calls(budget=1, raise_on_violation=True):
+            client.cases()
+            with pytest.raises(APICallBudgetExceededError):
+                client.cases()
+
+    def test_repeat_threshold(self, cases, client):
+        with track_api_calls(repeat_threshold=2) as tracker:
+            for _ in range(3):
+                client.cases(CASE_ID).id
+
+        assert tracker.violations == [
+            "GET cases/{id} was called more than 2 times in a row, this is likely an N+1 query"
+        ]
+
+    def test_concurrent_calls_are_tracked(self, cases, client):
+        with track_api_calls() as tracker:
+            client.organisations.get_organisation_cards(CASE_ID, CASE_ID)
+
+        assert tracker.calls == 2
+
+    def test_middleware(self, cases, client, caplog):
+        def view(request):
+            client.cases()
+            return "response"
+
+        request = SimpleNamespace(method="GET", path="/cases/")
+        with caplog.at_level("INFO", logger="v2_api_client.middleware"):
+            response = APICallBudgetMiddleware(view)(request)
+
+        assert response == "response"
+        assert request.api_calls.calls == 1
+        assert caplog.records[0].getMessage().startswith("GET /cases/ made 1 API calls")
+
+
+class TestSlimAndProjection:
+    @pytest.fixture
+    def cases(self, api_server):
+        case = {"id": CASE_ID, "name": "Steel", "reference": "AD0001", "type": {"id": 1}}
+        api_server.responses["/api/v2/cases/"] = (200, [case])
+        api_server.responses[f"/api/v2/cases/{CASE_ID}/"] = (200, case)
+        yield
+        field_projector.clear()
+
+    def test_slim(self):
+        assert BaseAPIClient.url("cases", slim=True).endswith("/api/v2/cases/?slim=true")
+        assert BaseAPIClient.url("cases", slim=False).endswith("/api/v2/cases/")
+
+    def test_slim_reaches_the_api(self, cases, api_server, client):
+        client.cases(slim=True)
+
+        assert api_server.requests == [("GET", "/api/v2/cases/?slim=true")]
+
+    def list_case_names(self, client):
+        return [case.name for case in client.cases()]
+
+    def test_projection(self, cases, api_server):
+        client = TRSAPIClient(token="test-token", projection=True)
+
+        assert self.list_case_names(client) == ["Steel"]
+        assert self.list_case_names(client) == ["Steel"]
+
+        assert api_server.requests == [
+            ("GET", "/api/v2/cases/"),
+            ("GET", "/api/v2/cases/?query=%7Bid%2Cname%7D"),
+        ]
+
+    def test_projection_falls_back_to_full_object(self, cases, api_server):
+        client = TRSAPIClient(token="test-token", projection=True)
+        for _ in range(2):
+            case = client.cases(CASE_ID)
+            assert case.name == "Steel"
+
+        assert case.reference == "AD0001"
+        assert "type" in case
+        assert api_server.requests == [
+            ("GET", f"/api/v2/cases/{CASE_ID}/"),
+            ("GET", f"/api/v2/cases/{CASE_ID}/?query=%7Bid%2Cname%7D"),
+            ("GET", f"/api/v2/cases/{CASE_ID}/"),
+        ]
+
+    def test_projected_list_falls_back_once(self, cases, api_server):
+        cases = [
+            {"id": CASE_ID, "name": "Steel", "reference": "AD0001"},
+            {"id": str(uuid.uuid4()), "name": "Aluminium", "reference": "AD0002"},
+        ]
+        api_server.responses["/api/v2/cases/"] = (200, cases)
+        client = TRSAPIClient(token="test-token", projection=True)
+
+        def list_cases(field):
+            return [getattr(case, field) for case in client.cases()]
+
+        list_cases("name")
+
+        assert list_cases("reference") == ["AD0001", "AD0002"]
+        assert api_server.requests == [
+            ("GET", "/api/v2/cases/"),
+            ("GET", "/api/v2/cases/?query=%7Bid%2Cname%7D"),
+            ("GET", "/api/v2/cases/"),
+        ]
+
+    def test_whole_objects_arent_projected(self, cases, api_server):
+        client = TRSAPIClient(token="test-token", projection=True)
+        case = {"id": CASE_ID, "name": "Steel", "reference": "AD0001", "type": {"id": 1}}
+
+        for _ in range(2):
+            assert json.loads(encoders.dumps(client.cases())) == [case]
+
+        assert api_server.requests == [("GET", "/api/v2/cases/")] * 2
+
+    def test_whole_projected_object_falls_back(self, cases, api_server):
+        client = TRSAPIClient(token="test-token", projection=True)
+        case = {"id": CASE_ID, "name": "Steel", "reference": "AD0001", "type": {"id": 1}}
+
+        def get_cases(whole):
+            cases = client.cases()
+            if whole:
+                return [dict(each.items()) for each in cases]
+            return [{"name": each.name} for each in cases]
+
+        get_cases(False)
+
+        assert get_cases(True) == [case]
+        assert [list(each) for each in client.cases()] == [list(case)]
+        assert get_cases(True) == [case]
+        assert api_server.requests == [
+            ("GET", "/api/v2/cases/"),
+            ("GET", "/api/v2/cases/?query=%7Bid%2Cname%7D"),
+            ("GET", "/api/v2/cases/"),
+            ("GET", "/api/v2/cases/"),
+            ("GET", "/api/v2/cases/"),
+        ]
+
+    def test_projection_is_off_by_default(self, cases, api_server, client):
+        self.list_case_names(client)
+        self.list_case_names(client)
+
+        assert api_server.requests == [("GET", "/api/v2/cases/")] * 2
+
+
+def available_json_backends():
+    backends = []
+    for name in JSON_BACKENDS:
+        try:
+            backends.append(load_json_backend(name))
+        except ImportError:
+            pass
+    return backends
+
+
+class TestJSONBackends:
+    data = {
+        "id": uuid.UUID(CASE_ID),
+        "created_at": datetime.datetime(2023, 3, 21, 13, 23, 20, 123456),
+        "initiated": datetime.date(2023, 3, 21),
+        "amount": decimal.Decimal("1.50"),
+        "tags": ["steel", None, True, 1.5],
+    }
+    # every type DjangoJSONEncoder handles, in every form that encodes differently
+    django_types = [
+        datetime.datetime(2023, 1, 1, 12, 0, 0, 123456),
+        datetime.datetime(2023, 1, 1, 12, 0, 0, 123456, tzinfo=datetime.timezone.utc),
+        datetime.datetime(2023, 1, 1, 12, tzinfo=datetime.timezone(datetime.timedelta(hours=1))),
+        datetime.date(2023, 1, 1),
+        datetime.time(12, 0, 0, 123456),
+        datetime.timedelta(seconds=5),
+        datetime.timedelta(days=-1, microseconds=1),
+        decimal.Decimal("1.50"),
+        uuid.UUID(CASE_ID),
+    ]
+
+    @pytest.mark.parametrize("backend", available_json_backends(), ids=lambda b: b.name)
+    def test_dumps_like_django(self, backend):
+        assert json.loads(backend.dumps(self.data)) == json.loads(
+            json.dumps(self.data, cls=DjangoJSONEncoder)
+        )
+
+    @pytest.mark.parametrize("backend", available_json_backends(), ids=lambda b: b.name)
+    def test_every_django_type_encodes_like_django(self, backend):
+        expected = json.dumps({"values": self.django_types}, cls=DjangoJSONEncoder)
+
+        assert json.loads(backend.dumps({"values": self.django_types})) == json.loads(expected)
+
+    @pytest.mark.parametrize("backend", available_json_backends(), ids=lambda b: b.name)
+    def test_dumps_with_default(self, backend):
+        assert json.loads(backend.dumps(self.data, default=str)) == json.loads(
+            json.dumps(self.data, default=str)
+        )
+
+    @pytest.mark.parametrize("backend", available_json_backends(), ids=lambda b: b.name)
+    def test_loads(self, backend):
+        assert backend.loads(b'{"id": 1, "names": ["a"]}') == {"id": 1, "names": ["a"]}
+        with pytest.raises(JSONDecodeError):
+            backend.loads(b"<html>")
+
+    def test_filter_parameters(self):
+        url = BaseAPIClient.url(
+            "cases", filter_parameters={"created_at": self.data["created_at"]}
+        )
+        encoded = parse_qs(url.split("?")[1])["filter_parameters"][0]
+
+        assert json.loads(base64.urlsafe_b64decode(encoded)) == {
+            "created_at": "2023-03-21 13:23:20.123456"
+        }
+
+    def test_responses(self, api_server, client):
+        api_server.responses["/api/v2/cases/"] = (200, [{"id": CASE_ID, "name": "Steel"}])
+
+        assert client.cases.get(client.cases.url("cases")) == [{"id": CASE_ID, "name": "Steel"}]
+
+    def test_json_request_bodies(self):
+        body = TRSJsonRequestFormatter.format({"case": uuid.UUID(CASE_ID)})
+
+        assert json.loads(body) == {"case": CASE_ID}
+        assert TRSJsonRequestFormatter.get_headers() == {"Content-type": "application/json"}
+
+
+class TestTRSObjectJsonEncoder:
+    def make_object(self, **data):
+        return TRSObject(
+            data={"id": CASE_ID, "created_at": "2023-03-21T13:23:20.123Z", **data},
+            api_client=SimpleNamespace(base_endpoint="cases/"),
+        )
+
+    def expected(self, **data):
+        return {"id": CASE_ID, "created_at": "2023-03-21T13:23:20.123Z", **data}
+
+    def test_encodes_in_one_pass(self):
+        submission = self.make_object(
+            documents=[{"id": 1, "created_at": "2023-03-21T13:23:20"}], type={"name": "ROI"}
+        )
+
+        encoded = json.loads(json.dumps(submission, cls=encoders.TRSObjectJsonEncoder))
+
+        assert encoded == self.expected(
+            documents=[{"id": 1, "created_at": "2023-03-21T13:23:20"}], type={"name": "ROI"}
+        )
+
+    def test_nested_objects(self):
+        case = self.make_object(name="Steel")
+        payload = {"case": case, "submissions": [self.make_object(), self.make_object()]}
+
+        encoded = json.loads(json.dumps(payload, cls=encoders.TRSObjectJsonEncoder))
+
+        assert encoded["case"] == self.expected(name="Steel")
+        assert encoded["submissions"] == [self.expected(), self.expected()]
+
+    def test_bulk_dumps(self):
+        objects = [self.make_object(index=index) for index in range(100)]
+
+        assert json.loads(encoders.dumps(objects)) == [
+            self.expected(index=index) for index in range(100)
+        ]
+        assert json.loads(encoders.dumps(objects)) == json.loads(
+            json.dumps(objects, cls=encoders.TRSObjectJsonEncoder)
+        )
+
+    def test_to_python(self):
+        case = self.make_object(tags=[{"name": "steel"}])
+
+        converted = encoders.to_python([case])
+
+        assert converted == [
+            {
+                "id": CASE_ID,
+                "created_at": datetime.datetime(
+                    2023, 3, 21, 13, 23, 20, 123000, tzinfo=datetime.timezone.utc
+                ),
+                "tags": [{"name": "steel"}],
+            }
+        ]
+        assert type(converted[0]) is dict and type(converted[0]["tags"][0]) is dict
+
+
+@pytest.fixture
+def mock_api(monkeypatch):
+    with MockAPIServer() as server:
+        monkeypatch.setattr(settings, "API_BASE_URL", server.url)
+        yield server
+
+
+class TestMockAPI:
+    def test_crud(self, mock_api, client):
+        case = client.cases({"name": "Steel"})
+        assert client.cases(case.id).name == "Steel"
+
+        client.cases.update(case.id, {"name": "Aluminium"})
+        assert [each.name for each in client.cases()] == ["Aluminium"]
+
+        client.cases.delete_object(case.id)
+        assert client.cases() == []
+
+    def test_filter_parameters(self, mock_api, client):
+        mock_api.add("cases", {"name": "Steel", "archived": False})
+        mock_api.add("cases", {"name": "Ceramics", "archived": True})
+
+        assert [each.name for each in client.cases(archived=False)] == ["Steel"]
+
+    def test_actions(self, mock_api, client):
+        mock_api.add("cases", {"id": CASE_ID, "name": "Steel"})
+        mock_api.add_action(
+            "cases", "get_status", lambda method, obj, data, query: {"stage": obj["name"]}
+        )
+        mock_api.add_action(
+            "cases",
+            "get_case_by_number",
+            lambda method, obj, data, query: {"id": CASE_ID, "number": query["case_number"][0]},
+            detail=False,
+        )
+
+        assert client.cases(CASE_ID).get_status() == {"stage": "Steel"}
+        assert client.cases.get_case_by_number("TD0001").number == "TD0001"
+
+    def test_injected_faults_are_deterministic(self, monkeypatch, client):
+        def statuses():
+            with MockAPIServer(error_rate=0.2, throttle_rate=0.2, seed=42) as server:
+                monkeypatch.setattr(settings, "API_BASE_URL", server.url)
+                results = []
+                for _ in range(20):
+                    try:
+                        client.cases()
+                        results.append(200)
+                    except Exception as exc:
+                        results.append(type(exc).__name__)
+                return results
+
+        first = statuses()
+        assert first == statuses()
+        assert "RateLimitedError" in first and "ServerError" in first
+
+    def test_replay_adapter(self, tmp_path, client):
+        adapter = ReplayAdapter()
+        adapter.add("GET", f"/api/v2/cases/{CASE_ID}/", {"id": CASE_ID, "name": "Steel"})
+        adapter.save(tmp_path / "recordings.json")
+
+        adapter = ReplayAdapter.from_file(tmp_path / "recordings.json")
+        mount_on_client(client, adapter)
+
+        assert client.cases(CASE_ID).name == "Steel"
+        assert adapter.requests == [("GET", f"/api/v2/cases/{CASE_ID}/")]
+        with pytest.raises(UnexpectedError) as excinfo:
+            client.cases()
+        assert isinstance(excinfo.value.__cause__, MissingRecordingError)
+
+
+class TestBenchmarks:
+    def test_run_benchmarks(self, mock_api):
+        mock_api.compress_responses = True
+        organisation_ids = benchmarks.populate(mock_api, list_sizes=(2, 3))
+
+        results = benchmarks.run_benchmarks(
+            organisation_ids, list_sizes=(2, 3), min_time=0, min_iterations=1, warmup=0
+        )
+
+        assert list(results) == [
+            "client_construction",
+            "url_building",
+            "get_many_2",
+            "get_many_3",
+            "attribute_access",
+            "encode_nested_dict",
+            "get_concurrently",
+            "refresh",
+            "lazy_objects_3",
+            "get_many_3_identity",
+            "get_many_3_gzip",
+            "decompress_3_gzip",
+        ]
+        assert all(result["ops_per_second"] > 0 for result in results.values())
+        assert results["get_many_3"]["peak_allocated_bytes"] > 0
+        assert results["lazy_objects_3"]["retained_bytes"] > 0
+        identity, compressed = results["get_many_3_identity"], results["get_many_3_gzip"]
+        assert identity["wire_bytes"] == identity["content_bytes"] == compressed["content_bytes"]
+        assert compressed["wire_bytes"] < compressed["content_bytes"] / 2
+
+    def test_refresh(self, mock_api, client):
+        mock_api.add("cases", {"id": CASE_ID, "name": "Steel"})
+        case = client.cases()[0]
+        mock_api.resources["cases"][CASE_ID]["name"] = "Aluminium"
+
+        assert case.refresh() is case
+        assert case.name == "Aluminium"
+
+    def test_compare_results(self):
+        baseline = {"results": {"refresh": {
+            "ops_per_second": 100, "p50_us": 10, "p99_us": 20, "peak_allocated_bytes": 100
+        }}}
+        current = {"results": {"refresh": {
+            "ops_per_second": 100, "p50_us": 10, "p99_us": 30, "peak_allocated_bytes": 105
+        }}}
+
+        assert benchmarks.compare_results(baseline, current, threshold=0.1) == [
+            "refresh p99_us regressed by 50.0%"
+        ]
+
+
+class TestHealthCheck:
+    def test_get_status(self, mock_api, client):
+        assert client.healthcheck() == "OK"
+
+        result = healthcheck.get_result()
+        assert result.ok and result.latency > 0
+
+    def test_timeout(self, mock_api):
+        mock_api.latency = 0.2
+
+        result = healthcheck.get_result(timeout=0.01)
+
+        assert not result.ok
+        assert isinstance(result.exception, requests.Timeout)
+        with pytest.raises(requests.Timeout):
+            healthcheck.get_status(timeout=0.01)
+
+    def test_cached(self, mock_api):
+        assert healthcheck.get_status(max_age=0.05) == "OK"
+        assert healthcheck.get_status(max_age=0.05) == "OK"
+        assert len(mock_api.requests) == 1
+
+        time.sleep(0.05)
+        mock_api.latency = 0.1
+        # the stale result is returned straight away, and refreshed once in the background
+        start = time.perf_counter()
+        results = [healthcheck.get_result(max_age=0.05) for _ in range(5)]
+        assert time.perf_counter() - start < 0.1
+        assert all(result.age >= 0.05 for result in results)
+
+        time.sleep(0.2)
+        assert healthcheck.get_result(max_age=0.05).age < 0.2
+        assert len(mock_api.requests) == 2
+
+    def test_uses_the_shared_connection_pool(self, client):
+        adapter = get_shared_adapter()
+
+        assert client.cases.get_session().get_adapter("https://trs-api.test") is adapter
+        assert client.users.get_session().get_adapter("http://trs-api.test") is adapter
+        assert client.cases.get_session() is not client.users.get_session()
+
+
+@pytest.fixture
+def response_cache(monkeypatch):
+    monkeypatch.setattr(
+        settings, "API_RESPONSE_CACHE_TIMEOUTS", {"django-feature-flags": 60}, raising=False
+    )
+    monkeypatch.setattr(
+        settings, "API_RESPONSE_CACHE_SHARED", ["django-feature-flags"], raising=False
+    )
+    cache.clear()
+    yield
+    cache.clear()
+
+
+class TestResponseCache:
+    def test_cached(self, mock_api, response_cache, client, observer):
+        mock_api.add("django-feature-flags", {"name": "ROI_V2", "enabled": True})
+
+        with track_api_calls() as tracker:
+            assert client.feature_flags()[0].name == "ROI_V2"
+            assert TRSAPIClient(token="other-token").feature_flags()[0].name == "ROI_V2"
+
+        assert len(mock_api.requests) == 1
+        assert [event.cache_hit for event in observer.request_events] == [False, True]
+        assert tracker.calls == 1 and tracker.cache_hits == 1
+
+    def test_not_shared_between_users(self, monkeypatch, mock_api, response_cache):
+        monkeypatch.setattr(settings, "API_RESPONSE_CACHE_TIMEOUTS", {"cases": 60}, raising=False)
+        mock_api.add("cases", {"id": CASE_ID, "name": "Steel"})
+
+        for token in ("test-token", "other-token"):
+            client = TRSAPIClient(token=token)
+            client.cases()
+            client.cases()
+
+        assert len(mock_api.requests) == 2
+
+    def test_only_configured_endpoints(self, mock_api, response_cache, client):
+        client.cases()
+        client.cases()
+
+        assert len(mock_api.requests) == 2
+
+    def test_writes_invalidate(self, mock_api, response_cache, client):
+        flag = client.feature_flags({"name": "ROI_V2"})
+        assert len(client.feature_flags()) == 1
+
+        client.feature_flags.delete_object(flag.id)
+
+        assert client.feature_flags() == []
+
+
+@pytest.fixture
+def stale_cache(monkeypatch, response_cache):
+    monkeypatch.setattr(
+        settings, "API_RESPONSE_CACHE_MAX_STALE", {"django-feature-flags": 300}, raising=False
+    )
+    # a private executor, so the tests can wait for the background refreshes
+    executor = BackgroundExecutor(max_workers=1)
+    monkeypatch.setattr("v2_api_client.library.get_shared_executor", lambda: executor)
+    yield executor
+    executor.shutdown()
+
+
+class TestStaleWhileRevalidate:
+    def test_serves_stale_and_refreshes_once(
+        self, monkeypatch, mock_api, stale_cache, client, observer
+    ):
+        mock_api.add("django-feature-flags", {"name": "ROI_V2", "enabled": True})
+        stale_hits = instrumentation.metrics.counter(
+            "trs_api_client_response_cache_stale_total", ""
+        )
+        stale_before = stale_hits.get(endpoint="django-feature-flags")
+        client.feature_flags()
+        mock_api.add("django-feature-flags", {"name": "V2_TESTS", "enabled": True})
+
+        expired = time.time() + 61
+        monkeypatch.setattr(time, "time", lambda: expired)
+        assert len(client.feature_flags()) == 1
+        assert len(client.feature_flags()) == 1
+        stale_cache.shutdown(wait=True)
+
+        assert len(mock_api.requests) == 2
+        cache_hits = [event for event in observer.request_events if event.cache_hit]
+        assert [event.stale for event in cache_hits] == [True, True]
+        assert stale_hits.get(endpoint="django-feature-flags") == stale_before + 2
+        # refreshed, and fresh again
+        assert len(client.feature_flags()) == 2
+        assert len(mock_api.requests) == 2
+        assert observer.request_events[-1].stale is False
+
+    def test_too_stale_is_fetched(self, monkeypatch, mock_api, stale_cache, client):
+        mock_api.add("django-feature-flags", {"name": "ROI_V2", "enabled": True})
+        client.feature_flags()
+        mock_api.add("django-feature-flags", {"name": "V2_TESTS", "enabled": True})
+
+        too_old = time.time() + 61 + 300
+        monkeypatch.setattr(time, "time", lambda: too_old)
+
+        assert len(client.feature_flags()) == 2
+        assert len(mock_api.requests) == 2
+
+
+class TestWarmUp:
+    def test_open_connections(self, mock_api):
+        assert warmup.open_connections(3) == 3
+        assert mock_api.requests == [("GET", "/healthcheck")] * 3
+
+    def test_warm_up(self, mock_api, response_cache, client):
+        mock_api.add("django-feature-flags", {"name": "ROI_V2", "enabled": True})
+
+        summary = warmup.warm_up(connections=2, paths=["feature_flags", "unknown"])
+
+        assert summary["connections"] == 2
+        assert summary["preloaded"] == ["feature_flags"]
+        client.feature_flags()
+        assert mock_api.requests.count(("GET", "/api/v2/django-feature-flags/")) == 1
+
+    def test_connection_errors_are_logged(self, monkeypatch, caplog):
+        monkeypatch.setattr(settings, "API_BASE_URL", "http://127.0.0.1:9")
+
+        assert warmup.warm_up(connections=1) == {
+            "connections": 0, "preloaded": [], "duration": pytest.approx(0, abs=2)
+        }
+        assert "Could not open a connection to the API" in caplog.text
+
+
+IMPORT_CHECK = """
+import logging
+import sys
+import time
+
+make_record = logging.Logger.makeRecord
+start = time.perf_counter()
+import v2_api_client.client
+import v2_api_client.shared.logging
+import v2_api_client.shared.utlils
+import v2_api_client.shared.upload_handler.django_upload_handler
+print(time.perf_counter() - start)
+print(",".join(module for module in {modules!r} if module in sys.modules))
+print(logging.Logger.makeRecord is make_record)
+"""
+
+
+class TestImports:
+    # slow to import, and only needed by some code paths. concurrent.futures isn't one of them,
+    # see test_concurrent_futures_is_imported_by_apiclient()
+    HEAVY_MODULES = ("pikepdf", "lxml", "phonenumbers", "dateutil", "django.db.models")
+
+    def test_heavy_dependencies_are_imported_lazily(self):
+        # in a fresh interpreter, without the Django settings configured
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_CHECK.format(modules=self.HEAVY_MODULES)],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.splitlines()
+        import_time, imported_modules, make_record_untouched = output
+
+        assert imported_modules == "", f"imported in {float(import_time) * 1000:.0f}ms"
+        assert make_record_untouched == "True"
+
+    def test_concurrent_futures_is_imported_by_apiclient(self):
+        # through asyncio, so the client's own module-level imports of it cost nothing. If this
+        # fails, they should be made lazy
+        check = "import apiclient, sys; print('concurrent.futures' in sys.modules)"
+        output = subprocess.run(
+            [sys.executable, "-c", check],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+
+        assert output == "True"
+
+    def test_audit_log_extra_details(self):
+        from v2_api_client.shared.logging import AuditLogFormatter
+
+        record = logging.getLogger("audit_trail").makeRecord(
+            "audit_trail", logging.INFO, "", 0, "Case viewed", (), None, extra={"case": 1}
+        )
+
+        assert AuditLogFormatter().format(record) == "AUDIT LOG - INFO - Case viewed - {'case': 1}"
+
+
+class TestDirtyTracking:
+    @pytest.fixture
+    def case(self, mock_api, client):
+        mock_api.add("cases", {"id": CASE_ID, "name": "Steel", "archived": "False"})
+        mock_api.requests.clear()
+        return client.cases(CASE_ID)
+
+    def test_changes_are_recorded(self, case):
+        case.name = "Aluminium"
+        case["type"] = {"name": "Anti-dumping"}
+
+        assert case.changed_data == {"name": "Aluminium", "type": {"name": "Anti-dumping"}}
+        assert case.name == "Aluminium"
+        assert case.type.name == "Anti-dumping"
+        assert case.archived == "False"
+
+    def test_save_sends_only_changed_fields(self, mock_api, case):
+        case.name = "Aluminium"
+
+        assert case.save() is case
+
+        assert mock_api.resources["cases"][CASE_ID]["name"] == "Aluminium"
+        assert case.changed_data == {}
+        # the object is loaded from the PATCH response, there's no need to GET it
+        assert case.archived == "False"
+        # nothing left to save
+        case.save()
+        assert mock_api.requests == [("PATCH", f"/api/v2/cases/{CASE_ID}/")]
+
+    def test_save_nested_value(self, mock_api, case):
+        case["deficiency_notice_params"] = {"a": 1, "b": [2, 3]}
+        case.save()
+
+        assert mock_api.resources["cases"][CASE_ID]["deficiency_notice_params"] == {
+            "a": 1,
+            "b": [2, 3],
+        }
+        assert case.deficiency_notice_params.a == 1
+
+    def test_save_lazy_object(self, mock_api, case):
+        case.name = "Aluminium"
+        # only the id is asked for, the object is still loaded in full when it's next used
+        case.save(fields=["id"])
+
+        assert mock_api.requests == [("PATCH", f"/api/v2/cases/{CASE_ID}/")]
+        assert case.archived == "False"
+        assert case.name == "Aluminium"
+
+    def test_unsaved_changes_survive_lazy_loading(self, case):
+        case.name = "Aluminium"
+
+        assert case.name == "Aluminium"
+        assert case.archived == "False"
+
+    def test_object_attributes_are_not_fields(self, case):
+        case.object_id = CASE_ID
+        case.retrieval_url = client_url = case.retrieval_url
+
+        assert case.changed_data == {}
+        assert case.retrieval_url == client_url
+
+
+class TestBulk:
+    def test_bulk_create_preserves_order(self, mock_api, client):
+        results = client.contacts.bulk_create(
+            [{"name": f"Contact {index}"} for index in range(10)], max_workers=4
+        )
+
+        assert [each.index for each in results] == list(range(10))
+        assert [each.name for each in results.results] == [
+            f"Contact {index}" for index in range(10)
+        ]
+        assert len(mock_api.resources["contacts"]) == 10
+
+    def test_failures_dont_abort_the_batch(self, mock_api, client):
+        contact, other_contact = mock_api.generate("contacts", 2)
+        contact["name"] = "Changed"
+        changed = client.contacts(contact["id"])
+        changed.name = "Also changed"
+
+        results = client.contacts.bulk_update(
+            [contact, {"id": CASE_ID, "name": "Missing"}, changed], max_workers=3
+        )
+
+        assert [each.ok for each in results] == [True, False, True]
+        assert type(results.failed[0].exception).__name__ == "NotFoundError"
+        assert results[2].result is changed
+        assert mock_api.resources["contacts"][contact["id"]]["name"] == "Also changed"
+
+        results = client.contacts.bulk_delete([other_contact["id"], CASE_ID])
+        assert [each.ok for each in results] == [True, False]
+        assert other_contact["id"] not in mock_api.resources["contacts"]
+
+    def test_bulk_endpoint(self, monkeypatch, mock_api, client):
+        def bulk(method, obj, data, query):
+            if any(not each.get("name") for each in data):
+                return 400, {
+                    "exception_type": "save_serializer_invalid_error",
+                    "serializer_name": "ContactSerializer",
+                    "name": ["This field is required."],
+                }
+            return mock_api.add("contacts", *data)
+
+        mock_api.add_action("contacts", "bulk", bulk, detail=False)
+        monkeypatch.setattr(client.contacts, "bulk_endpoint", "bulk")
+
+        results = client.contacts.bulk_create(
+            [{"name": "First"}, {"name": "Second"}, {"name": ""}], batch_size=2
+        )
+
+        assert [each.ok for each in results] == [True, True, False]
+        assert results.failed[0].field_errors == {"name": ["This field is required."]}
+        assert [each.name for each in results.results] == ["First", "Second"]
+        assert [each[0] for each in mock_api.requests] == ["POST", "POST"]
+
+
+class TestRunAction:
+    def test_run_action(self, mock_api, client):
+        contacts = mock_api.generate("contacts", 5)
+
+        def add_to_case(method, obj, data, query):
+            if obj["name"] == "contacts 3":
+                return 400, {"detail": "Already on the case."}
+            obj["case_id"] = data["case_id"]
+            return obj
+
+        mock_api.add_action("contacts", "add_to_case", add_to_case)
+
+        results = client.contacts.add_to_case([each["id"] for each in contacts], CASE_ID)
+
+        assert [each.item for each in results] == [each["id"] for each in contacts]
+        assert [each.ok for each in results] == [True, True, True, False, True]
+        assert [each.result["name"] for each in results.succeeded] == [
+            "contacts 0", "contacts 1", "contacts 2", "contacts 4"
+        ]
+        assert all(each["case_id"] == CASE_ID for each in contacts if each["name"] != "contacts 3")
+
+    def test_calls_to_one_object_are_made_in_order(self, mock_api, client):
+        user = mock_api.add("users", {"groups": []})[0]
+
+        def change_group(method, obj, data, query):
+            obj["groups"] = obj["groups"] + [data["group_name"]]
+            return dict(obj)
+
+        mock_api.add_action("users", "change_group", change_group)
+
+        results = client.users.run_action(
+            "change_group",
+            "put",
+            [user["id"]] * 3,
+            data=[{"group_name": name} for name in ("Caseworker", "Manager", "Admin")],
+            max_workers=3,
+        )
+
+        assert [each.result["groups"] for each in results] == [
+            ["Caseworker"], ["Caseworker", "Manager"], ["Caseworker", "Manager", "Admin"]
+        ]
+        assert client.users(user["id"]).add_group("Viewer")["groups"][-1] == "Viewer"
+        with pytest.raises(ValueError):
+            client.users.run_action("change_group", "put", [user["id"]], data=[{}, {}])
+
+
+class TestIdentityMap:
+    @pytest.fixture
+    def client(self):
+        return TRSAPIClient(token="test", identity_map=True)
+
+    def test_one_object_per_id(self, mock_api, client):
+        mock_api.add("cases", {"id": CASE_ID, "name": "Steel"})
+
+        case = client.cases(CASE_ID)
+        assert case.name == "Steel"
+        assert client.cases(CASE_ID) is case
+        assert client.cases()[0] is case
+        assert [each[0] for each in mock_api.requests] == ["GET", "GET"]
+
+        client.cases.update(CASE_ID, {"name": "Aluminium"})
+        assert case.name == "Aluminium"
+        assert TRSAPIClient(token="test").cases(CASE_ID) is not case
+
+    def test_partial_objects_are_not_reused_for_full_retrievals(self, mock_api, client):
+        mock_api.add("cases", {"id": CASE_ID, "name": "Steel"})
+
+        case = client.cases(fields=["id"])[0]
+        assert client.cases(CASE_ID).name == "Steel"
+        assert client.cases(CASE_ID) is not case
+        # but a full response is merged into the partial object
+        assert client.cases()[0] is client.cases(CASE_ID)
+
+    def test_partial_objects_are_not_reused_for_other_fields(self, mock_api, client):
+        mock_api.add("cases", {"id": CASE_ID, "name": "Steel", "reference": "AD0001"})
+
+        case = client.cases(CASE_ID, fields=["name"])
+        assert case.name == "Steel"
+        other = client.cases(CASE_ID, fields=["reference"])
+        assert other is not case
+        assert other.reference == "AD0001"
+        assert client.cases(CASE_ID, fields=["reference"]) is other
+
+    def test_unsaved_changes_survive_a_relist(self, mock_api, client):
+        mock_api.add("cases", {"id": CASE_ID, "name": "Steel"})
+
+        case = client.cases()[0]
+        case.name = "Aluminium"
+        assert client.cases()[0] is case
+
+        assert case.name == "Aluminium"
+        assert case.changed_data == {"name": "Aluminium"}
+
+    def test_objects_are_weakly_referenced(self, mock_api, client):
+        mock_api.generate("cases", 3)
+
+        cases = client.cases()
+        assert len(client.identity_map) == 3
+        del cases
+        assert len(client.identity_map) == 0
+
+
+class TestLazyLoading:
+    def test_loaded_once_across_threads(self, monkeypatch, client):
+        with MockAPIServer(latency=0.05) as server:
+            monkeypatch.setattr(settings, "API_BASE_URL", server.url)
+            server.add("cases", {"id": CASE_ID, "name": "Steel"})
+            case = client.cases(CASE_ID)
+            assert not case.is_loaded
+
+            names = []
+            threads = [
+                threading.Thread(target=lambda: names.append(case.name)) for _ in range(8)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        assert names == ["Steel"] * 8
+        assert server.requests == [("GET", f"/api/v2/cases/{CASE_ID}/")]
+        assert case.is_loaded
+
+    def test_objects_sharing_a_lock_load_concurrently(self, monkeypatch, client):
+        cases = [client.cases.make_trs_object(str(uuid.uuid4()), lazy=True) for _ in range(200)]
+        by_lock = {}
+        for case in cases:
+            by_lock.setdefault(get_load_lock(case), []).append(case)
+        first, second = next(each for each in by_lock.values() if len(each) > 1)[:2]
+        # each request only returns once both are being made
+        barrier = threading.Barrier(2, timeout=2)
+
+        def get(url, **kwargs):
+            barrier.wait()
+            return {"name": "Steel"}
+
+        monkeypatch.setattr(first.api_client, "get", get)
+        thread = threading.Thread(target=first.prefetch)
+        thread.start()
+        second.prefetch()
+        thread.join()
+
+        assert first.name == second.name == "Steel"
+
+    def test_empty_responses_are_not_retrieved_again(self, client):
+        adapter = ReplayAdapter()
+        adapter.add("GET", f"/api/v2/cases/{CASE_ID}/", {})
+        mount_on_client(client, adapter)
+
+        case = client.cases(CASE_ID)
+        assert "name" not in case
+        assert "name" not in case
+        assert adapter.requests == [("GET", f"/api/v2/cases/{CASE_ID}/")]
+
+    def test_prefetch(self, client):
+        adapter = ReplayAdapter()
+        mount_on_client(client, adapter)
+        case = client.cases(CASE_ID)
+
+        # failures aren't cached
+        with pytest.raises(UnexpectedError):
+            case.prefetch()
+        assert not case.is_loaded
+
+        adapter.add("GET", f"/api/v2/cases/{CASE_ID}/", {"id": CASE_ID, "name": "Steel"})
+        assert case.prefetch() is case
+        assert case.is_loaded
+        assert case.name == "Steel"
+        assert len(adapter.requests) == 2
+
+        other_case = client.cases(CASE_ID)
+        results = client.cases.prefetch([case, other_case])
+        assert [each.item for each in results] == [other_case]
+        assert other_case.is_loaded
+
+
+class TestTRSObjectLayout:
+    def test_objects_are_slotted(self, client):
+        case = client.cases.make_trs_object(CASE_ID, data={"id": CASE_ID, "name": "Steel"})
+
+        assert "__dict__" not in dir(type(case))
+        assert case.retrieval_url == f"cases/{CASE_ID}"
+        with pytest.raises(AttributeError):
+            case._private = 1
+
+    def test_library_objects_are_slotted(self):
+        from v2_api_client.library import cases, contacts, organisations, submissions, users
+
+        object_classes = [
+            each
+            for module in (cases, contacts, organisations, submissions, users)
+            for each in vars(module).values()
+            if isinstance(each, type) and issubclass(each, TRSObject) and each is not TRSObject
+        ]
+        assert object_classes
+        assert all("__dict__" not in dir(each) for each in object_classes)
+
+    def test_lazy_objects_without_a_retrieval_url(self, mock_api, client):
+        mock_api.add("cases", {"id": CASE_ID, "name": "Steel"})
+
+        assert client.cases.make_trs_object(CASE_ID, lazy=True).name == "Steel"
+
+
+class TestAdaptiveLimiter:
+    @pytest.fixture
+    def adaptive_limiter(self):
+        return limiter.AdaptiveLimiter(
+            initial_limit=4, max_wait=0.05, registry=instrumentation.MetricsRegistry()
+        )
+
+    def test_aimd(self, adaptive_limiter):
+        for _ in range(4):
+            adaptive_limiter.acquire()
+            adaptive_limiter.release(limiter.classify(), 0.01)
+        assert adaptive_limiter.limit == pytest.approx(5, abs=0.1)
+
+        adaptive_limiter.acquire()
+        adaptive_limiter.release(limiter.classify(RateLimitedError()), 0.01)
+        assert adaptive_limiter.allowed_in_flight == 2
+        assert adaptive_limiter.rate is not None
+        # 429s from requests that were already in flight only count once
+        adaptive_limiter.max_wait = 1
+        adaptive_limiter.acquire()
+        adaptive_limiter.release(limiter.THROTTLED, 0.01)
+        assert adaptive_limiter.allowed_in_flight == 2
+        assert adaptive_limiter.backoffs.get() == 1
+
+    def test_slow_requests_shrink_the_limit(self, adaptive_limiter):
+        adaptive_limiter.latency_target = 0.1
+        adaptive_limiter.acquire()
+        adaptive_limiter.release(limiter.SUCCESS, 0.5)
+
+        assert adaptive_limiter.limit == pytest.approx(3.6)
+        assert adaptive_limiter.rate is None
+
+    def test_waits_for_the_limit(self, adaptive_limiter):
+        for _ in range(4):
+            adaptive_limiter.acquire()
+        with pytest.raises(RateLimitedError):
+            adaptive_limiter.acquire()
+
+        threading.Timer(0.01, adaptive_limiter.release, (limiter.IGNORED, 0.01)).start()
+        adaptive_limiter.max_wait = 1
+        adaptive_limiter.acquire()
+        assert adaptive_limiter.in_flight == 4
+
+    def test_backoffs_are_shared_through_the_cache(self):
+        cache.clear()
+        first, second = (
+            limiter.AdaptiveLimiter(
+                initial_limit=8, cache="default", registry=instrumentation.MetricsRegistry()
+            )
+            for _ in range(2)
+        )
+        first.acquire()
+        first.release(limiter.TIMEOUT, 2)
+
+        second.acquire()
+        assert second.as_dict() == {"limit": 4, "in_flight": 1, "rate": first.rate}
+        cache.clear()
+
+    def test_clients_use_the_shared_limiter(self, monkeypatch, client):
+        monkeypatch.setattr(
+            settings,
+            "API_ADAPTIVE_LIMITER",
+            {"initial_limit": 8, "cooldown": 0, "min_rate": 100},
+            raising=False,
+        )
+        limiter.reset_limiter()
+        try:
+            with MockAPIServer(throttle_rate=0.5, seed=1) as server:
+                monkeypatch.setattr(settings, "API_BASE_URL", server.url)
+                for _ in range(10):
+                    try:
+                        client.cases()
+                    except RateLimitedError:
+                        pass
+            shared_limiter = limiter.get_limiter()
+            assert shared_limiter.allowed_in_flight < 8
+            assert shared_limiter.in_flight == 0
+            assert "trs_api_client_limiter_limit" in instrumentation.metrics.render()
+        finally:
+            limiter.reset_limiter()
+
+
+class TestHedging:
+    @pytest.fixture
+    def slow_once(self, mock_api):
+        """get_status takes half a second the first time it's called."""
+        mock_api.add("cases", {"id": CASE_ID, "name": "Steel"})
+        calls = []
+
+        def get_status(method, obj, data, query):
+            calls.append(method)
+            if len(calls) == 1:
+                time.sleep(0.5)
+            return {"stage": len(calls)}
+
+        mock_api.add_action("cases", "get_status", get_status)
+        return calls
+
+    def get_client(self, **kwargs):
+        policy = hedging.HedgePolicy(registry=instrumentation.MetricsRegistry(), **kwargs)
+        return TRSAPIClient(token="test", hedge=policy), policy
+
+    def test_slow_requests_are_hedged(self, slow_once):
+        client, policy = self.get_client(delay=0.05, budget=1)
+
+        start = time.perf_counter()
+        # the hedge's response wins
+        assert client.cases.make_trs_object(CASE_ID, lazy=True).get_status() == {"stage": 2}
+        assert time.perf_counter() - start < 0.4
+        assert policy.hedges.get(endpoint="cases/{id}/get_status", won=True) == 1
+
+    def test_hedges_are_limited_by_the_budget(self, slow_once):
+        client, policy = self.get_client(delay=0.05, budget=0.5)
+
+        assert client.cases.make_trs_object(CASE_ID, lazy=True).get_status() == {"stage": 1}
+        assert slow_once == ["GET"]
+
+    def test_busy_executor_is_not_waited_for(self, monkeypatch, slow_once):
+        executor = BackgroundExecutor(max_workers=1)
+        monkeypatch.setattr(hedging, "get_shared_executor", lambda: executor)
+        client, policy = self.get_client(delay=0.05, budget=1)
+        busy = threading.Event()
+        assert executor.try_submit(busy.wait) is not None
+        assert executor.try_submit(busy.wait) is None
+
+        # made on the calling thread, unhedged
+        assert client.cases.make_trs_object(CASE_ID, lazy=True).get_status() == {"stage": 1}
+        assert slow_once == ["GET"]
+        busy.set()
+        executor.shutdown()
+
+    def test_delay_is_the_observed_percentile(self):
+        policy = hedging.HedgePolicy(
+            min_samples=4, percentile=75, registry=instrumentation.MetricsRegistry()
+        )
+        for latency in (0.1, 0.2, 0.3):
+            policy.record("cases/{id}", latency)
+        assert policy.get_delay("cases/{id}") is None
+
+        policy.record("cases/{id}", 0.4)
+        assert policy.get_delay("cases/{id}") == 0.4
+
+    def test_only_opted_in_clients_are_hedged(self, monkeypatch):
+        assert TRSAPIClient(token="test").cases.hedge_policy is None
+        assert TRSAPIClient(token="test", hedge=True).cases.hedge_policy is not None
+
+        monkeypatch.setattr(settings, "API_HEDGED_REQUESTS", {"budget": 0.01}, raising=False)
+        policy = TRSAPIClient(token="test").cases.hedge_policy
+        assert policy.budget == 0.01
+        assert TRSAPIClient(token="test").users.hedge_policy is policy
+        assert TRSAPIClient(token="test", hedge=False).cases.hedge_policy is None
+
+
+class TestCompression:
+    def test_accept_encoding(self, monkeypatch, client):
+        assert "gzip" in client.cases.get_session().headers["Accept-Encoding"]
+
+        monkeypatch.setattr(settings, "API_ACCEPT_ENCODING", "identity", raising=False)
+        assert compression.get_accept_encoding() == "identity"
+
+    def test_compressed_responses(self, mock_api, client):
+        mock_api.compress_responses = True
+        mock_api.generate("cases", 20)
+
+        assert len(client.cases()) == 20
+
+    def test_big_request_bodies_are_compressed(self, monkeypatch, mock_api, client):
+        monkeypatch.setattr(settings, "API_COMPRESS_REQUEST_BODIES_OVER", 100, raising=False)
+
+        client.cases({"name": "Steel"})
+        assert mock_api.compressed_request_bodies == 0
+
+        case = client.cases({"name": "Steel", "description": "x" * 200})
+        assert mock_api.compressed_request_bodies == 1
+        assert mock_api.resources["cases"][case.id]["description"] == "x" * 200
@@ -0,0 +1,221 @@
+"""The HTTP layer of the API client, the request strategy and requests adapters used by
+BaseAPIClient.
+
+Every BaseAPIClient has its own requests session (so cookies are never shared between users),
+but the sessions all mount the same adapter, so connections to the API are pooled process-wide.
+The pool size is set by the API_CONNECTION_POOL_SIZE setting, default 10.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from apiclient.request_strategies import RequestStrategy
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.connection import HTTPConnection, HTTPSConnection
+
+from v2_api_client import instrumentation
+from v2_api_client.compression import compress_request_body, get_accept_encoding
+from v2_api_client.limiter import get_limiter, reset_limiter
+
+# connection timings are recorded by the connection classes below, which have no way of knowing
+# which request they are for, but a request is made from start to finish on the one thread
+_connection_timings = threading.local()
+
+
+class TimedConnectionMixin:
+    def _new_conn(self):
+        start = time.perf_counter()
+        try:
+            return super()._new_conn()
+        finally:
+            _connection_timings.connect_time = time.perf_counter() - start
+
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        _connection_timings.tls_time = max(
+            time.perf_counter() - start - getattr(_connection_timings, "connect_time", 0), 0
+        )
+
+
+class TimedHTTPConnection(TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """A requests HTTPAdapter whose connections record how long they took to open, and which
+    compresses big request bodies if that's enabled, see v2_api_client.compression."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TimedHTTPConnectionPool,
+            "https": TimedHTTPSConnectionPool,
+        }
+
+    def send(self, request, *args, **kwargs):
+        compress_request_body(request)
+        return super().send(request, *args, **kwargs)
+
+
+def reset_connection_timings():
+    _connection_timings.connect_time = 0
+    _connection_timings.tls_time = 0
+
+
+_shared_adapter = None
+_shared_session = None
+_shared_executor = None
+_shared_lock = threading.RLock()
+
+
+def get_shared_adapter() -> TimedHTTPAdapter:
+    """Returns the adapter (and so the connection pool) shared by every client in this
+    process."""
+    global _shared_adapter
+    if _shared_adapter is None:
+        with _shared_lock:
+            if _shared_adapter is None:
+                pool_size = getattr(settings, "API_CONNECTION_POOL_SIZE", 10)
+                _shared_adapter = TimedHTTPAdapter(
+                    pool_connections=pool_size, pool_maxsize=pool_size
+                )
+    return _shared_adapter
+
+
+def get_shared_session() -> requests.Session:
+    """Returns a process-wide session using the shared adapter, for requests that aren't made
+    by a BaseAPIClient, e.g. the health check. It never stores cookies."""
+    global _shared_session
+    if _shared_session is None:
+        with _shared_lock:
+            if _shared_session is None:
+                session = requests.Session()
+                session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                _shared_session = mount_adapters(session)
+    return _shared_session
+
+
+class BackgroundExecutor(ThreadPoolExecutor):
+    """A thread pool that turns work down rather than queueing it, see try_submit()."""
+
+    def __init__(self, max_workers: int, **kwargs):
+        super().__init__(max_workers=max_workers, **kwargs)
+        self.idle_workers = threading.BoundedSemaphore(max_workers)
+
+    def try_submit(self, function, *args):
+        """Runs function(*args) if a worker is free, returns its Future, or None if they are
+        all busy, so the caller can do without (or do it itself) rather than wait in a queue."""
+        if not self.idle_workers.acquire(blocking=False):
+            return None
+        try:
+            future = self.submit(function, *args)
+        except BaseException:
+            self.idle_workers.release()
+            raise
+        future.add_done_callback(lambda _: self.idle_workers.release())
+        return future
+
+
+def get_shared_executor() -> BackgroundExecutor:
+    """Returns a process-wide thread pool for requests made in the background, e.g. hedged
+    requests. Its size is set by the API_SHARED_EXECUTOR_MAX_WORKERS setting, default 32.
+
+    Work is only ever added with try_submit(), so a busy pool never delays a request, callers
+    that fan out (e.g. get_concurrently() or the bulk methods) just hedge less."""
+    global _shared_executor
+    if _shared_executor is None:
+        with _shared_lock:
+            if _shared_executor is None:
+                _shared_executor = BackgroundExecutor(
+                    max_workers=getattr(settings, "API_SHARED_EXECUTOR_MAX_WORKERS", 32),
+                    thread_name_prefix="trs-api-client",
+                )
+    return _shared_executor
+
+
+def reset_shared_transport() -> None:
+    """Closes the pooled connections, e.g. in a worker after a fork, as connections must never
+    be shared between processes. New connections are opened as they are needed."""
+    if _shared_adapter is not None:
+        _shared_adapter.close()
+    # its lock may have been held by another thread at the time of the fork
+    reset_limiter()
+    # and its threads don't survive one
+    global _shared_executor
+    _shared_executor = None
+
+
+def mount_adapters(session, adapter=None):
+    """Mounts adapter, by default the shared one, for both http:// and https:// on a
+    session, and asks for compressed responses, see v2_api_client.compression."""
+    adapter = adapter or get_shared_adapter()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["Accept-Encoding"] = get_accept_encoding()
+    return session
+
+
+class TRSRequestStrategy(RequestStrategy):
+    """The request strategy used by BaseAPIClient, makes the request and notifies any
+    registered instrumentation observers about it.
+
+    If the adaptive limiter is enabled, every request waits for it first, see
+    v2_api_client.limiter."""
+
+    def _make_request(self, request_method, endpoint: str, **kwargs):
+        limiter = get_limiter()
+        if limiter is None:
+            return self._make_observed_request(request_method, endpoint, **kwargs)
+        with limiter.request():
+            return self._make_observed_request(request_method, endpoint, **kwargs)
+
+    def _make_observed_request(self, request_method, endpoint: str, **kwargs):
+        if not instrumentation.has_observers():
+            return super()._make_request(request_method, endpoint, **kwargs)
+
+        event = instrumentation.RequestEvent(
+            method=request_method.__name__.upper(),
+            url=endpoint,
+            base_endpoint=getattr(self.get_client(), "base_endpoint", None),
+        )
+
+        def timed_request_method(*args, **request_kwargs):
+            reset_connection_timings()
+            response = request_method(*args, **request_kwargs)
+            event.status_code = response.status_code
+            event.response_bytes = len(response.content)
+            # elapsed is the time between sending the request and parsing the response headers
+            event.ttfb = response.elapsed.total_seconds()
+            event.connect_time = _connection_timings.connect_time
+            event.tls_time = _connection_timings.tls_time
+            # made by urllib3, if the adapter was given max_retries
+            if retries := getattr(response.raw, "retries", None):
+                event.retries = len(retries.history)
+            return response
+
+        start = time.perf_counter()
+        try:
+            return super()._make_request(timed_request_method, endpoint, **kwargs)
+        except Exception as exc:
+            event.exception = exc
+            raise
+        finally:
+            event.total_time = time.perf_counter() - start
+            instrumentation.notify_request_finished(event)
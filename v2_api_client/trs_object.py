@@ -1,10 +1,41 @@
 from __future__ import annotations
 
+import threading
+import time
+
 from apiclient.utils.typing import OptionalDict
-from django.core.serializers.json import DjangoJSONEncoder
 from dotwiz import DotWiz
 
+from v2_api_client import instrumentation
 from v2_api_client.decoders import encode
+from v2_api_client.json_backends import (
+    TRSJsonRequestFormatter,
+    get_django_json_encoder,
+    get_json_backend,
+)
+
+
+class _DjangoJSONEncoderDescriptor:
+    """Returns DjangoJSONEncoder, which is only imported when it's first needed."""
+
+    def __get__(self, instance, owner):
+        return type(get_django_json_encoder())
+
+
+# changes to the data of an object are made under one of a fixed set of locks, a lock per object
+# would make every TRSObject bigger. They're only held for the change itself, not the request
+_load_locks = [threading.Lock() for _ in range(64)]
+# id() of the objects being lazily loaded, to the Event set once the load is done
+_loads_in_flight = {}
+
+
+def get_load_lock(trs_object) -> threading.Lock:
+    # the low bits of an id() are always the same, objects are aligned in memory
+    return _load_locks[(id(trs_object) >> 4) % len(_load_locks)]
+
+
+# methods of the data that use all of it, see TRSObject.get_projected_data_dict()
+WHOLE_OBJECT_METHODS = frozenset({"keys", "values", "items", "copy", "to_dict"})
 
 
 class TRSObject:
@@ -25,27 +56,67 @@ class TRSObject:
 
     submission.update({"type": {submission_type_id}}) --> Newly updated submission TRSObject.
 
+    Or change its fields and save() it, which only sends the fields that were changed:
+
+    submission.status = "draft"
+    submission["deficiency_notice_params"] = {...}
+    submission.save() --> the same TRSObject, updated with the response
+
     The TRSObject also makes calling custom actions (those defined by an @action decorator in the
     API) easy. Furthermore, lazy loading is used to reduce unnecessary calls to the API, by passing
     a TRSObject a retrieval_url instead of actual response data, the object will only contact the
     API when strictly necessary (for example when accessing the DotWiz data).
     """
 
-    object_id = None
-    encoder = DjangoJSONEncoder
+    # every attribute of the object itself is declared here, assigning to any other name sets
+    # (and records a change to) that field of the data instead. Slotted, as lists of tens of
+    # thousands of objects are common, subclasses must declare __slots__ = () to stay that way.
+    # All of them are set in __init__, a missing slot would be looked up in the data
+    __slots__ = (
+        "lazy",
+        "api_client",
+        "object_id",
+        "_retrieval_url",
+        "changed_data",
+        # set when the object was retrieved with automatic field projection, see
+        # v2_api_client.projection
+        "projection",
+        "projected",
+        # True when the data only has some of the object's fields, e.g. it was retrieved with
+        # fields
+        "_partial",
+        # True once the data of a lazy object has been retrieved, even if it was empty
+        "_loaded",
+        "_data",
+        # see v2_api_client.identity_map
+        "__weakref__",
+    )
+    encoder = _DjangoJSONEncoderDescriptor()
 
     def __init__(self, *args, **kwargs):
-        self.lazy = kwargs.pop("lazy", None)
-        if self.lazy:
-            self._data = {}
+        # bypasses __setattr__, which would double the time it takes to make an object
+        set_attribute = super().__setattr__
+        lazy = kwargs.pop("lazy", None)
+        projection = kwargs.pop("projection", None)
+        set_attribute("lazy", lazy)
+        set_attribute("api_client", kwargs.pop("api_client", None))
+        set_attribute("object_id", kwargs.pop("object_id", None))
+        set_attribute("_retrieval_url", kwargs.pop("retrieval_url", None))
+        set_attribute("changed_data", {})
+        set_attribute("projection", projection)
+        set_attribute("projected", projection is not None and projection.fields is not None)
+        set_attribute("_partial", False)
+
+        if lazy:
+            set_attribute("_loaded", False)
+            set_attribute("_data", {})
         else:
-            self._data = DotWiz(kwargs.pop("data"))
-            self.encode_nested_dict(self._data)
-
-        self.api_client = kwargs.pop("api_client", None)
-        self.object_id = kwargs.pop("object_id", None)
-        self.retrieval_url = kwargs.pop("retrieval_url", None)
-        self.changed_data = {}
+            start = time.perf_counter()
+            data = DotWiz(kwargs.pop("data"))
+            self.encode_nested_dict(data)
+            set_attribute("_loaded", True)
+            set_attribute("_data", data)
+            self.notify_observers("decode", time.perf_counter() - start)
 
         super().__init__(*args, **kwargs)
 
@@ -54,15 +125,76 @@ class TRSObject:
         try:
             return super().__getattribute__(item)
         except AttributeError:
-            return getattr(self.data_dict, item)
+            return getattr(self.get_projected_data_dict(item), item)
 
     def __getitem__(self, item):
         """Allows for data_dict lookup through self["key_name"]"""
-        return self.data_dict[item]
+        return self.get_projected_data_dict(item)[item]
+
+    def __setattr__(self, key, value):
+        """Allows for changing the data through self.{key_name} = value, see set_field()."""
+        if key.startswith("_") or hasattr(type(self), key):
+            super().__setattr__(key, value)
+        else:
+            self.set_field(key, value)
+
+    def __setitem__(self, key, value):
+        """Allows for changing the data through self["key_name"] = value, see set_field()."""
+        self.set_field(key, value)
+
+    def set_field(self, key: str, value) -> None:
+        """Changes a field of this object, recording the change to be sent by save().
+
+        Only whole fields are tracked, changes made inside a nested dict or list (e.g.
+        self.type.name = "...") aren't recorded, assign the whole field instead.
+        """
+        self.changed_data[key] = value
+        if self.is_loaded:
+            # a lazy object that hasn't been loaded yet gets the change applied once it is
+            self._data[key] = DotWiz(value) if isinstance(value, dict) else value
 
     def __contains__(self, item):
         """Allows for 'if x in self' statements"""
-        return item in self.data_dict
+        return item in self.get_projected_data_dict(item)
+
+    def __iter__(self):
+        """Allows for 'for key in self' loops, over the keys of the data"""
+        return iter(self.data_dict)
+
+    def get_projected_data_dict(self, item):
+        """Returns the data_dict to look item up in.
+
+        If this object was retrieved with field projection, the access is recorded, and if item
+        wasn't one of the projected fields, the object is first re-fetched in full.
+        """
+        data_dict = self.load_data()
+        if self.projection is None or not isinstance(item, str) or item.startswith("_"):
+            return data_dict
+
+        if item in WHOLE_OBJECT_METHODS and item not in data_dict:
+            # e.g. self.items(), every field is used
+            return self.data_dict
+
+        if item not in data_dict and self.projected:
+            data_dict = self.load_unprojected()
+        if item in data_dict:
+            self.projection.record(item)
+        return data_dict
+
+    def load_unprojected(self):
+        """Re-fetches all the fields of an object that was retrieved with field projection,
+        along with every other object retrieved by the same call, see
+        Projection.get_unprojected_data()."""
+        data = self.projection.get_unprojected_data(self.api_client, self.object_id)
+        if data is None:
+            # e.g. it's no longer in the list
+            url = self.api_client.url(self.api_client.get_retrieve_endpoint(self.object_id))
+            data = self.api_client.get(url)
+        data = DotWiz(data)
+        self.encode_nested_dict(data)
+        self._data.update(data)
+        self.projected = False
+        return self._data
 
     def __repr__(self):
         """Generates a string representation of this object using the base_endpoint defined in the
@@ -111,24 +243,126 @@ class TRSObject:
 
     @property
     def data_dict(self):
-        """Wrapped in a property to allow for lazy retrieval from the API.
+        """All of this object's data, wrapped in a property to allow for lazy retrieval from the
+        API, see load_data().
+
+        If this object was retrieved with field projection, it's re-fetched in full, and the call
+        site that retrieved it stops being projected, there's no telling which fields it uses.
+        """
+        data_dict = self.load_data()
+        if self.projection is not None:
+            self.projection.record_all()
+            if self.projected:
+                data_dict = self.load_unprojected()
+        return data_dict
+
+    def load_data(self):
+        """Returns this object's data, retrieving it first if it's a lazy object.
 
         First checks if this is a lazy object and if the API has not been contacted yet, if so,
         it will make the request and save the response in the private _data attribute.
 
         If the ._data attribute exists, it just returns that instead.
+
+        The request is only made once, even if several threads access the object at the same
+        time, and an empty response isn't requested again. A failed request is retried on the
+        next access.
         """
-        if self._data:
+        if self._loaded or not (self.lazy and self.retrieval_url):
             return self._data
 
-        if self.lazy and self.retrieval_url:
-            data = DotWiz(self.api_client.get(self.retrieval_url))
-            self._data = data
-            self.object_id = data["id"]
-            self.encode_nested_dict(self._data)
+        lock = get_load_lock(self)
+        while not self._loaded:
+            with lock:
+                if self._loaded:
+                    break
+                in_flight = _loads_in_flight.get(id(self))
+                loading = in_flight is None
+                if loading:
+                    in_flight = _loads_in_flight[id(self)] = threading.Event()
+
+            if not loading:
+                # another thread is loading it, if that fails this one tries again
+                in_flight.wait()
+                continue
+            try:
+                self.load_lazy_data(lock)
+            finally:
+                with lock:
+                    del _loads_in_flight[id(self)]
+                in_flight.set()
 
         return self._data
 
+    def load_lazy_data(self, lock: threading.Lock) -> None:
+        """Retrieves the data of a lazy object, without holding lock while the request is made."""
+        start = time.perf_counter()
+        data = DotWiz(self.api_client.get(self.get_absolute_retrieval_url()))
+        self.encode_nested_dict(data)
+        with lock:
+            # unless merge() has loaded it in the meantime
+            if not self._loaded:
+                if "id" in data:
+                    self.object_id = data["id"]
+                self._data = data
+                self.apply_changed_data()
+                self._loaded = True
+        self.notify_observers("lazy_load", time.perf_counter() - start)
+
+    @property
+    def retrieval_url(self) -> str:
+        """The URL this object is retrieved from, if it wasn't given one, the path of its retrieve
+        endpoint (worked out when it's needed, rather than stored for every object in a list)."""
+        if self._retrieval_url is None and self.object_id is not None and self.api_client:
+            return self.api_client.get_retrieve_endpoint(self.object_id)
+        return self._retrieval_url
+
+    @retrieval_url.setter
+    def retrieval_url(self, value: str) -> None:
+        self._retrieval_url = value
+
+    def get_absolute_retrieval_url(self) -> str:
+        url = self.retrieval_url
+        if "://" not in url:
+            # objects from _get_many() and _post() only have the endpoint path
+            url = self.api_client.url(url)
+        return url
+
+    @property
+    def is_loaded(self) -> bool:
+        """True if this object's data has been retrieved (always True if it isn't lazy)."""
+        return self._loaded or not self.lazy
+
+    def has_fields(self, fields: set) -> bool:
+        """True if this object has (or will have once it's loaded) all of fields."""
+        if self.is_loaded:
+            return fields <= self._data.keys()
+        retrieved_fields = self.api_client.get_url_fields(self.retrieval_url)
+        return retrieved_fields is not None and fields <= retrieved_fields
+
+    def prefetch(self) -> TRSObject:
+        """Retrieves the data of a lazy object now, rather than when it's first accessed, e.g. from
+        a worker thread. Returns self."""
+        self.load_data()
+        return self
+
+    def apply_changed_data(self) -> None:
+        """Re-applies the unsaved changes on top of freshly loaded data."""
+        for key, value in self.changed_data.items():
+            self._data[key] = DotWiz(value) if isinstance(value, dict) else value
+
+    def notify_observers(self, action: str, duration: float) -> None:
+        """Lets any registered instrumentation observers know how long an action took."""
+        if instrumentation.has_observers():
+            instrumentation.notify_object_event(
+                instrumentation.ObjectEvent(
+                    action=action,
+                    base_endpoint=getattr(self.api_client, "base_endpoint", None),
+                    object_id=self.object_id,
+                    duration=duration,
+                )
+            )
+
     def custom_action(
         self,
         method: str,
@@ -154,20 +388,9 @@ class TRSObject:
         TRSObject or a list of them. Typically... All of the custom actions in the API should
         return a single object or a list of them, this is NOT guaranteed.
         """
-        request_method = getattr(self.api_client, method)
-        url = self.api_client.url(
-            self.api_client.get_retrieve_endpoint(self.object_id, action_name),
-            fields=fields,
-            params=params,
+        return self.api_client.custom_action(
+            self.object_id, method, action_name, data=data, fields=fields, params=params
         )
-        if method in ["GET", "get"]:
-            response = request_method(url)
-        else:
-            if not data:
-                data = dict()
-            response = request_method(url, data=data)
-
-        return response
 
     def update(self, data: dict, fields: list = None) -> TRSObject:
         """
@@ -184,6 +407,64 @@ class TRSObject:
         """
         return self.api_client.update(self.object_id, data, fields=fields)
 
+    def get_update_url(self, fields: list = None) -> str:
+        """Returns the URL to PATCH this object with."""
+        return self.api_client.url(
+            self.api_client.get_retrieve_endpoint(self.object_id), fields=fields
+        )
+
+    def save(self, fields: list = None) -> TRSObject:
+        """
+        Sends a PATCH request to the API with only the fields that have been changed, and merges
+        the response into this object in-place.
+
+        Parameters
+        ----------
+        fields : what fields you want returned in the response, e.g. ["id"] if you don't need the
+        updated object back
+
+        Returns
+        -------
+        self
+        """
+        if not self.changed_data:
+            return self
+
+        changed_data = self.changed_data
+        kwargs = {}
+        if any(isinstance(value, (dict, list)) for value in changed_data.values()) and not (
+            issubclass(self.api_client.get_request_formatter(), TRSJsonRequestFormatter)
+        ):
+            # nested values can't be form-encoded
+            changed_data = get_json_backend().dumps_bytes(changed_data)
+            kwargs["headers"] = {"Content-Type": "application/json"}
+        data = self.api_client.patch(
+            self.get_update_url(fields=fields), data=changed_data, **kwargs
+        )
+        self.changed_data = {}
+        if data:
+            self.merge(data, partial=bool(fields))
+        return self
+
+    def merge(self, data: dict, partial: bool = False) -> None:
+        """Merges newer response data for this object into it.
+
+        partial is True when data only has some of the fields, in which case a lazy object that
+        hasn't been loaded yet is left to load in full when it's next accessed.
+        """
+        data = DotWiz(data)
+        self.encode_nested_dict(data)
+        self._partial = self._partial and partial
+        with get_load_lock(self):
+            if self.is_loaded:
+                self._data.update(data)
+                # the unsaved changes still win over the server's values
+                self.apply_changed_data()
+            elif not partial:
+                self._data = data
+                self.apply_changed_data()
+                self._loaded = True
+
     def delete(self):
         """Deletes this object."""
         return self.api_client.delete_object(self.object_id)
@@ -202,11 +483,17 @@ class TRSObject:
         -------
         self
         """
-        if remove_query_params:
-            url = self.api_client.get_retrieve_endpoint(object_id=self.object_id)
+        if remove_query_params or not self.retrieval_url:
+            url = self.api_client.url(
+                self.api_client.get_retrieve_endpoint(object_id=self.object_id)
+            )
         else:
-            url = self.retrieval_url
-        refreshed_object = self.api_client._get(url=url, object_id=self.object_id)
-        self.data = refreshed_object.data
+            url = self.get_absolute_retrieval_url()
+        data = DotWiz(self.api_client.get(url))
+        self.encode_nested_dict(data)
+        with get_load_lock(self):
+            self._data = data
+            self._loaded = True
+        self._partial = self.api_client.is_partial_url(url)
         self.changed_data = {}
         return self
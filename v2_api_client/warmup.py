@@ -0,0 +1,124 @@
+"""Warms up a freshly started (or forked) worker, so its first requests are as fast as the rest.
+
+warm_up() opens API_WARMUP_CONNECTIONS (default 0) pooled connections to the API, paying for
+the DNS lookups and TCP/TLS handshakes up front, and GETs the paths in API_WARMUP_PRELOAD
+(e.g. ["feature_flags", "document_bundles"], see preload()) so they are in the response cache, see
+v2_api_client.cache.ResponseCache. Only shared base_endpoints (API_RESPONSE_CACHE_SHARED) are worth
+preloading, the others are cached per user.
+
+With gunicorn, call it from a post_fork hook in gunicorn.conf.py, connections opened before the
+fork must never be shared between workers:
+
+from v2_api_client.warmup import post_fork
+
+Otherwise, set API_WARMUP_ON_STARTUP = True and add "v2_api_client" to INSTALLED_APPS to warm
+up in a background thread when Django starts.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from v2_api_client.library import BaseAPIClient
+from v2_api_client.transport import (
+    get_shared_adapter,
+    get_shared_session,
+    reset_shared_transport,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def open_connections(count: int, timeout: float = 2.0) -> int:
+    """Opens count connections to the API in the shared pool by making that many health
+    checks at the same time. Returns the number that succeeded."""
+    # any more than the pool holds would be closed as soon as they were returned to it
+    count = min(count, get_shared_adapter()._pool_maxsize)
+    if count <= 0:
+        return 0
+    url = f"{settings.API_BASE_URL}/healthcheck"
+    # the requests all wait for each other, so none of them can reuse another's connection
+    barrier = threading.Barrier(count)
+
+    def open_connection(_):
+        try:
+            barrier.wait(timeout=timeout)
+        except threading.BrokenBarrierError:
+            pass
+        get_shared_session().get(url, timeout=timeout)
+
+    opened = 0
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        futures = [executor.submit(open_connection, each) for each in range(count)]
+        for future in futures:
+            try:
+                future.result()
+                opened += 1
+            except Exception as exc:
+                logger.warning("Could not open a connection to the API: %s", exc)
+    return opened
+
+
+def preload(paths: list, client=None) -> list:
+    """GETs each of paths, e.g. "feature_flags", so the responses are in the response cache.
+    The first part of each path is either the name of one of the object clients of a
+    TRSAPIClient or its base_endpoint. Returns the paths loaded."""
+    if client is None:
+        from v2_api_client.client import TRSAPIClient
+
+        client = TRSAPIClient(token=settings.HEALTH_CHECK_TOKEN)
+    api_clients = {}
+    for name, api_client in vars(client).items():
+        if isinstance(api_client, BaseAPIClient):
+            api_clients[name] = api_clients[api_client.get_base_endpoint()] = api_client
+
+    preloaded = []
+    for path in paths:
+        name, _, rest = path.partition("/")
+        api_client = api_clients.get(name)
+        if api_client is None:
+            logger.warning("No API client found to preload %s", path)
+            continue
+        try:
+            api_client.get(
+                api_client.url("/".join(filter(None, [api_client.get_base_endpoint(), rest])))
+            )
+            preloaded.append(path)
+        except Exception as exc:
+            logger.warning("Could not preload %s: %s", path, exc)
+    return preloaded
+
+
+def warm_up(connections: int = None, paths: list = None) -> dict:
+    """Opens pooled connections to the API and preloads the response cache, connections and
+    paths default to the API_WARMUP_CONNECTIONS and API_WARMUP_PRELOAD settings. Never raises,
+    failures are logged."""
+    if connections is None:
+        connections = getattr(settings, "API_WARMUP_CONNECTIONS", 0)
+    if paths is None:
+        paths = getattr(settings, "API_WARMUP_PRELOAD", [])
+
+    start = time.perf_counter()
+    summary = {
+        "connections": open_connections(connections),
+        "preloaded": preload(paths) if paths else [],
+    }
+    summary["duration"] = time.perf_counter() - start
+    logger.info(
+        "Warmed up %s connections to the API and preloaded %s in %.1fms",
+        summary["connections"],
+        summary["preloaded"],
+        summary["duration"] * 1000,
+        extra={"api_warmup": summary},
+    )
+    return summary
+
+
+def post_fork(server, worker) -> None:
+    """A gunicorn post_fork hook, drops any connections inherited from the master process and
+    warms up the new worker."""
+    reset_shared_transport()
+    warm_up()